@@ -0,0 +1,220 @@
+""" Module providing an asyncio (ASGI) serving mode for the covid data dashboard.
+Connections are handled by coroutines on one event loop rather than a thread
+per request. The dashboard's views, which read the local data store and news
+file, run on a small bounded pool of threads, so however many clients are
+connected only that many threads do blocking work. Requests are served the
+saved data straight away. Only a dashboard page requested before any covid data
+has been stored waits for the running refresh, and it waits without holding a
+thread. Changes are pushed to browsers at /events. Each connection is a
+coroutine waiting on one shared future, so thousands of idle connections cost
+no threads and one wake up for each event.
+Upstream api requests are never made by a request, they run on the scheduler
+and update pipeline threads.
+Run with an ASGI server: uvicorn asgi_app:app, or python asgi_app.py
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import asyncio
+import configparser
+import concurrent.futures
+import logging
+import urllib.parse
+
+import main
+import dashboard_events
+from update_pipeline import add_refresh_callback
+from scheduler_service import stop_scheduler_service
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+view_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=config.getint('asgi', 'view_threads', fallback=8),
+    thread_name_prefix='asgi-view')
+refreshed_sources = ['covid_data', 'news']
+# the future every event stream waits on, completed when an event is published
+# or on each heartbeat, and the events formatted for each last id since then
+event_streams = {'loop': None, 'listener': None, 'waiter': None, 'formatted': {}}
+
+def call_view(method: str, path: str, query_string: bytes, headers: list) -> tuple:
+    """ Runs the flask view for a request, on a view thread.
+
+    Arguments:
+        method: the http method
+        path: the request path, e.g. '/index'
+        query_string: the raw query string
+        headers: list of (name, value) header pairs as bytes
+
+    Returns:
+        status, headers, body: of the flask response, as ASGI expects them
+    """
+    with main.app.test_request_context(path, method=method, query_string=query_string,
+        headers=[(name.decode('latin-1'), value.decode('latin-1')) for name, value in headers]):
+        response = main.app.full_dispatch_request()
+        response.direct_passthrough = False # static files are streamed from a file otherwise
+        body = response.get_data()
+        response_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in response.headers.items()]
+        return response.status_code, response_headers, body
+
+def set_done(future: asyncio.Future) -> None:
+    """ Marks a refresh wait as finished, if it has not timed out already """
+    if not future.done():
+        future.set_result(None)
+
+async def wait_for_refreshes(timeout: float) -> None:
+    """ Waits for any running news or covid data refresh to finish.
+
+    The wait is a future completed by the refreshing thread, so no thread is
+    held while waiting.
+
+    Arguments:
+        timeout: the longest to wait in seconds
+    """
+    loop = asyncio.get_running_loop()
+    waits = []
+    for source in refreshed_sources:
+        future = loop.create_future()
+        if add_refresh_callback(source, lambda future=future:
+            loop.call_soon_threadsafe(set_done, future)):
+            waits.append(future)
+    if waits:
+        await asyncio.wait(waits, timeout=timeout)
+
+def no_data_stored() -> bool:
+    """ Returns True if the default areas have no covid data stored yet """
+    return main.get_data_version('region') is None or main.get_data_version('nation') is None
+
+async def handle_http(scope: dict, receive, send) -> None:
+    """ Serves one http request through the dashboard's flask views """
+    while True: # the dashboard only takes GET requests, any body is read and ignored
+        message = await receive()
+        if not message.get('more_body'):
+            break
+    loop = asyncio.get_running_loop()
+    if scope['path'] == '/index' and await loop.run_in_executor(view_executor, no_data_stored):
+        # nothing to show yet, so the dashboard waits for the first data
+        await wait_for_refreshes(config.getfloat('asgi', 'refresh_wait', fallback=2))
+    status, headers, body = await loop.run_in_executor(view_executor, call_view,
+        scope['method'], scope['path'], scope.get('query_string', b''), scope.get('headers', []))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+def wake_streams() -> None:
+    """ Wakes every event stream, runs on the event loop """
+    waiter = event_streams['waiter']
+    event_streams['waiter'] = None
+    event_streams['formatted'] = {}
+    if waiter is not None and not waiter.done():
+        waiter.set_result(None)
+
+def notify_streams(loop: asyncio.AbstractEventLoop) -> None:
+    """ Wakes the event streams from the thread that published an event """
+    if not loop.is_closed():
+        loop.call_soon_threadsafe(wake_streams)
+
+def send_heartbeat(loop: asyncio.AbstractEventLoop, heartbeat: float) -> None:
+    """ Wakes every event stream so idle connections are sent a keep alive """
+    wake_streams()
+    loop.call_later(heartbeat, send_heartbeat, loop, heartbeat)
+
+def start_event_streams(loop: asyncio.AbstractEventLoop) -> None:
+    """ Wakes the event streams on this loop when an event is published, once per loop """
+    if event_streams['loop'] is loop:
+        return
+    if event_streams['listener'] is not None:
+        dashboard_events.remove_listener(event_streams['listener'])
+    event_streams['loop'] = loop
+    event_streams['listener'] = lambda: notify_streams(loop)
+    dashboard_events.add_listener(event_streams['listener'])
+    heartbeat = config.getfloat('events', 'heartbeat', fallback=15)
+    loop.call_later(heartbeat, send_heartbeat, loop, heartbeat)
+
+def stream_body(last_id: int) -> tuple:
+    """ Returns the events after last_id as server-sent events, and the new last id.
+
+    Streams are woken together and most have the same last id, so each body is
+    formatted once per wake up.
+    """
+    key = (last_id, dashboard_events.get_last_id())
+    if key not in event_streams['formatted']:
+        new_events = dashboard_events.events_since(last_id)
+        if new_events:
+            event_streams['formatted'][key] = (b''.join(dashboard_events.format_event(event)
+                for event in new_events), new_events[-1]['id'])
+        else:
+            event_streams['formatted'][key] = (b': keep alive\n\n', last_id)
+    return event_streams['formatted'][key]
+
+async def wait_for_disconnect(receive) -> None:
+    """ Returns when the client disconnects """
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def handle_events(scope: dict, receive, send) -> None:
+    """ Streams changes to the dashboard as server-sent events, see dashboard_events.
+
+    Reconnecting browsers send Last-Event-ID, a new connection sends 'since', the
+    event id the page was rendered with.
+    """
+    loop = asyncio.get_running_loop()
+    start_event_streams(loop)
+    headers = dict(scope.get('headers', []))
+    query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    last_id = dashboard_events.parse_last_id(
+        headers.get(b'last-event-id', b'').decode('latin-1') or query.get('since', [None])[0])
+    await send({'type': 'http.response.start', 'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]})
+    await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    dashboard_events.count_stream(1)
+    try:
+        while True:
+            if dashboard_events.get_last_id() == last_id: # nothing published while sending
+                if event_streams['waiter'] is None:
+                    event_streams['waiter'] = loop.create_future()
+                await asyncio.wait([event_streams['waiter'], disconnected],
+                    return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    return
+            body, last_id = stream_body(last_id)
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        dashboard_events.count_stream(-1)
+        disconnected.cancel()
+
+async def handle_lifespan(receive, send) -> None:
+    """ Starts the background services when the server starts and stops them on shutdown """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # a blocking startup refresh runs on a view thread, not the event loop
+            await asyncio.get_running_loop().run_in_executor(view_executor,
+                main.start_background_services)
+            logging.info('ASGI server started')
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            stop_scheduler_service()
+            if event_streams['listener'] is not None:
+                dashboard_events.remove_listener(event_streams['listener'])
+            view_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope: dict, receive, send) -> None:
+    """ The ASGI application """
+    if scope['type'] == 'http' and scope['path'] == '/events':
+        await handle_events(scope, receive, send)
+    elif scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+
+if __name__ == '__main__':
+    try:
+        import uvicorn # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise SystemExit('The ASGI serving mode needs an ASGI server: pip install uvicorn')
+    uvicorn.run(app, host=config.get('asgi', 'host', fallback='127.0.0.1'),
+        port=config.getint('asgi', 'port', fallback=8000))
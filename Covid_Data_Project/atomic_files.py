@@ -0,0 +1,60 @@
+""" Module for writing the data files of the covid data dashboard safely.
+A file is written to a temporary file in the same folder, flushed to disk and
+then renamed over the old file. The rename is atomic, so a reader opening the
+file gets either the old or the new contents in full, never a partly written
+file, and a crash while writing leaves the old file in place.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+
+def sync_folder(folder: str) -> None:
+    """ Flushes a folder's entries to disk, so a rename survives a crash.
+    Not possible on Windows """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    descriptor = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def write_atomic(path: str, data: bytes) -> os.stat_result:
+    """ Replaces a file's contents atomically.
+
+    Arguments:
+        path: the file to write
+        data: the new contents
+
+    Returns:
+        file_status: os.stat of the new file, the same as os.stat(path) until it is next replaced
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    descriptor, temporary_path = tempfile.mkstemp(dir=folder,
+        prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as temporary_file:
+            temporary_file.write(data)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+            os.chmod(temporary_path, mode) # temporary files are only readable by their owner
+            file_status = os.fstat(temporary_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_path)
+        raise
+    sync_folder(folder)
+    return file_status
+
+def write_json(path: str, data) -> os.stat_result:
+    """ Replaces a json file atomically, see write_atomic """
+    return write_atomic(path, json.dumps(data).encode('UTF-8'))
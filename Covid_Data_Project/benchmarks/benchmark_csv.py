@@ -0,0 +1,63 @@
+""" Benchmark of streaming csv ingestion against loading the whole file.
+
+Writes a synthetic multi-area export (most recent first within each area) and
+measures time and peak memory for:
+    parse_csv_data + process_covid_csv_data (whole file as a list of lines)
+    process_covid_csv_file (streaming, stops once the metrics are found)
+    read_csv_batches (streaming column batches over the whole file)
+
+Run from the project folder: python benchmarks/benchmark_csv.py [rows]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pylint: disable=wrong-import-position
+from covid_data_handler import parse_csv_data, process_covid_csv_data,\
+    process_covid_csv_file, read_csv_batches
+from synthetic_data import write_export
+
+def measure(description: str, function) -> object:
+    """ Runs function, printing the time taken and the peak memory allocated.
+
+    The time is taken from a run without tracemalloc, which slows allocation down.
+    """
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('  ' + description.ljust(40) + format(elapsed, '8.3f') + 's ' +
+        format(peak / 2**20, '9.1f') + ' MiB peak')
+    return result
+
+def scan_batches(csv_filename: str) -> float:
+    """ Sums the cases column over every batch of the file """
+    return sum(np.nansum(batch['newCasesBySpecimenDate'])
+        for batch in read_csv_batches(csv_filename))
+
+def run_benchmark(rows: int) -> None:
+    """ Writes the export and times each way of reading it """
+    with tempfile.TemporaryDirectory() as directory:
+        csv_filename = os.path.join(directory, 'export.csv')
+        write_export(csv_filename, rows)
+        print(str(rows) + ' row export (' +
+            format(os.path.getsize(csv_filename) / 2**20, '.1f') + ' MiB):')
+        full = measure('parse_csv_data + process_covid_csv_data',
+            lambda: process_covid_csv_data(parse_csv_data(csv_filename)))
+        streamed = measure('process_covid_csv_file',
+            lambda: process_covid_csv_file(csv_filename, 'Area 0'))
+        assert full == streamed
+        measure('process_covid_csv_file (last area)',
+            lambda: process_covid_csv_file(csv_filename, 'Area ' + str(rows // 1000 - 1)))
+        measure('read_csv_batches (whole file)', lambda: scan_batches(csv_filename))
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,109 @@
+""" Benchmark of the NumPy metrics engine against the original record loop.
+
+Generates synthetic multi-year series for many areas and times calculating the
+7 day sum for every date of every area, first with the loop that
+process_covid_api_data used (re-run for each date) and then with covid_metrics.
+Also times the latest values only, the dashboard's own call path, with the loop
+process_covid_csv_data used and with process_covid_csv_data, for the bundled
+export and a synthetic one of --rows rows.
+
+Run from the project folder: python benchmarks/benchmark_metrics.py [years] [areas] [rows]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import covid_metrics # pylint: disable=wrong-import-position
+from covid_data_handler import parse_csv_data, process_covid_csv_data\
+    # pylint: disable=wrong-import-position
+from synthetic_data import synthetic_records, write_export # pylint: disable=wrong-import-position
+
+project_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def loop_seven_day_rate(covid_data_entries: list[dict]) -> int:
+    """ The 7 day sum as calculated by the original process_covid_api_data loop """
+    seven_day_rate = 0
+    no_of_days_ignore = 2
+    no_of_days_counted = 0
+    for daily_data in covid_data_entries:
+        if daily_data['newCasesBySpecimenDate'] is None:
+            no_of_days_ignore +=1
+        no_of_days_ignore -= 1
+        if no_of_days_ignore <= 0 and no_of_days_counted <= 6:
+            seven_day_rate += daily_data['newCasesBySpecimenDate']
+            no_of_days_counted +=1
+    return seven_day_rate
+
+def run_benchmark(years: int, areas: int) -> None:
+    """ Times both implementations over every date of every area and checks they agree """
+    all_records = [synthetic_records(365 * years, seed) for seed in range(areas)]
+    start = time.perf_counter()
+    loop_results = [[loop_seven_day_rate(records[day:]) for day in range(len(records) - 1)]
+        for records in all_records]
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    engine_results = [covid_metrics.compute_metrics(covid_metrics.series_from_records(records))
+        for records in all_records]
+    engine_time = time.perf_counter() - start
+    for loop_sums, metrics in zip(loop_results, engine_results):
+        engine_sums = metrics['seven_day_cases'][::-1][:len(loop_sums)]
+        assert np.array_equal(np.array(loop_sums, dtype=float), engine_sums)
+    print(str(areas) + ' areas x ' + str(years) + ' years, every date:')
+    print('  record loop:    ' + format(loop_time, '.3f') + 's')
+    print('  metrics engine: ' + format(engine_time, '.3f') + 's (' +
+        format(loop_time / engine_time, '.0f') + 'x faster)')
+
+def loop_csv_latest(covid_csv_data: list[str]) -> tuple:
+    """ The latest values as calculated by the original process_covid_csv_data loop """
+    current_line_count = 0
+    last7days_cases = 0
+    current_hospital_cases = 0
+    counter = 10
+    total_deaths = None
+    for item in covid_csv_data:
+        current_line = item.split(",")
+        if current_hospital_cases == 0 and current_line_count != 0:
+            current_hospital_cases = int(current_line[5])
+        if 2 < current_line_count < counter:
+            if current_line[6] == "":
+                counter +=1
+            else:
+                last7days_cases += int(current_line[6])
+        elif (current_line[4] != "") and current_line_count != 0:
+            total_deaths = int(current_line[4])
+            break
+        current_line_count +=1
+    return last7days_cases, current_hospital_cases, total_deaths
+
+def time_calls(function, number: int) -> float:
+    """ Returns the mean time in seconds of number calls to function """
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    return (time.perf_counter() - start) / number
+
+def run_latest_benchmark(rows: int) -> None:
+    """ Times finding the latest values of the bundled export and a synthetic one """
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic_filename = os.path.join(directory, 'export.csv')
+        write_export(synthetic_filename, rows, rows)
+        for description, csv_filename in (
+            ('bundled export', os.path.join(project_folder, 'nation_2021-10-28.csv')),
+            (str(rows) + ' row export', synthetic_filename)):
+            covid_csv_data = parse_csv_data(csv_filename)
+            if csv_filename != synthetic_filename: # the loop reads 0 hospital cases as missing
+                assert loop_csv_latest(covid_csv_data) == process_covid_csv_data(covid_csv_data)
+            loop_time = time_calls(lambda: loop_csv_latest(covid_csv_data), 1000)
+            engine_time = time_calls(lambda: process_covid_csv_data(covid_csv_data), 1000)
+            print(description + ', latest values:')
+            print('  record loop:            ' + format(loop_time * 1000, '.3f') + 'ms')
+            print('  process_covid_csv_data: ' + format(engine_time * 1000, '.3f') + 'ms')
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50)
+    run_latest_benchmark(int(sys.argv[3]) if len(sys.argv) > 3 else 100000)
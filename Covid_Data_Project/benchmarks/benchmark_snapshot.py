@@ -0,0 +1,89 @@
+""" Benchmark of the binary snapshot against the json files saved from the api.
+
+Writes a synthetic api response for many areas as json, converts it to a
+snapshot and measures the file sizes, then the time and peak memory to load
+the data and get one area's series:
+    json.load + series_from_records (as the json files are read)
+    load_snapshot, memory mapped + snapshot_series
+    load_snapshot, read into memory + snapshot_series
+The existing region and nation files are converted and measured in the same way.
+
+Run from the project folder: python benchmarks/benchmark_snapshot.py [areas] [days]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pylint: disable=wrong-import-position
+import covid_metrics
+import covid_snapshot
+from synthetic_data import synthetic_records
+
+def measure(description: str, function) -> object:
+    """ Runs function, printing the time taken and the peak memory allocated.
+
+    The time is taken from a run without tracemalloc, which slows allocation down.
+    Memory mapped pages are not allocations, so they are not counted.
+    """
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('  ' + description.ljust(40) + format(elapsed * 1000, '9.2f') + 'ms ' +
+        format(peak / 2**20, '9.2f') + ' MiB peak')
+    return result
+
+def json_series(json_filename: str, area_name: str) -> dict:
+    """ Loads a json file and returns one area's series """
+    with open(json_filename, 'r', encoding='UTF-8') as covid_json:
+        covid_data = json.load(covid_json)
+    return covid_metrics.series_from_records([record for record in covid_data['data']
+        if record['areaName'] == area_name])
+
+def folder_size(folder: str) -> int:
+    """ Returns the total size of the files in a folder """
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+def compare(json_filename: str, area_type: str, area_name: str, folder: str) -> None:
+    """ Converts a json file to a snapshot and measures loading each """
+    covid_snapshot.convert_files(folder, {area_type: [json_filename]})
+    snapshot_size = folder_size(covid_snapshot.current_folder(folder))
+    print('  json file: ' + format(os.path.getsize(json_filename) / 2**20, '.2f') +
+        ' MiB, snapshot: ' + format(snapshot_size / 2**20, '.2f') + ' MiB')
+    from_json = measure('json.load + series_from_records',
+        lambda: json_series(json_filename, area_name))
+    from_snapshot = measure('load_snapshot (memory mapped)', lambda: covid_snapshot
+        .snapshot_series(covid_snapshot.load_snapshot(folder), area_type, area_name))
+    measure('load_snapshot (read)', lambda: covid_snapshot.snapshot_series(
+        covid_snapshot.load_snapshot(folder, memory_map=False), area_type, area_name))
+    assert covid_metrics.latest_metrics(from_json) == covid_metrics.latest_metrics(from_snapshot)
+
+def run_benchmark(areas: int, days: int) -> None:
+    """ Measures a synthetic multi-area file and the project's own json files """
+    with tempfile.TemporaryDirectory() as directory:
+        json_filename = os.path.join(directory, 'areas.json')
+        with open(json_filename, 'w', encoding='UTF-8') as covid_json:
+            json.dump({'data': [record for area in range(areas)
+                for record in synthetic_records(days, area)]}, covid_json)
+        print(str(areas) + ' areas x ' + str(days) + ' days:')
+        compare(json_filename, 'region', 'Area ' + str(areas - 1),
+            os.path.join(directory, 'synthetic'))
+        for area_type, json_filename in (('region', 'region_covid_data.json'),
+            ('nation', 'nation_covid_data.json')):
+            if os.path.exists(json_filename):
+                with open(json_filename, 'r', encoding='UTF-8') as covid_json:
+                    area_name = json.load(covid_json)['data'][0]['areaName']
+                print(json_filename + ':')
+                compare(json_filename, area_type, area_name, os.path.join(directory, area_type))
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 700)
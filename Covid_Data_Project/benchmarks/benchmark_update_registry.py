@@ -0,0 +1,59 @@
+""" Benchmark of the update registry against the original sched queue scans.
+
+Schedules thousands of named updates, cancels half of them by name and runs
+the rest. The sched version checks name uniqueness and finds events to cancel
+by scanning the queue, as main and the delete_scheduled_*_event functions did.
+
+Run from the project folder: python benchmarks/benchmark_update_registry.py [updates]
+"""
+
+import os
+import sys
+import sched
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import update_registry # pylint: disable=wrong-import-position
+
+def sched_benchmark(names: list[str]) -> float:
+    """ Times scheduling, cancelling and running updates with a sched queue """
+    scheduler = sched.scheduler(time.time, time.sleep)
+    start = time.perf_counter()
+    for position, name in enumerate(names):
+        if any(event.argument == (name,) for event in scheduler.queue):
+            continue # name is not unique
+        scheduler.enter(position * 0.001, 1, len, (name,))
+    for name in names[::2]:
+        for event in scheduler.queue:
+            if event.argument == (name,):
+                scheduler.cancel(event)
+    while scheduler.queue:
+        event = scheduler.queue[0]
+        scheduler.cancel(event)
+        event.action(*event.argument)
+    return time.perf_counter() - start
+
+def registry_benchmark(names: list[str]) -> float:
+    """ Times scheduling, cancelling and running updates with the update registry """
+    start = time.perf_counter()
+    for position, name in enumerate(names):
+        update_registry.add_update(name, position * 0.001 - 3600, {'news': len})
+    for name in names[::2]:
+        update_registry.cancel_update(name)
+    update_registry.run_due_updates()
+    elapsed = time.perf_counter() - start
+    assert update_registry.get_registry_status()['scheduled'] == 0
+    return elapsed
+
+def run_benchmark(updates: int) -> None:
+    """ Times both implementations with the same update names """
+    names = ['update ' + str(number) for number in range(updates)]
+    sched_time = sched_benchmark(names)
+    registry_time = registry_benchmark(names)
+    print(str(updates) + ' updates, half cancelled:')
+    print('  sched queue scans: ' + format(sched_time, '.3f') + 's')
+    print('  update registry:   ' + format(registry_time, '.3f') + 's (' +
+        format(sched_time / registry_time, '.0f') + 'x faster)')
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
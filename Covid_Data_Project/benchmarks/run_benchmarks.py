@@ -0,0 +1,215 @@
+""" Offline benchmark suite for ingest, metric computation and page rendering.
+
+Runs in a temporary working directory with the 'mock' data source, a local
+server standing in for the covid and news apis, so no network access is needed and
+the project's data files are not touched. Covers:
+    parse_csv_data + process_covid_csv_data for growing exports
+    process_covid_csv_data alone (the latest values, from already parsed lines)
+    process_covid_api_data and calculate_covid_api_data for growing history
+    create_filtered_list for growing lists of dismissed articles
+    end to end /index throughput and latency under concurrent load
+
+Results are saved in benchmarks/results as <commit>.json. Pass --compare with an
+earlier results file to print the change for each case.
+
+Run from the project folder: python benchmarks/run_benchmarks.py [--quick] [--compare FILE]
+"""
+
+import argparse
+import concurrent.futures
+import configparser
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+benchmark_folder = os.path.dirname(os.path.abspath(__file__))
+project_folder = os.path.dirname(benchmark_folder)
+results_folder = os.path.join(benchmark_folder, 'results')
+sys.path.insert(0, project_folder)
+
+full_sizes = {'csv_rows': [10000, 100000, 1000000], 'history_days': [90, 365, 730, 1460],
+    'dismissals': [0, 100, 1000, 10000], 'concurrency': [1, 8, 32], 'index_requests': 400}
+quick_sizes = {'csv_rows': [10000, 100000], 'history_days': [90, 730],
+    'dismissals': [0, 1000], 'concurrency': [1, 8], 'index_requests': 100}
+
+def median_time(function, repeat: int = 5) -> float:
+    """ Returns the median time in seconds of repeated calls to function """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def benchmark_csv(sizes: list[int]) -> dict:
+    """ Times parse_csv_data + process_covid_csv_data for each export size, and
+    process_covid_csv_data alone, which should not grow with the size
+    """
+    from covid_data_handler import parse_csv_data, process_covid_csv_data
+    from synthetic_data import write_export
+    results = {}
+    for rows in sizes:
+        write_export('export.csv', rows)
+        results['csv_parse_process_' + str(rows)] = median_time(
+            lambda: process_covid_csv_data(parse_csv_data('export.csv')), 3)
+        covid_csv_data = parse_csv_data('export.csv')
+        results['csv_process_latest_' + str(rows)] = median_time(
+            lambda: process_covid_csv_data(covid_csv_data), 50)
+        os.remove('export.csv')
+    return results
+
+def benchmark_api_processing(history_lengths: list[int]) -> dict:
+    """ Times processing an area's data for each length of stored history.
+
+    process_covid_api_data is timed cold (caches cleared before each call) and
+    warm, calculate_covid_api_data over the whole history.
+    """
+    import covid_data_handler
+    import covid_data_store
+    from shared_state import state
+    from synthetic_data import synthetic_records
+    results = {}
+    for days in history_lengths:
+        area_name = 'History ' + str(days)
+        records = synthetic_records(days, days, area_name)
+        covid_data_store.upsert_records('region', area_name, records)
+        def cold_process():
+            with covid_data_handler.cache_lock:
+                covid_data_handler.covid_data_cache.clear()
+            state.remove_item('metrics', 'region/' + area_name)
+            covid_data_handler.process_covid_api_data('region', area_name, request_missing=False)
+        results['process_covid_api_data_cold_' + str(days)] = median_time(cold_process, 20)
+        results['process_covid_api_data_warm_' + str(days)] = median_time(lambda:
+            covid_data_handler.process_covid_api_data('region', area_name,
+            request_missing=False), 200)
+        results['calculate_covid_api_data_full_' + str(days)] = median_time(lambda:
+            covid_data_handler.calculate_covid_api_data(records, 'region', area_name), 20)
+    return results
+
+def benchmark_filtered_list(dismissal_counts: list[int]) -> dict:
+    """ Times create_filtered_list as the list of dismissed articles grows """
+    import covid_news_handling
+    from shared_state import state
+    covid_news_handling.news_API_request()
+    covid_news_handling.load_news_articles()
+    article_ids = list(covid_news_handling.news_state['store']['articles'])
+    results = {}
+    for count in dismissal_counts:
+        # a few real articles among many dismissals that are no longer in the store
+        for number in range(count):
+            removed_id = article_ids[number] if number < 5 else 'old-' + str(number)
+            state.set_value('removed_articles', removed_id, time.time())
+        results['create_filtered_list_' + str(count)] = median_time(
+            covid_news_handling.create_filtered_list, 50)
+        for removed_id, _ in state.get_items('removed_articles'):
+            state.remove_item('removed_articles', removed_id)
+    return results
+
+def benchmark_index(concurrency_levels: list[int], requests_per_level: int) -> dict:
+    """ Measures /index throughput and latency with concurrent clients """
+    import requests
+    from werkzeug.serving import make_server
+    import main
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:' + str(server.server_port) + '/index'
+    areas = [None] + ['History ' + str(days) for days in full_sizes['history_days']]
+    results = {}
+    try:
+        for concurrency in concurrency_levels:
+            latencies = []
+            def client(client_number):
+                session = requests.Session()
+                for number in range(client_number, requests_per_level, concurrency):
+                    area = areas[number % len(areas)]
+                    start = time.perf_counter()
+                    response = session.get(url, params={'area': area} if area else None)
+                    latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+                list(executor.map(client, range(concurrency)))
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+            name = 'index_' + str(concurrency) + '_clients_'
+            results[name + 'requests_per_second'] = requests_per_level / elapsed
+            results[name + 'p50'] = latencies[len(latencies) // 2]
+            results[name + 'p95'] = latencies[int(len(latencies) * 0.95)]
+    finally:
+        server.shutdown()
+    return results
+
+def git_commit() -> str:
+    """ Returns the short hash of the checked out commit, 'unknown' outside git """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=project_folder,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run_suite(sizes: dict) -> dict:
+    """ Runs every benchmark in a temporary directory against the stand-in servers """
+    working_folder = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        config = configparser.ConfigParser()
+        config.read(os.path.join(project_folder, 'config_file.ini'))
+        config['data_source'] = {'backend': 'mock', 'record': 'false'}
+        with open(os.path.join(directory, 'config_file.ini'), 'w', encoding='UTF-8') as config_file:
+            config.write(config_file)
+        os.chdir(directory) # the modules read config and write data files relative to it
+        # log to a file as main does, rather than to the console
+        logging.basicConfig(filename='benchmark.log', level=logging.DEBUG)
+        try:
+            import covid_data_handler
+            covid_data_handler.covid_API_request(None, 'LTLA')
+            covid_data_handler.covid_API_request(None, 'nation')
+            results = {}
+            results.update(benchmark_csv(sizes['csv_rows']))
+            results.update(benchmark_api_processing(sizes['history_days']))
+            results.update(benchmark_filtered_list(sizes['dismissals']))
+            results.update(benchmark_index(sizes['concurrency'], sizes['index_requests']))
+        finally:
+            os.chdir(working_folder)
+    return results
+
+def compare_results(previous: dict, current: dict) -> None:
+    """ Prints each case with its change from a previous run """
+    print('case'.ljust(52) + 'previous'.rjust(12) + 'current'.rjust(12) + 'change'.rjust(9))
+    for name, value in current['results'].items():
+        old_value = previous['results'].get(name)
+        line = name.ljust(52) + format(value, '12.5f')
+        if old_value:
+            line = (name.ljust(52) + format(old_value, '12.5f') + format(value, '12.5f')
+                + format((value - old_value) / old_value, '+9.1%'))
+        print(line)
+
+def main(arguments: list[str]) -> None:
+    """ Runs the suite, saves the results and optionally compares them """
+    parser = argparse.ArgumentParser(description='Offline dashboard benchmarks')
+    parser.add_argument('--quick', action='store_true', help='run smaller sizes')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    options = parser.parse_args(arguments)
+    commit = git_commit()
+    current = {'commit': commit, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'quick': options.quick,
+        'results': run_suite(quick_sizes if options.quick else full_sizes)}
+    os.makedirs(results_folder, exist_ok=True)
+    results_filename = os.path.join(results_folder, commit + '.json')
+    with open(results_filename, 'w', encoding='UTF-8') as results_file:
+        json.dump(current, results_file, indent=2)
+    print('Results saved to ' + results_filename)
+    if options.compare:
+        with open(options.compare, encoding='UTF-8') as previous_file:
+            compare_results(json.load(previous_file), current)
+    else:
+        compare_results({'results': {}}, current)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,24 @@
+""" Synthetic data generators shared by the benchmarks.
+
+Every generator is seeded, so the same arguments always give the same data
+and results can be compared across commits.
+The covid records and news articles are those served by mock_upstream.
+"""
+
+import numpy as np
+from mock_upstream import synthetic_records, synthetic_articles # pylint: disable=unused-import
+
+def write_export(csv_filename: str, rows: int, days: int = 1000) -> None:
+    """ Writes a csv export with rows // days areas of days records each """
+    start = np.datetime64('2021-10-28')
+    with open(csv_filename, 'w', encoding='UTF-8') as file:
+        file.write('areaCode,areaName,areaType,date,cumDailyNsoDeathsByDeathDate,'
+            'hospitalCases,newCasesBySpecimenDate\n')
+        for area in range(max(rows // days, 1)):
+            for day in range(days):
+                date = (start - day).item()
+                deaths = '' if day < 13 else str(100000 - day)
+                cases = '' if day == 0 else str((area * 7 + day * 13) % 5000)
+                file.write('E' + str(area) + ',Area ' + str(area) + ',ltla,' +
+                    date.strftime('%d/%m/%Y') + ',' + deaths + ',' + str(day % 900) + ',' +
+                    cases + '\n')
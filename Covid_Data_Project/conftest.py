@@ -1 +1,13 @@
-# comment to allow github upload
\ No newline at end of file
+# comment to allow github upload
+import pytest
+import covid_data_store
+
+@pytest.fixture
+def temporary_store(tmp_path, monkeypatch):
+    """ Points the covid data store at an empty database in tmp_path for one test """
+    monkeypatch.setitem(covid_data_store.config['covid_store'], 'database',
+        str(tmp_path / 'covid_data.db'))
+    monkeypatch.setattr(covid_data_store.connections, 'connection', None, raising=False)
+    yield
+    if covid_data_store.connections.connection is not None:
+        covid_data_store.connections.connection.close()
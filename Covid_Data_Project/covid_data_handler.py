@@ -5,16 +5,58 @@ Part of the 2021 Assessement for ECM1400 at University of Exeter
 """
 
 import configparser
+import collections
+import csv
+import itertools
+import threading
 import time
 import sched
 import json
 import logging
+import numpy as np
 from uk_covid19 import Cov19API
+from update_pipeline import run_concurrently, run_single_flight, get_request_timeout
+from update_registry import add_update, cancel_update
+import data_sources
+import covid_data_store
+import covid_metrics
+import covid_history
+import covid_snapshot
+import dashboard_events
+from dashboard_metrics import timed
+from shared_state import state
 
 data_sched = sched.scheduler(time.time, time.sleep) # create scheduler
 config = configparser.ConfigParser()
 config.read('config_file.ini')
 
+# used to seed the data store the first time an area is read
+covid_data_files = {'region': 'region_covid_data.json', 'nation': 'nation_covid_data.json'}
+snapshot_state = {'changed': False} # True once the store has changed since the last snapshot
+# in memory copy of the recent data for each (area type, area name), least recently used first.
+# Each entry holds the store version it was loaded from, the recent records and the
+# processed tuple (once calculated)
+covid_data_cache = collections.OrderedDict()
+cache_lock = threading.Lock()
+cache_stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'evictions': 0}
+pending_areas = {'region': set(), 'nation': set()} # areas requested but not yet in the store
+published_metrics = {} # (area type, area name) -> the metrics last pushed to browsers
+location_types = {'region': 'LTLA', 'nation': 'nation'}
+
+desired_data_region = { # data required for region
+"date": "date",
+"areaName": "areaName",
+"newCasesBySpecimenDate": "newCasesBySpecimenDate",
+}
+
+desired_data_nation = { # data required for nation
+"date": "date",
+"areaName": "areaName",
+"newCasesBySpecimenDate": "newCasesBySpecimenDate",
+"hospitalCases": "hospitalCases",
+"cumDailyNsoDeathsByDeathDate": "cumDailyNsoDeathsByDeathDate",
+}
+
 def parse_csv_data(csv_filename: str) -> list[str]:
     """ Fetch covid data from CSV.
 
@@ -31,6 +73,22 @@ def parse_csv_data(csv_filename: str) -> list[str]:
             list_of_lines.append(line) # append data to list "list_of_lines"
     return list_of_lines
 
+def csv_record(current_line: dict) -> dict:
+    """ Converts a row of a csv export into a typed daily record.
+
+    Arguments:
+        current_line: dictionary of column title -> cell from the csv
+
+    Returns:
+        record: 'date' in ISO format, 'areaName' and each metric as an int, None if empty
+    """
+    day, month, year = current_line['date'].split('/')
+    record = {'date': year + '-' + month + '-' + day, 'areaName': current_line.get('areaName')}
+    for column in covid_metrics.metric_columns:
+        # empty cells are days where the data has not been updated yet
+        record[column] = int(current_line[column]) if current_line.get(column) else None
+    return record
+
 def process_covid_csv_data(covid_csv_data: list[str]) -> tuple[int, int, int]:
     """ Processes data to find 7 day rate, hospitilisations and deaths
 
@@ -43,85 +101,247 @@ def process_covid_csv_data(covid_csv_data: list[str]) -> tuple[int, int, int]:
         current_hospital_cases: Number of cases currently in hospital
         total_deaths: Total number of deaths
     """
-    current_line_count = 0 # Stores the line of the CSV file (now in an array) being searched
-    last7days_cases = 0
-    current_hospital_cases = 0
-    counter = 10
-    for item in covid_csv_data:
-        current_line = item.split(",") # Splits each line of the file by comma
-        if current_hospital_cases == 0 and current_line_count != 0:
-            # takes data from first line with data not including the header as it is most up to date
-            current_hospital_cases = int(current_line[5])
-        if 2 < current_line_count < counter:
-            # next 7 items, typically skipping first 2 days as they are incomplete
-            if current_line[6] == "":
-                #if the cell is empty, i.e, the data has not been updated for the new day yet
-                counter +=1 # shifts the data selected one day in advance
-            else:
-                last7days_cases += int(current_line[6])
-                # adds the cases for the day to the weekly sum
-        elif (current_line[4] != "") and current_line_count != 0:
-            # When the column is not empty (as it is for first 2 weeks) and is not the column title
-            total_deaths = int(current_line[4])
-            break # no more data is needed, break from for loop
-        current_line_count +=1
+    header = covid_csv_data[0].strip().split(",") # column titles
+    # Splits each line of the file by comma, only as far as the values are found
+    records = (csv_record(dict(zip(header, item.strip().split(","))))
+        for item in itertools.islice(covid_csv_data, 1, None))
+    # first two days are skipped as they are incomplete, empty days are skipped within the 7
+    return latest_csv_metrics(records)
+
+def latest_csv_metrics(records) -> tuple[int, int, int]:
+    """ Finds 7 day rate, hospitilisations and deaths from csv records, most recent first.
+
+    Records are only read until every value has been found, typically the first
+    couple of weeks, so the time taken does not grow with the length of the export.
+
+    Arguments:
+        records: iterable of records, see csv_record
+
+    Returns:
+        see process_covid_csv_data
+    """
+    days_read = 0
+    recent_cases = [] # the 7 non empty days of the 7 day rate
+    current_hospital_cases = None
+    total_deaths = None
+    for record in records:
+        # two incomplete days are skipped, then 7 non empty days are summed
+        if days_read >= 2 and len(recent_cases) < 7 \
+            and record['newCasesBySpecimenDate'] is not None:
+            recent_cases.append(record['newCasesBySpecimenDate'])
+        days_read += 1
+        if current_hospital_cases is None:
+            current_hospital_cases = record['hospitalCases']
+        if total_deaths is None:
+            total_deaths = record['cumDailyNsoDeathsByDeathDate']
+        if len(recent_cases) >= 7 and current_hospital_cases is not None \
+            and total_deaths is not None:
+            break # no more data is needed
+    last7days_cases = sum(recent_cases) if recent_cases else None
     return last7days_cases, current_hospital_cases, total_deaths
 
-def covid_API_request(location = "Exeter", location_type = "LTLA") -> None:
+def iter_csv_records(csv_filename: str, area_name: str = None):
+    """ Reads a csv export one row at a time as typed records.
+
+    Only one row is held in memory, so exports of any size can be read.
+
+    Arguments:
+        csv_filename: Name of the CSV file to read
+        area_name: if given, only rows for this area are returned
+
+    Yields:
+        record: see csv_record
+    """
+    with open(csv_filename, 'r', encoding="UTF-8", newline='') as file:
+        for current_line in csv.DictReader(file):
+            if area_name is None or current_line['areaName'] == area_name:
+                yield csv_record(current_line)
+
+def read_csv_batches(csv_filename: str, batch_size: int = 65536):
+    """ Reads a csv export in column batches of NumPy arrays.
+
+    Arguments:
+        csv_filename: Name of the CSV file to read
+        batch_size: the number of rows in each batch
+
+    Yields:
+        batch: dictionary of 'date' -> datetime64 array, 'areaName' -> str array
+            and metric name -> float array (NaN where empty), in file order
+    """
+    records = []
+    for record in iter_csv_records(csv_filename):
+        records.append(record)
+        if len(records) == batch_size:
+            yield csv_batch(records)
+            records = []
+    if records:
+        yield csv_batch(records)
+
+def csv_batch(records: list[dict]) -> dict:
+    """ Converts a list of csv records into a batch of column arrays, see read_csv_batches """
+    batch = {'date': np.array([record['date'] for record in records], dtype='datetime64[D]'),
+        'areaName': np.array([record['areaName'] for record in records])}
+    for column in covid_metrics.metric_columns:
+        batch[column] = np.array([np.nan if record[column] is None else record[column]
+            for record in records], dtype=float)
+    return batch
+
+def process_covid_csv_file(csv_filename: str, area_name: str = None) -> tuple[int, int, int]:
+    """ Streams a csv export to find 7 day rate, hospitilisations and deaths.
+
+    Gives the same result as process_covid_csv_data(parse_csv_data(csv_filename))
+    but reads the file one row at a time and stops as soon as every value has been
+    found, so memory use does not grow with the size of the file. Rows for each
+    area must be most recent first, as in exports from the api.
+
+    Arguments:
+        csv_filename: Name of the CSV file to read
+        area_name: the area to process, needed if the export holds more than one area
+
+    Returns:
+        see process_covid_csv_data
+    """
+    return latest_csv_metrics(iter_csv_records(csv_filename, area_name))
+
+@timed
+def covid_API_request(location = None, location_type = "LTLA") -> None:
     # note this name is necessary to pass tests - ignore Pylint
     """ Interacts with the UK government covid data api to return live data.
 
     Interacts with https://coronavirus.data.gov.uk/details/developers-guide) to
     fetch the required data for the dashboard: regional 7 day rate,
-    national 7 day rate, hospital cases and total deaths. The data
-    is then stored in two JSON files -> 'region_covid_data.json' and
-    'nation_covid_data.json' to be accessed later.
+    national 7 day rate, hospital cases and total deaths. New and revised
+    days are then written to the local data store to be accessed later.
 
     Arguments:
-        type: the type of area the data is for
+        location: the name of the area, defaults to the area in config_file.ini
+        location_type: the type of area the data is for, 'LTLA' or 'nation'
     """
     covid_api_data = {}
     if location_type == 'LTLA':
-        location = config['covid_defaults']['region']
+        area_type = 'region'
+        structure = desired_data_region
     elif location_type == 'nation':
-        location = config['covid_defaults']['nation']
+        area_type = 'nation'
+        structure = desired_data_nation
+    else:
+        logging.warning('Warning: No data request occured for location: %s', location_type)
+        return covid_api_data
+    if not location:
+        location = get_area_name(area_type)
     api_request = [ # the data filter. Takes parameters passed up.
     'areaType='+location_type,
     'areaName='+location
     ]
+    covid_api_data, modified = request_covid_api_data(api_request, structure)
+    logging.info('API data called for %s', location)
+    if not covid_api_data['data'] and get_data_version(area_type, location) is None:
+        note_missing_area(area_type, location)
+        return covid_api_data
+    covid_data_store.mark_refreshed(area_type, location)
+    if modified: # an unchanged dataset is not re-processed
+        # only new or revised days are written to the store
+        if covid_data_store.upsert_records(area_type, location, covid_api_data['data']):
+            snapshot_state['changed'] = True
+            covid_history.update_history(area_type, location, covid_api_data['data'])
+            publish_metrics(area_type, location)
+        logging.info('%s data added to store', location_type)
+    return covid_api_data
 
-    desired_data_region = { # data required for region
-    "date": "date",
-    "areaName": "areaName",
-    "newCasesBySpecimenDate": "newCasesBySpecimenDate",
-    }
-
-    desired_data_nation = { # data required for nation
-    "date": "date",
-    "areaName": "areaName",
-    "newCasesBySpecimenDate": "newCasesBySpecimenDate",
-    "hospitalCases": "hospitalCases",
-    "cumDailyNsoDeathsByDeathDate": "cumDailyNsoDeathsByDeathDate",
-    }
-    if location_type == 'LTLA': # if region data is needed
-        covid_api_data = Cov19API(filters=api_request, structure=desired_data_region)
-        covid_api_data = covid_api_data.get_json()
-        logging.info('API data called for %s', location)
-        with open('region_covid_data.json', 'w', encoding = 'UTF-8') as write_file:
-            # open json in write
-            json.dump(covid_api_data, write_file)
-            logging.info('%s data added to JSON', location_type)
-    elif location_type == 'nation': # if national data is needed
-        covid_api_data = Cov19API(filters=api_request, structure=desired_data_nation)
-        covid_api_data = covid_api_data.get_json()
-        logging.info('API data called for %s', location)
-        with open("nation_covid_data.json", "w", encoding="UTF-8") as write_file:
-            # open json in writeyes
-            json.dump(covid_api_data, write_file)
-            logging.info('%s data added to JSON', location_type)
+def covid_API_batch_request(area_type: str, area_names: list[str]) -> None:
+    """ Refreshes the data for many areas of the same type.
+
+    Small batches are requested one area at a time, concurrently. Larger batches
+    are requested with a single filter for every area of the type, which the api
+    pages through, and the records are split by area name before being stored.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_names: names of the areas to refresh
+    """
+    area_names = set(area_names)
+    if not area_names:
+        return
+    location_type = location_types[area_type]
+    if len(area_names) <= config.getint('covid_store', 'batch_threshold', fallback=8):
+        run_concurrently({name: lambda name=name: covid_API_request(name, location_type)
+            for name in area_names})
+        return
+    if area_type == 'region':
+        structure = desired_data_region
     else:
-        logging.warning('Warning: No data request occured for location: %s', location_type)
-    return covid_api_data
+        structure = desired_data_nation
+    covid_api_data, modified = request_covid_api_data(['areaType='+location_type], structure)
+    logging.info('API data called for %s %s areas', len(area_names), area_type)
+    records_by_area = collections.defaultdict(list)
+    for daily_data in covid_api_data['data']:
+        if daily_data['areaName'] in area_names:
+            records_by_area[daily_data['areaName']].append(daily_data)
+    for area_name in area_names:
+        if area_name in records_by_area or get_data_version(area_type, area_name) is not None:
+            covid_data_store.mark_refreshed(area_type, area_name)
+        else:
+            note_missing_area(area_type, area_name)
+    if not modified:
+        return
+    for area_name, records in records_by_area.items():
+        if covid_data_store.upsert_records(area_type, area_name, records):
+            snapshot_state['changed'] = True
+            covid_history.update_history(area_type, area_name, records)
+            publish_metrics(area_type, area_name)
+
+def publish_metrics(area_type: str, area_name: str) -> None:
+    """ Pushes the metrics of an area that have changed since they were last pushed.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+    """
+    processed = process_covid_api_data(area_type, area_name, request_missing=False)
+    names = ['area', 'seven_day_rate', 'hospital_cases', 'deaths'][:len(processed)]
+    metrics = dict(zip(names[1:], processed[1:]))
+    with cache_lock:
+        previous = published_metrics.get((area_type, area_name), {})
+        published_metrics[(area_type, area_name)] = metrics
+    changed = {name: value for name, value in metrics.items()
+        if name not in previous or previous[name] != value}
+    if changed:
+        dashboard_events.publish('metrics', dict(changed, area_type=area_type, area=area_name))
+
+def request_covid_api_data(api_request: list[str], structure: dict) -> tuple[dict, bool]:
+    """ Requests every page of data for a filter from the configured data source.
+
+    Each page is a conditional request, so if the dataset has not changed
+    since the last refresh every page is a 304 and nothing is re-parsed.
+
+    Arguments:
+        api_request: the filters for the request, e.g. ['areaType=nation', 'areaName=England']
+        structure: the metrics to return for each day
+
+    Returns:
+        covid_api_data: data in the same format as Cov19API.get_json
+        modified: False if no page of the data has changed
+    """
+    api_params = Cov19API(filters=api_request, structure=structure).api_params
+    covid_api_data = {'data': []}
+    modified = False
+    page = 1
+    while True:
+        page_params = dict(api_params, format='json', page=page)
+        page_data, page_modified = data_sources.get_json('covid', page_params,
+            timeout=get_request_timeout())
+        if page_data is None: # 204, past the last page
+            break
+        modified = modified or page_modified
+        covid_api_data['data'].extend(page_data['data'])
+        if page_data.get('pagination', {}).get('next') is None:
+            break
+        page += 1
+    covid_api_data['lastUpdate'] = data_sources.get_last_modified('covid',
+        dict(api_params, format='json', page=1))
+    covid_api_data['length'] = len(covid_api_data['data'])
+    covid_api_data['totalPages'] = page
+    return covid_api_data, modified
 
 def process_region_request(region = 'Exeter') -> None:
     """ Process regional data from API for frontend
@@ -130,7 +350,7 @@ def process_region_request(region = 'Exeter') -> None:
         region: location of which data is fetched for
     """
     logging.info('Region request processing for %s', region)
-    covid_API_request('', 'LTLA') # request data from api
+    covid_API_request(None, 'LTLA') # request data from api
     process_covid_api_data('region')
 
 def process_nation_request(nation = 'England') -> None:
@@ -140,93 +360,347 @@ def process_nation_request(nation = 'England') -> None:
         nation: location of which data is fetched for
     """
     logging.info('Nation request processing for %s', nation)
-    covid_API_request('', 'nation') # request data from api
+    covid_API_request(None, 'nation') # request data from api
     process_covid_api_data('nation')
 
-def process_covid_api_data(area_type: str) -> tuple:
+def get_area_name(area_type: str) -> str:
+    """ Returns the name of the default area shown for an area type, from config_file.ini """
+    if area_type == 'region':
+        return config['covid_defaults']['region']
+    return config['covid_defaults']['nation']
+
+def get_snapshot() -> dict:
+    """ Returns the snapshot named in config_file.ini, None if there is none.
+
+    The snapshot is memory mapped, and mapped again only if it is rewritten.
+    """
+    return covid_snapshot.get_loaded_snapshot(
+        config.get('covid_store', 'snapshot', fallback='covid_snapshot'))
+
+def write_covid_snapshot() -> None:
+    """ Writes the store to the snapshot named in config_file.ini, if the store has
+    changed since the last snapshot. Every worker then maps the one copy.
+
+    Only the areas whose store version differs from the snapshot's are read from
+    the store, the rest are copied from the current snapshot.
+    """
+    if not snapshot_state['changed']:
+        return
+    snapshot_state['changed'] = False
+    snapshot = get_snapshot()
+    areas = {}
+    versions = {}
+    for area_type, area_name, version in covid_data_store.get_areas():
+        # the version is read first, so records newer than it are never marked as current
+        versions[(area_type, area_name)] = version
+        if snapshot is None or (area_type, area_name) not in snapshot['areas'] \
+            or snapshot['versions'].get((area_type, area_name)) != version:
+            areas[(area_type, area_name)] = covid_data_store.read_area_records(
+                area_type, area_name)
+    if not areas: # written by another worker
+        return
+    covid_snapshot.write_snapshot(config.get('covid_store', 'snapshot',
+        fallback='covid_snapshot'), areas, versions, snapshot)
+
+def seed_covid_data_store(area_type: str, area_name: str = None) -> None:
+    """ Loads an area into the store from the snapshot, if it has no data yet.
+
+    The default areas are loaded from their json files if there is no snapshot.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area, defaults to the area in config_file.ini
+    """
+    area_name = area_name or get_area_name(area_type)
+    snapshot = get_snapshot()
+    series = None if snapshot is None else covid_snapshot.snapshot_series(
+        snapshot, area_type, area_name)
+    if series is not None:
+        covid_data_store.upsert_records(area_type, area_name,
+            covid_snapshot.series_records(series, area_name))
+        logging.info('Data store seeded from snapshot for %s', area_name)
+        return
+    if area_name != get_area_name(area_type):
+        return
+    try:
+        with open(covid_data_files[area_type], 'r', encoding='UTF-8') as covid_json:
+            covid_data = json.load(covid_json)
+    except FileNotFoundError:
+        logging.warning('Warning: No stored data or json file for: %s', area_type)
+        return
+    covid_data_store.upsert_records(area_type, get_area_name(area_type), covid_data['data'])
+    logging.info('Data store seeded from %s', covid_data_files[area_type])
+
+def load_covid_data(area_type: str, area_name: str = None, seed: bool = True) -> dict:
+    """ Returns the cache entry for an area, reloading it if the store has changed.
+
+    Only the recent window of days needed for the dashboard is read. The store version
+    is checked on every call, so a refresh by any worker invalidates the cache. The
+    cache holds a limited number of areas, the least recently used is evicted first.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area, defaults to the area in config_file.ini
+        seed: if False an empty store is not seeded from the bundled data
+
+    Returns:
+        cache_entry: dictionary holding the store version, recent records
+            and processed data (None if not yet calculated)
+    """
+    if not area_name:
+        area_name = get_area_name(area_type)
+    version = covid_data_store.get_area_version(area_type, area_name)
+    if version is None and seed: # nothing stored yet
+        seed_covid_data_store(area_type, area_name)
+        version = covid_data_store.get_area_version(area_type, area_name)
+    key = (area_type, area_name)
+    with cache_lock:
+        cache_entry = covid_data_cache.get(key)
+        if cache_entry is not None and cache_entry['version'] == version:
+            covid_data_cache.move_to_end(key)
+            return cache_entry
+    # not loaded yet or the data has been refreshed since it was cached
+    cache_entry = {'version': version, 'records': covid_data_store.read_recent_records(
+        area_type, area_name, config.getint('covid_store', 'recent_window', fallback=30)),
+        'processed': None}
+    with cache_lock:
+        cache_stats['refreshes'] += 1
+        covid_data_cache[key] = cache_entry
+        covid_data_cache.move_to_end(key)
+        while len(covid_data_cache) > config.getint('covid_store', 'cache_size', fallback=256):
+            covid_data_cache.popitem(last=False)
+            cache_stats['evictions'] += 1
+    return cache_entry
+
+def get_data_version(area_type: str, area_name: str = None) -> int:
+    """ Returns the store version of an area's data, changes whenever the data is refreshed
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area, defaults to the area in config_file.ini
+    """
+    return covid_data_store.get_area_version(area_type, area_name or get_area_name(area_type))
+
+def get_data_refreshed(area_type: str, area_name: str = None) -> float:
+    """ Returns when an area's data was last checked against the api, None if never
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area, defaults to the area in config_file.ini
+    """
+    return covid_data_store.get_refreshed_time(area_type, area_name or get_area_name(area_type))
+
+def get_data_trend(area_type: str, area_name: str = None) -> dict:
+    """ Returns the change in an area's 7 day rate over recent weeks, None if there is no data
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area, defaults to the area in config_file.ini
+    """
+    return covid_history.get_trend(area_type, area_name or get_area_name(area_type))
+
+def get_cache_stats() -> dict:
+    """ Returns a copy of the covid data cache hit and miss counters """
+    with cache_lock:
+        return dict(cache_stats, size=len(covid_data_cache))
+
+def note_missing_area(area_type: str, area_name: str) -> None:
+    """ Remembers that the api returned no data for an area, so it is not requested
+    again until missing_expiry seconds (config_file.ini) have passed.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+    """
+    state.set_value('missing_areas', area_type + '/' + area_name, time.time())
+    logging.warning('Warning: No data returned for %s', area_name)
+
+def is_missing_area(area_type: str, area_name: str) -> bool:
+    """ Returns True if the api returned no data for an area within missing_expiry seconds
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+    """
+    noted = state.get_value('missing_areas', area_type + '/' + area_name)
+    return noted is not None and time.time() - noted < config.getfloat(
+        'covid_store', 'missing_expiry', fallback=3600)
+
+def remove_expired_missing_areas() -> None:
+    """ Forgets areas noted as missing more than missing_expiry seconds ago """
+    expiry = config.getfloat('covid_store', 'missing_expiry', fallback=3600)
+    for key, noted in state.get_items('missing_areas'):
+        if time.time() - noted >= expiry:
+            state.remove_item('missing_areas', key)
+
+def request_area(area_type: str, area_name: str) -> None:
+    """ Queues an area that has no stored data to be fetched in the next batch.
+
+    The batch runs shortly afterwards on the data scheduler, so the request that
+    asked for the area never waits on the api. Areas the api recently returned no
+    data for are not queued, and at most max_pending areas (config_file.ini) are
+    queued at once, so requests for unknown areas cannot cause repeated downloads.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+    """
+    if is_missing_area(area_type, area_name):
+        return
+    with cache_lock:
+        if area_name in pending_areas[area_type]:
+            return
+        if sum(len(names) for names in pending_areas.values()) >= config.getint(
+            'covid_store', 'max_pending', fallback=16):
+            logging.warning('Warning: Too many areas waiting to be fetched, %s not queued',
+                area_name)
+            return
+        first_pending = not pending_areas['region'] and not pending_areas['nation']
+        pending_areas[area_type].add(area_name)
+    if first_pending:
+        data_sched.enter(config.getfloat('covid_store', 'batch_delay', fallback=5), 1,
+            execute_pending_requests)
+        logging.info('Batch request scheduled, first area: %s', area_name)
+
+def execute_pending_requests() -> None:
+    """ Fetches every area queued by request_area, batched by area type """
+    with cache_lock:
+        batches = {area_type: list(names) for area_type, names in pending_areas.items()}
+        for names in pending_areas.values():
+            names.clear()
+    remove_expired_missing_areas()
+    for area_type, area_names in batches.items():
+        covid_API_batch_request(area_type, area_names)
+    write_covid_snapshot()
+
+@timed
+def process_covid_api_data(area_type: str, area_name: str = None,
+    request_missing: bool = True, record: bool = True) -> tuple:
     """ Function to process data from the covid API.
 
-    Loads data from json files - 'region_covid_data.json' and
-    'nation_covid_data.json'. Calculates 7 day infection rate
-    based on api data.
+    Loads the recent data for the area from the data store. Calculates 7 day
+    infection rate based on api data. The result is cached until the store changes.
+    If the store has no data for the area it is queued to be fetched and
+    None values are returned until it arrives.
 
     Arguments:
         area_type: the area that the data is being fetched for, determines how data is processed
+        area_name: name of the area, defaults to the area in config_file.ini
+        request_missing: if False an area with no stored data is not queued to be fetched
+        record: if False nothing is written, the store is not seeded, no area is
+            queued and the metrics are not shared with other workers
 
     Returns:
+        area_name: name of the area the data is for
         seven_day_rate: Cumulative cases in last 7 days, excluding empty and
             incomplete cell
         hospital_cases: current number of hospitalisations
         deaths: total number of deaths in desired region
     """
-    seven_day_rate = 0
-    no_of_days_ignore = 2 # the number of days of data skipped due to no data uploaded
-    no_of_days_counted = 0
-    hospital_cases = None
-    deaths = None
-    # load covid data from json
-    if area_type == 'region':
-        with open('region_covid_data.json', 'r', encoding='UTF-8') as covid_json:
-            covid_data = json.load(covid_json)
-    else:
-        with open('nation_covid_data.json', 'r', encoding='UTF-8') as covid_json:
-            covid_data = json.load(covid_json)
+    if area_type != 'region':
+        area_type = 'nation'
+    if not area_name:
+        area_name = get_area_name(area_type)
+    cache_entry = load_covid_data(area_type, area_name, seed=record)
+    if cache_entry['version'] is None: # no data stored for this area yet
+        if request_missing and record:
+            request_area(area_type, area_name)
+        if area_type == 'nation':
+            return area_name, None, None, None
+        return area_name, None
+    if cache_entry['processed'] is not None:
+        with cache_lock:
+            cache_stats['hits'] += 1
+        return cache_entry['processed']
+    with cache_lock:
+        cache_stats['misses'] += 1
+    shared_metrics = state.get_value('metrics', area_type + '/' + area_name)
+    if shared_metrics is not None and shared_metrics['version'] == cache_entry['version']:
+        # already calculated by another worker
+        cache_entry['processed'] = tuple(shared_metrics['processed'])
+        return cache_entry['processed']
+    processed = calculate_covid_api_data(cache_entry['records'], area_type, area_name)
+    if area_type == 'nation' and None in processed[2:]:
+        # value not reported within the recent window, look further back
+        processed = processed[:2] + (
+            processed[2] if processed[2] is not None else covid_data_store.latest_value(
+                area_type, area_name, 'hospitalCases'),
+            processed[3] if processed[3] is not None else covid_data_store.latest_value(
+                area_type, area_name, 'cumDailyNsoDeathsByDeathDate'))
+    cache_entry['processed'] = processed
+    if record:
+        state.set_value('metrics', area_type + '/' + area_name,
+            {'version': cache_entry['version'], 'processed': processed})
+    return processed
+
+def calculate_covid_api_data(covid_data_entries: list[dict], area_type: str,
+    area_name: str) -> tuple:
+    """ Calculates the values shown on the dashboard from the api records.
 
-    covid_data_entries = covid_data['data']
-    for daily_data in covid_data_entries:
-        if daily_data['newCasesBySpecimenDate'] is None: # if the data column is empty
-            no_of_days_ignore +=1
-            logging.warning("Warning: More case data than expected empty.\
- Data for %s missing. API may not be up to date.", str(daily_data['date']))
-            # adds an extra day to skip over to find complete data for 7 day rate
-        no_of_days_ignore -= 1
-        if area_type == 'nation': # if data is for nation, more is processed
-            if deaths is None and daily_data['cumDailyNsoDeathsByDeathDate'] is not None:
-                deaths = daily_data['cumDailyNsoDeathsByDeathDate']
-            if daily_data['hospitalCases'] is not None and hospital_cases is None:
-                hospital_cases = daily_data['hospitalCases']
-        if no_of_days_ignore <= 0 and no_of_days_counted <= 6:
-            seven_day_rate += daily_data['newCasesBySpecimenDate']
-            no_of_days_counted +=1
+    Arguments:
+        covid_data_entries: list of daily records, most recent first
+        area_type: 'region' or 'nation', determines how data is processed
+        area_name: name of the area, returned as the first value
+
+    Returns:
+        see process_covid_api_data
+    """
+    seven_day_rate, hospital_cases, deaths = covid_metrics.latest_metrics(
+        covid_metrics.series_from_records(covid_data_entries), 'api')
     if area_type == 'nation': # returns data
         logging.info('Returning API data for: %s', area_type)
-        return 'England', seven_day_rate, hospital_cases, deaths
+        return area_name, seven_day_rate, hospital_cases, deaths
     else:
         logging.info('Returning API data for: %s', area_type)
-        return 'Exeter', seven_day_rate
+        return area_name, seven_day_rate
 
 def schedule_covid_updates (update_name: str, update_interval: int) -> None:
-    """ Creates scheduler for covid data that calls execute_update
+    """ Adds a covid data refresh, calling execute_update, to a scheduled update
 
-    Create scheduler to update covid data based on user specified time,
+    Registers the update to refresh covid data based on user specified time,
     in order to update the covid data that is shown to the user.
 
     Arguments:
         update_name: the name of the update, specified by user, used as an identifier
         update_interval: the time until the update is requested to occur
     """
-    data_sched.enter(update_interval, 1, execute_update, (update_name,))
-    logging.info('Schedule created for: %s', update_name)
+    if add_update(update_name, update_interval, {'data': execute_update}):
+        logging.info('Schedule created for: %s', update_name)
 
 def execute_update(update_name: str) -> None:
     """ Function executed by scheduler to update covid data on the frontend.
 
-    Refreshes the data in the json files, by querying the api again.
+    Refreshes the data in the data store, by querying the api again.
+    Updates due at the same time share one refresh (see run_single_flight).
 
     Arguments:
         update_name: the name of the update, specified by user, used as an identifier
     """
     logging.info('Schedule execure for: %s', update_name)
-    process_region_request() # refresh data in region json
-    process_nation_request() # refresh data in nation json
+    run_single_flight('covid_data', refresh_covid_data)
 
-def delete_scheduled_data_event(item_name: str) -> None: # needs reworking
+def refresh_covid_data() -> None:
+    """ Requests the default region and nation concurrently with batches for
+    any other areas currently cached, if any request fails its last data is kept.
+    """
+    tasks = {'region': process_region_request, 'nation': process_nation_request}
+    with cache_lock:
+        cached_areas = list(covid_data_cache)
+    for area_type in ('region', 'nation'):
+        area_names = [name for cached_type, name in cached_areas
+            if cached_type == area_type and name != get_area_name(area_type)]
+        if area_names:
+            tasks[area_type + ' areas'] = lambda area_type=area_type, area_names=area_names:\
+                covid_API_batch_request(area_type, area_names)
+    # refresh all the data at the same time
+    run_concurrently(tasks)
+    write_covid_snapshot()
+
+def delete_scheduled_data_event(item_name: str) -> None:
     """ Function to delete a scheduled update for data if requested by the user (x is pressed)
 
     Arguments:
-        update_name: the name of the update, specified by user, used as an identifier
+        item_name: the name of the update, specified by user, used as an identifier
     """
-    for event in data_sched.queue:
-        if event.argument == item_name:
-            data_sched.cancel(event)
-            logging.info('Schedule deleted for: %s', item_name)
+    if cancel_update(item_name, 'data'):
+        logging.info('Schedule deleted for: %s', item_name)
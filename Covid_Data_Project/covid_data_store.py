@@ -0,0 +1,146 @@
+""" Module for storing covid data in a local SQLite time series store
+for the covid data dashboard.
+Daily records are keyed by area and date, so a refresh only writes the days
+that are new or have been revised, and the dashboard reads only the recent
+days it needs rather than the whole history.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import sqlite3
+import threading
+import time
+import logging
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+metric_columns = ['newCasesBySpecimenDate', 'hospitalCases', 'cumDailyNsoDeathsByDeathDate']
+connections = threading.local() # one connection per thread
+
+def get_connection() -> sqlite3.Connection:
+    """ Returns this thread's connection to the store, creating the tables if needed """
+    connection = getattr(connections, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(config.get('covid_store', 'database',
+            fallback='covid_data.db'), timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL') # readers do not block the writer
+        connection.execute('''CREATE TABLE IF NOT EXISTS covid_data (
+            area_type TEXT, area_name TEXT, date TEXT,
+            newCasesBySpecimenDate INTEGER, hospitalCases INTEGER,
+            cumDailyNsoDeathsByDeathDate INTEGER,
+            PRIMARY KEY (area_type, area_name, date)) WITHOUT ROWID''')
+        connection.execute('''CREATE TABLE IF NOT EXISTS area_versions (
+            area_type TEXT, area_name TEXT, version INTEGER,
+            PRIMARY KEY (area_type, area_name))''')
+        connection.execute('''CREATE TABLE IF NOT EXISTS area_refreshes (
+            area_type TEXT, area_name TEXT, refreshed REAL,
+            PRIMARY KEY (area_type, area_name))''')
+        connection.commit()
+        connections.connection = connection
+    return connection
+
+def upsert_records(area_type: str, area_name: str, records: list[dict]) -> int:
+    """ Inserts new days and updates revised days for an area.
+
+    Days that are unchanged are left alone. If any day changed the area's
+    version is increased so caches in every worker know to reload.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area, e.g. 'Exeter'
+        records: daily records from the api, containing 'date' and any metric columns
+
+    Returns:
+        changed: the number of days inserted or updated
+    """
+    connection = get_connection()
+    rows = [(area_type, area_name, record['date'])
+        + tuple(record.get(column) for column in metric_columns) for record in records]
+    with connection: # one transaction for the whole refresh
+        changes_before = connection.total_changes
+        connection.executemany('''INSERT INTO covid_data VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (area_type, area_name, date) DO UPDATE SET
+            newCasesBySpecimenDate = excluded.newCasesBySpecimenDate,
+            hospitalCases = excluded.hospitalCases,
+            cumDailyNsoDeathsByDeathDate = excluded.cumDailyNsoDeathsByDeathDate
+            WHERE newCasesBySpecimenDate IS NOT excluded.newCasesBySpecimenDate
+            OR hospitalCases IS NOT excluded.hospitalCases
+            OR cumDailyNsoDeathsByDeathDate IS NOT excluded.cumDailyNsoDeathsByDeathDate''', rows)
+        changed = connection.total_changes - changes_before
+        if changed:
+            connection.execute('''INSERT INTO area_versions VALUES (?, ?, 1)
+                ON CONFLICT (area_type, area_name) DO UPDATE SET version = version + 1''',
+                (area_type, area_name))
+    logging.info('%s days changed in store for %s', changed, area_name)
+    return changed
+
+def get_area_version(area_type: str, area_name: str) -> int:
+    """ Returns the version of an area's data, None if the store has no data for it """
+    row = get_connection().execute('''SELECT version FROM area_versions
+        WHERE area_type = ? AND area_name = ?''', (area_type, area_name)).fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+def mark_refreshed(area_type: str, area_name: str) -> None:
+    """ Records that an area's data was checked against the api, whether or not it changed """
+    connection = get_connection()
+    with connection:
+        connection.execute('''INSERT INTO area_refreshes VALUES (?, ?, ?)
+            ON CONFLICT (area_type, area_name) DO UPDATE SET refreshed = excluded.refreshed''',
+            (area_type, area_name, time.time()))
+
+def get_areas() -> list[tuple]:
+    """ Returns (area type, area name, version) for every area with stored data """
+    return get_connection().execute('SELECT area_type, area_name, version FROM area_versions'
+        ).fetchall()
+
+def get_refreshed_time(area_type: str, area_name: str) -> float:
+    """ Returns when an area's data was last checked against the api, None if never """
+    row = get_connection().execute('''SELECT refreshed FROM area_refreshes
+        WHERE area_type = ? AND area_name = ?''', (area_type, area_name)).fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+def read_recent_records(area_type: str, area_name: str, days: int) -> list[dict]:
+    """ Reads the most recent days of data for an area.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+        days: the number of days to read
+
+    Returns:
+        records: daily records in the same format as the api, most recent first
+    """
+    rows = get_connection().execute('''SELECT date, newCasesBySpecimenDate, hospitalCases,
+        cumDailyNsoDeathsByDeathDate FROM covid_data WHERE area_type = ? AND area_name = ?
+        ORDER BY date DESC LIMIT ?''', (area_type, area_name, days)).fetchall()
+    return [dict(zip(['date'] + metric_columns, row), areaName=area_name) for row in rows]
+
+def read_area_records(area_type: str, area_name: str) -> list[dict]:
+    """ Reads every stored day of data for an area, in the same format as read_recent_records """
+    rows = get_connection().execute('''SELECT date, newCasesBySpecimenDate, hospitalCases,
+        cumDailyNsoDeathsByDeathDate FROM covid_data WHERE area_type = ? AND area_name = ?
+        ORDER BY date DESC''', (area_type, area_name)).fetchall()
+    return [dict(zip(['date'] + metric_columns, row), areaName=area_name) for row in rows]
+
+def latest_value(area_type: str, area_name: str, column: str):
+    """ Returns the most recent non empty value of a metric for an area.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+        column: one of metric_columns
+    """
+    if column not in metric_columns:
+        raise ValueError('Unknown metric: ' + column)
+    row = get_connection().execute('SELECT ' + column + ''' FROM covid_data
+        WHERE area_type = ? AND area_name = ? AND ''' + column + ''' IS NOT NULL
+        ORDER BY date DESC LIMIT 1''', (area_type, area_name)).fetchone()
+    if row is None:
+        return None
+    return row[0]
@@ -0,0 +1,307 @@
+""" Module for the historical covid metrics of the covid data dashboard.
+A history index holds, for every stored day of an area (oldest first), the 7
+day sum of cases as the dashboard calculated it on that day, prefix sums of
+the daily cases and the latest known hospital cases and deaths. Queries such
+as the 7 day rate on any date or the change over the last few weeks are then
+a binary search and a subtraction, rather than a scan of the daily records.
+When an area is refreshed only the days from the first new or revised day
+onwards are calculated again. An area's days are read from the memory mapped
+snapshot when it holds the area's current version, otherwise from the store.
+An index is never changed once built, a refresh
+replaces it, so a request reading an index always sees one consistent version.
+Indexes are kept for at most cache_size areas (config_file.ini [covid_store]),
+the least recently used is evicted first.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import collections
+import threading
+import logging
+import numpy as np
+import covid_data_store
+import covid_metrics
+import covid_snapshot
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+# (area type, area name) -> the index for the store version it was built from,
+# least recently used first
+history_indexes = collections.OrderedDict()
+history_lock = threading.Lock()
+history_stats = {'builds': 0, 'updates': 0, 'days_calculated': 0, 'evictions': 0,
+    'snapshot_reads': 0}
+latest_columns = {'hospital_cases': 'hospitalCases', 'deaths': 'cumDailyNsoDeathsByDeathDate'}
+
+def build_index(series: dict) -> dict:
+    """ Builds a history index from a series.
+
+    Arguments:
+        series: as returned by covid_metrics.series_from_records
+
+    Returns:
+        index: the series' columns together with, for every date, 'seven_day_cases',
+            'hospital_cases' and 'deaths' and 'case_totals', the prefix sums of
+            cases (case_totals[i] is the total of the days before day i)
+    """
+    index = dict(series, seven_day_cases=np.zeros(0), case_totals=np.zeros(1),
+        hospital_cases=np.zeros(0), deaths=np.zeros(0))
+    return calculate_from(index, 0)
+
+def calculate_from(index: dict, start: int) -> dict:
+    """ Returns a new index with the metrics from day start onwards calculated again.
+
+    The metrics before start are kept, so start must be the first day that is new or revised.
+    """
+    cases = index['newCasesBySpecimenDate']
+    valid_before = np.flatnonzero(~np.isnan(cases[:start]))
+    # the 7 day sum skips the most recent non empty day, so no window for a day from
+    # start onwards begins before the window ending at the second last non empty day
+    window_start = max(valid_before[-2] - 6, 0) if len(valid_before) > 1 else 0
+    seven_day_cases = covid_metrics.api_window_sums(cases[window_start:])[start - window_start:]
+    case_totals = index['case_totals'][start] + np.cumsum(np.nan_to_num(cases[start:]))
+    updated = dict(index,
+        seven_day_cases=np.concatenate((index['seven_day_cases'][:start], seven_day_cases)),
+        case_totals=np.concatenate((index['case_totals'][:start + 1], case_totals)))
+    for name, column in latest_columns.items():
+        previous = index[name][start - 1] if start else np.nan
+        latest = covid_metrics.latest_known(index[column][start:])
+        updated[name] = np.concatenate((index[name][:start],
+            np.where(np.isnan(latest), previous, latest)))
+    with history_lock:
+        history_stats['days_calculated'] += len(cases) - start
+    return updated
+
+def update_index(index: dict, series: dict) -> dict:
+    """ Returns a new index with the days of a series merged in.
+
+    Days already in the index are replaced by the series, only the metrics from
+    the first day that changed are calculated again.
+
+    Arguments:
+        index: as returned by build_index
+        series: new and revised days, as returned by covid_metrics.series_from_records
+
+    Returns:
+        index: the updated index, the same index if no day changed
+    """
+    dates = index['date']
+    positions = np.searchsorted(dates, series['date'])
+    if len(dates):
+        existing = (positions < len(dates)) & (
+            dates[np.minimum(positions, len(dates) - 1)] == series['date'])
+    else:
+        existing = np.zeros(len(positions), dtype=bool)
+    merged = dict(index)
+    start = len(dates)
+    for column in covid_metrics.metric_columns:
+        old_values = index[column][positions[existing]]
+        new_values = series[column][existing]
+        changed = ~((old_values == new_values) | (np.isnan(old_values) & np.isnan(new_values)))
+        if changed.any():
+            merged[column] = index[column].copy()
+            merged[column][positions[existing]] = new_values
+            start = min(start, positions[existing][changed].min())
+    if (~existing).any():
+        new_dates = series['date'][~existing]
+        start = min(start, np.searchsorted(dates, new_dates.min()))
+        order = np.argsort(np.concatenate((dates, new_dates)), kind='stable')
+        for column in ['date'] + covid_metrics.metric_columns:
+            merged[column] = np.concatenate((merged[column], series[column][~existing]))[order]
+    if start == len(merged['date']):
+        return index
+    return calculate_from(merged, int(start))
+
+def get_history(area_type: str, area_name: str) -> dict:
+    """ Returns the history index for an area, None if the store has no data for it.
+
+    The index is built the first time it is needed. If the store has changed since,
+    the area's days are read again (see read_series) and merged in with update_index.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+    """
+    version = covid_data_store.get_area_version(area_type, area_name)
+    if version is None:
+        return None
+    key = (area_type, area_name)
+    with history_lock:
+        index = history_indexes.get(key)
+        if index is not None:
+            history_indexes.move_to_end(key)
+    if index is not None and index['version'] == version:
+        return index
+    series = read_series(area_type, area_name, version)
+    if index is None:
+        index = build_index(series)
+        stat = 'builds'
+    else:
+        index = update_index(index, series)
+        stat = 'updates'
+    index = dict(index, version=version)
+    store_index(key, index, stat)
+    return index
+
+def read_series(area_type: str, area_name: str, version: int) -> dict:
+    """ Returns every stored day of an area as a series.
+
+    The days are taken from the memory mapped snapshot if it holds this version of
+    the area, so workers share its pages, otherwise they are read from the store.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+        version: the area's current store version
+    """
+    snapshot = covid_snapshot.get_loaded_snapshot(
+        config.get('covid_store', 'snapshot', fallback='covid_snapshot'))
+    if snapshot is not None and snapshot['versions'].get((area_type, area_name)) == version:
+        with history_lock:
+            history_stats['snapshot_reads'] += 1
+        return covid_snapshot.snapshot_series(snapshot, area_type, area_name)
+    return covid_metrics.series_from_records(
+        covid_data_store.read_area_records(area_type, area_name))
+
+def store_index(key: tuple, index: dict, stat: str) -> None:
+    """ Keeps an area's index, evicting the least recently used over cache_size areas
+
+    Arguments:
+        key: (area type, area name)
+        index: the new index
+        stat: the counter to add one to, 'builds' or 'updates'
+    """
+    with history_lock:
+        history_stats[stat] += 1
+        history_indexes[key] = index
+        history_indexes.move_to_end(key)
+        while len(history_indexes) > config.getint('covid_store', 'cache_size', fallback=256):
+            history_indexes.popitem(last=False)
+            history_stats['evictions'] += 1
+
+def update_history(area_type: str, area_name: str, records: list[dict]) -> None:
+    """ Merges days just written to the store into an area's index, if it has been built.
+
+    Called by the refresh, so the store does not have to be read again.
+
+    Arguments:
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+        records: the daily records written to the store, most recent first
+    """
+    key = (area_type, area_name)
+    with history_lock:
+        index = history_indexes.get(key)
+    if index is None:
+        return
+    index = dict(update_index(index, covid_metrics.series_from_records(records)),
+        version=covid_data_store.get_area_version(area_type, area_name))
+    store_index(key, index, 'updates')
+    logging.info('History index updated for %s', area_name)
+
+def get_history_stats() -> dict:
+    """ Returns a copy of the history index counters """
+    with history_lock:
+        return dict(history_stats, areas=len(history_indexes))
+
+def to_date(date) -> np.datetime64:
+    """ Converts a date, e.g. '2021-10-28', to a datetime64 day.
+
+    Raises:
+        ValueError: if the date is not a valid ISO date
+    """
+    return np.datetime64(date, 'D')
+
+def position_on(index: dict, date = None) -> int:
+    """ Returns the position of the last day on or before a date, -1 if there is none.
+
+    Arguments:
+        index: as returned by get_history
+        date: the date, the most recent day if None
+    """
+    if date is None:
+        return len(index['date']) - 1
+    return int(np.searchsorted(index['date'], to_date(date), side='right')) - 1
+
+def value_on(index: dict, name: str, date = None) -> int:
+    """ Returns a metric as it was on a date, None if unknown.
+
+    Arguments:
+        index: as returned by get_history
+        name: 'seven_day_cases', 'hospital_cases' or 'deaths'
+        date: the date, the most recent day if None
+    """
+    position = position_on(index, date)
+    if position < 0 or np.isnan(index[name][position]):
+        return None
+    return int(index[name][position])
+
+def cases_between(index: dict, start = None, end = None) -> int:
+    """ Returns the total of the daily cases from start to end, inclusive.
+
+    Arguments:
+        index: as returned by get_history
+        start: the first date, the first stored day if None
+        end: the last date, the most recent day if None
+    """
+    first = 0 if start is None else int(np.searchsorted(index['date'], to_date(start)))
+    last = position_on(index, end)
+    if last < first:
+        return 0
+    return int(index['case_totals'][last + 1] - index['case_totals'][first])
+
+def weekly_change(index: dict, weeks: int, date = None) -> dict:
+    """ Returns how the 7 day rate has changed over a number of weeks.
+
+    Arguments:
+        index: as returned by get_history
+        weeks: the number of weeks to compare over
+        date: the date to compare to, the most recent day if None
+
+    Returns:
+        change: dictionary of 'date', 'weeks', 'seven_day_rate', 'previous_rate',
+            'change' and 'percent_change', None where unknown
+    """
+    position = position_on(index, date)
+    if position < 0:
+        return {'date': None, 'weeks': weeks, 'seven_day_rate': None, 'previous_rate': None,
+            'change': None, 'percent_change': None}
+    day = index['date'][position]
+    current = value_on(index, 'seven_day_cases', day)
+    previous = value_on(index, 'seven_day_cases', day - 7 * weeks)
+    change = None if current is None or previous is None else current - previous
+    return {'date': str(day), 'weeks': weeks, 'seven_day_rate': current,
+        'previous_rate': previous, 'change': change,
+        'percent_change': round(change / previous * 100, 1) if change is not None and previous
+            else None}
+
+def history_days(index: dict, start = None, end = None) -> list[dict]:
+    """ Returns the metrics for each day from start to end, inclusive, oldest first.
+
+    Arguments:
+        index: as returned by get_history
+        start: the first date, the first stored day if None
+        end: the last date, the most recent day if None
+    """
+    first = 0 if start is None else int(np.searchsorted(index['date'], to_date(start)))
+    stop = max(position_on(index, end) + 1, first)
+    columns = {'date': index['date'][first:stop].astype(str).tolist()}
+    for name, column in (('cases', 'newCasesBySpecimenDate'),
+        ('seven_day_rate', 'seven_day_cases'), ('hospital_cases', 'hospital_cases'),
+        ('deaths', 'deaths')):
+        values = index[column][first:stop]
+        converted = np.nan_to_num(values).astype(np.int64).astype(object)
+        converted[np.isnan(values)] = None
+        columns[name] = converted.tolist()
+    return [dict(zip(columns, day)) for day in zip(*columns.values())]
+
+def get_trend(area_type: str, area_name: str) -> dict:
+    """ Returns the change in an area's 7 day rate over the weeks set in config_file.ini,
+    see weekly_change. None if the store has no data for the area.
+    """
+    index = get_history(area_type, area_name)
+    if index is None:
+        return None
+    return weekly_change(index, config.getint('covid_history', 'trend_weeks', fallback=4))
@@ -0,0 +1,127 @@
+""" Module for calculating covid metrics from daily time series
+for the covid data dashboard.
+Series are held as NumPy arrays in date order (oldest first) and the rolling
+7 day sums, latest hospital cases and cumulative deaths are calculated for
+every date at once, rather than by looping over the daily records.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import numpy as np
+
+metric_columns = ['newCasesBySpecimenDate', 'hospitalCases', 'cumDailyNsoDeathsByDeathDate']
+
+def series_from_records(records: list[dict]) -> dict:
+    """ Converts daily records from the api or data store into a series of arrays.
+
+    Arguments:
+        records: list of daily records, most recent first (as returned by the api)
+
+    Returns:
+        series: dictionary of 'date' -> datetime64 array and metric name -> float
+            array (NaN where the value is empty), oldest first
+    """
+    records = records[::-1]
+    series = {'date': np.array([record['date'] for record in records], dtype='datetime64[D]')}
+    for column in metric_columns:
+        series[column] = np.array([np.nan if record.get(column) is None else record[column]
+            for record in records], dtype=float)
+    return series
+
+def api_window_sums(cases: np.ndarray, window: int = 7, skip: int = 1) -> np.ndarray:
+    """ Rolling sum of cases as calculated from api data, for every date.
+
+    Matches process_covid_api_data: the most recent non empty day is treated as
+    incomplete and skipped, along with any empty days after it. The sum is then
+    taken over the window of consecutive days ending at the next non empty day.
+    An empty day inside the window makes the sum NaN.
+
+    Arguments:
+        cases: daily cases, oldest first, NaN where empty
+        window: the number of days summed
+        skip: the number of recent non empty days treated as incomplete
+
+    Returns:
+        sums: the sum as it would have been calculated on each date, NaN if unknown
+    """
+    valid = ~np.isnan(cases)
+    prefix = np.concatenate(([0], np.cumsum(np.where(valid, cases, 0))))
+    missing = np.concatenate(([0], np.cumsum(~valid)))
+    positions = np.flatnonzero(valid)
+    counts = np.cumsum(valid) # non empty days up to and including each date
+    sums = np.full(len(cases), np.nan)
+    has_window = counts > skip
+    end = positions[counts[has_window] - 1 - skip] # last day of each window
+    start = np.maximum(end - window + 1, 0)
+    window_sums = prefix[end + 1] - prefix[start]
+    window_sums[missing[end + 1] - missing[start] > 0] = np.nan
+    sums[has_window] = window_sums
+    return sums
+
+def csv_window_sums(cases: np.ndarray, window: int = 7, skip: int = 2) -> np.ndarray:
+    """ Rolling sum of cases as calculated from csv data, for every date.
+
+    Matches process_covid_csv_data: the two most recent days are skipped and
+    the sum is taken over the next seven non empty days.
+
+    Arguments:
+        cases: daily cases, oldest first, NaN where empty
+        window: the number of non empty days summed
+        skip: the number of recent days skipped
+
+    Returns:
+        sums: the sum as it would have been calculated on each date, NaN if unknown
+    """
+    valid = ~np.isnan(cases)
+    prefix = np.concatenate(([0], np.cumsum(cases[valid])))
+    counts = np.concatenate((np.zeros(skip, dtype=int), np.cumsum(valid)))[:len(cases)]
+    sums = prefix[counts] - prefix[np.maximum(counts - window, 0)]
+    return np.where(counts > 0, sums, np.nan)
+
+def latest_known(values: np.ndarray) -> np.ndarray:
+    """ Returns the most recent non empty value at each date (forward filled).
+
+    Arguments:
+        values: daily values, oldest first, NaN where empty
+    """
+    index = np.where(~np.isnan(values), np.arange(len(values)), -1)
+    index = np.maximum.accumulate(index) if len(index) else index
+    return np.where(index >= 0, values[np.maximum(index, 0)], np.nan)
+
+def compute_metrics(series: dict, rule: str = 'api') -> dict:
+    """ Calculates the dashboard metrics for every date of a series in one pass.
+
+    Arguments:
+        series: as returned by series_from_records
+        rule: 'api' or 'csv', the incomplete recent days rule to use for the 7 day sum
+
+    Returns:
+        metrics: dictionary of arrays, oldest first - 'date', 'seven_day_cases',
+            'seven_day_average', 'hospital_cases' and 'deaths'
+    """
+    cases = series['newCasesBySpecimenDate']
+    if rule == 'csv':
+        seven_day_cases = csv_window_sums(cases)
+    else:
+        seven_day_cases = api_window_sums(cases)
+    return {'date': series['date'],
+        'seven_day_cases': seven_day_cases,
+        'seven_day_average': seven_day_cases / 7,
+        'hospital_cases': latest_known(series['hospitalCases']),
+        'deaths': latest_known(series['cumDailyNsoDeathsByDeathDate'])}
+
+def latest_metrics(series: dict, rule: str = 'api') -> tuple:
+    """ Returns the metrics for the most recent date as python ints.
+
+    Arguments:
+        series: as returned by series_from_records
+        rule: 'api' or 'csv', see compute_metrics
+
+    Returns:
+        seven_day_cases, hospital_cases, deaths: None where the value is unknown
+    """
+    if len(series['date']) == 0:
+        return None, None, None
+    metrics = compute_metrics(series, rule)
+    return tuple(None if np.isnan(metrics[name][-1]) else int(metrics[name][-1])
+        for name in ('seven_day_cases', 'hospital_cases', 'deaths'))
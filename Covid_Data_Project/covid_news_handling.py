@@ -5,108 +5,322 @@ Part of the 2021 Assessement for ECM1400 at University of Exeter
 """
 
 import configparser
+import collections
+import hashlib
+import threading
+import os
 import time
 import sched
 import json
 import logging
-import requests
 from flask import Markup
+import news_client
+import atomic_files
+from update_pipeline import run_concurrently, run_single_flight
+from scheduler_service import wake_scheduler_service
+from update_registry import add_update, cancel_update
+from shared_state import state
+from dashboard_metrics import timed
+import dashboard_events
 
 config = configparser.ConfigParser()
 config.read('config_file.ini')
 
 news_sched = sched.scheduler(time.time, time.sleep) # create scheduler
 
+# 'store' is the loaded version of 'news_articles.json': its file id and modified time, and
+# the formatted articles keyed by article id, in the order returned by the api. A version is
+# never changed, a new version replaces it, so requests read the articles without a lock.
+# removed articles are held in the shared state as article id -> time removed by the user
+news_state = {'store': {'file_id': None, 'file_version': None,
+    'articles': collections.OrderedDict()}, 'refill_pending': False, 'last_refill': 0}
+news_lock = threading.Lock()
+news_load_lock = threading.Lock() # one thread loads a new version, the others keep the last
+
+@timed
 def news_API_request(covid_terms = 'Covid COVID-19 coronavirus') -> None:
     """ Queries news api to fetch news articles to display.
 
-    Queries https://newsapi.org/
+    Queries https://newsapi.org/ with each search term, or the terms combined
+    into as few queries as possible if combine_terms is set (see news_client),
+    run concurrently. Queries that fail are skipped. If every query fails, or
+    today's request budget is spent, the existing articles are kept and returned.
     """
     logging.info('News API called')
-    base_url = "https://newsapi.org/v2/top-headlines?"
+    covid_terms = config['news_api']['search_terms']
+    # if combined, "Covid", "COVID-19" and "coronavirus" are one query:
+    # Covid OR COVID-19 OR coronavirus
+    queries = news_client.build_queries(covid_terms.split(' '))
+    results, failures = run_concurrently({query: lambda query=query: news_search_request(query)
+        for query in queries})
+    responses = [results[query] for query in queries if query in results]
+    if not responses:
+        logging.warning('Warning: No news returned for %s, keeping existing articles',
+            ', '.join(failures))
+        return cached_news_return()
+    # merged in search term order
+    news_return = {'status': 'ok', 'articles': merge_articles(responses)}
+    news_return['totalResults'] = len(news_return['articles'])
+    shown_ids = shown_article_ids()
+    process_news_articles(news_return)
+    publish_news_changes(shown_ids)
+    return news_return
+
+def article_id(article: dict) -> str:
+    """ Returns the id of an article, a hash of its url (or title if it has no url) """
+    return hashlib.sha1((article.get('url') or article['title']).encode('UTF-8')).hexdigest()[:16]
+
+def merge_articles(responses: list[dict]) -> list[dict]:
+    """ Merges the articles from several api responses, removing duplicates.
+
+    Arguments:
+        responses: api responses, each with a list of 'articles'
+
+    Returns:
+        articles: each article once, in the order first seen
+    """
+    seen_ids = set()
+    articles = []
+    for news_return in responses:
+        for article in news_return['articles']:
+            current_id = article_id(article)
+            if current_id not in seen_ids: # if the news article is not a duplicate
+                seen_ids.add(current_id)
+                articles.append(article)
+    return articles
+
+def cached_news_return() -> dict:
+    """ Returns the articles saved by the last successful request, {} if there are none.
+
+    The articles are taken from the news store already in memory, the file is
+    only read if another worker has replaced it.
+    """
+    store = load_news_articles()
+    if store['file_id'] is None:
+        return {}
+    articles = [{'title': article['headline'], 'url': article['url'],
+        'description': article['content']} for article in store['articles'].values()]
+    news_client.count('fallbacks')
+    return {'status': 'ok', 'totalResults': len(articles), 'articles': articles, 'cached': True}
+
+def news_search_request(search_term: str) -> dict:
+    """ Makes a single request to the news api for one query, see news_client.get_news.
+
+    Arguments:
+        search_term: query the headlines must match, e.g. 'Covid OR coronavirus'
+
+    Returns:
+        news_return: the api response, raises if the request was not successful
+    """
     api_key = config['news_api']['API_key']
     language = config['news_api']['language']
-    covid_terms = config['news_api']['search_terms']
-    news_return_list = []
-    for i in covid_terms.split(' '): # queries api with "Covid", then "COVID-19", then "coronavirus"
-        # combined to form an API request
-        # api request
-        news_return = requests.get(base_url+'q='+i+"&apiKey="+api_key+'&language='+language)
-        # only gets english articles
-        news_return = news_return.json()
-        if not news_return_list: # if it is the first query
-            news_return_list = news_return
-        else:
-            for item in news_return:
-                if item not in news_return_list: # if the news article is not a duplicate
-                    news_return_list.append(item)
-    process_news_articles(news_return_list)
-    return news_return_list
+    # combined to form an API request, only gets english articles
+    # the page size sets how many articles are kept as a backlog for dismissals
+    news_return = news_client.get_news({'q': search_term, 'apiKey': api_key,
+        'language': language, 'pageSize': config.getint('news_api', 'backlog_size', fallback=50)})
+    if news_return.get('status') != 'ok':
+        raise ValueError('News API returned ' + str(news_return.get('code')))
+    return news_return
 
 def process_news_articles(news_return) -> json:
     """ Function to process data into a json file 'news_articles.json'
 
-    Loads data into a json to be stored or used later"
+    Loads data into a json to be stored or used later. The file is replaced
+    atomically, so other workers never read a partly written file, and the
+    articles become the current version without the file being read again.
 
     Arguments:
         news_return: List of news articles as dictionaries
     """
     articles = news_return['articles']
-    with open("news_articles.json", "w", encoding="UTF-8") as write_file:
-        json.dump(articles, write_file)
+    file_status = atomic_files.write_json('news_articles.json', articles)
+    set_news_store(articles, file_status)
     logging.info('News data added to JSON')
 
-def create_filtered_list(removed_articles: list[dict]) -> list[dict]:
+def set_news_store(articles: list[dict], file_status: os.stat_result) -> dict:
+    """ Makes articles the current version of the news store.
+
+    Articles are formatted for the front end once, here, rather than on every view.
+
+    Arguments:
+        articles: the articles saved in 'news_articles.json'
+        file_status: os.stat of the file they were saved in
+
+    Returns:
+        store: the new version, see news_state['store']
+    """
+    formatted_articles = collections.OrderedDict()
+    for article in articles:
+        # format article for front end display including html markup to embed urls
+        formatted_articles[article_id(article)] = {'id': article_id(article),
+            'title': Markup('<a href='+article["url"]+'>'+article["title"]+'</a>'),
+            'content': article['description'], 'headline': article['title'],
+            'url': article['url']}
+    store = {'file_id': (file_status.st_ino, file_status.st_mtime_ns),
+        'file_version': file_status.st_mtime_ns, 'articles': formatted_articles}
+    news_state['store'] = store
+    return store
+
+def load_news_articles() -> dict:
+    """ Returns the current version of the news store, loading 'news_articles.json'
+    if it has been replaced since it was loaded.
+
+    Only one thread loads the new file. Other threads keep using the version they
+    have until it is loaded, so a refresh never holds a request, unless nothing
+    has been loaded yet.
+
+    Returns:
+        store: the current version, see news_state['store']
+    """
+    store = news_state['store']
+    try:
+        file_status = os.stat('news_articles.json')
+    except FileNotFoundError:
+        logging.warning('Warning: No news articles file')
+        return store
+    if (file_status.st_ino, file_status.st_mtime_ns) == store['file_id']:
+        return store
+    if not news_load_lock.acquire(blocking=store['file_id'] is None):
+        return store # being loaded by another thread
+    try:
+        with open('news_articles.json', 'r', encoding='UTF-8') as news_json:
+            # open the json file, the version is of the file opened in case it is replaced again
+            file_status = os.fstat(news_json.fileno())
+            if (file_status.st_ino, file_status.st_mtime_ns) == news_state['store']['file_id']:
+                return news_state['store'] # loaded while waiting
+            articles = json.load(news_json)
+        return set_news_store(articles, file_status)
+    finally:
+        news_load_lock.release()
+
+def remove_article(removed_id: str) -> None:
+    """ Removes an article so it is not displayed again until the removal expires.
+
+    Arguments:
+        removed_id: id of the article removed by the user
+    """
+    expire_removed_articles()
+    shown_ids = shown_article_ids()
+    state.set_value('removed_articles', removed_id, time.time())
+    state.increment('versions', 'removed_articles')
+    logging.info('News article with id: %s removed', removed_id)
+    publish_news_changes(shown_ids)
+    check_news_backlog()
+
+def is_removed(current_id: str) -> bool:
+    """ Returns True if an article has been removed by the user and the removal has not expired """
+    removed_time = state.get_value('removed_articles', current_id)
+    return removed_time is not None and removed_time >= time.time() - config.getfloat(
+        'news_api', 'removed_expiry', fallback=604800)
+
+def available_article_count() -> int:
+    """ Returns the number of articles in the news store that have not been removed """
+    return sum(1 for current_id in news_state['store']['articles'] if not is_removed(current_id))
+
+def check_news_backlog() -> None:
+    """ Schedules a background refill of the news store if it is running low.
+
+    The refill runs on the news scheduler, never in the request that removed the
+    article, and at most once per refill_interval in config_file.ini.
+    """
+    if available_article_count() >= config.getint('news_api', 'low_water_mark', fallback=8):
+        return
+    with news_lock:
+        if news_state['refill_pending']:
+            return
+        news_state['refill_pending'] = True
+    delay = max(news_state['last_refill'] + config.getfloat('news_api', 'refill_interval',
+        fallback=300) - time.time(), 0)
+    news_sched.enter(delay, 1, refill_news_backlog)
+    wake_scheduler_service()
+    logging.info('News backlog low, refill scheduled in %s seconds', int(delay))
+
+def refill_news_backlog() -> None:
+    """ Run by the news scheduler to refill the news store from the api """
+    try:
+        run_single_flight('news', news_API_request)
+    finally:
+        news_state['last_refill'] = time.time()
+        news_state['refill_pending'] = False
+
+def expire_removed_articles() -> None:
+    """ Forgets removals older than the expiry in config_file.ini """
+    expiry_time = time.time() - config.getfloat('news_api', 'removed_expiry', fallback=604800)
+    for removed_id, removed_time in state.get_items('removed_articles'):
+        if removed_time < expiry_time:
+            state.remove_item('removed_articles', removed_id)
+
+def get_news_version() -> tuple:
+    """ Returns a value that changes whenever the news shown on the dashboard changes """
+    return load_news_articles()['file_version'], state.get_value('versions', 'removed_articles', 0)
+
+def get_news_refreshed() -> float:
+    """ Returns when the news articles were last fetched, None if they never have been """
+    file_version = load_news_articles()['file_version']
+    if file_version is None:
+        return None
+    return file_version / 1e9
+
+@timed
+def create_filtered_list(removed_articles = None) -> list[dict]:
     """ Formats news articles to be displayed on dashboard
 
-    Processes JSON data into the correct format to be presented on the
-    news tab of the dashboard
-    Selects first four articles to be displayed on front end dashboard.
-    Ensures articles to display have not already been removed by displaying it against
-    the 'removed_articles' list.
+    Selects the first articles from the news store to be displayed on front end
+    dashboard. Ensures articles to display have not already been removed by checking
+    them against the set of removed article ids.
 
     Arguments:
-        removed_articles: list of articles that have been removed by the user,
-            so should not be displayed again
+        removed_articles: optional extra ids of articles that should not be displayed
 
     Returns:
         filtered_list: list of dictionaries storing formatted articles
     """
+    articles = load_news_articles()['articles']
+    excluded_ids = set(removed_articles or ())
     filtered_list = []
-    current_location = 0
-    with open('news_articles.json', 'r', encoding='UTF-8') as news_json:
-        # open the json file
-        news_return = json.load(news_json)
-        list_of_articles = []
-        for article in news_return:
-            # format article for front end display including html markup to embed urls
-            list_of_articles.append({'title': Markup('<a href='+article["url"]+'>'
-            +article["title"]+'</a>'), 'content': article['description']})
-    # filter articles into list of four
-    while len(filtered_list) <= int(config['news_api']['number_of_articles']) and list_of_articles:
-        try:
-            if list_of_articles[current_location]['title'] not in removed_articles:
-                filtered_list.append(list_of_articles[current_location])
-            else:
-                logging.info('News Article %s not added as removed by user',\
-                list_of_articles[current_location]['title'])
-        except IndexError:
-            # less than specified articles in list
-            logging.warning('Warning: Insufficient articles available to display')
+    for current_id, article in articles.items():
+        # filter articles into list of four
+        if len(filtered_list) > int(config['news_api']['number_of_articles']):
             break
-        current_location+=1
+        if current_id in excluded_ids or is_removed(current_id):
+            logging.info('News Article %s not added as removed by user', current_id)
+        else:
+            filtered_list.append(article)
+    if len(filtered_list) <= int(config['news_api']['number_of_articles']):
+        # less than specified articles in list
+        logging.warning('Warning: Insufficient articles available to display')
     return filtered_list
 
+def shown_article_ids() -> list[str]:
+    """ Returns the ids of the articles shown on the dashboard, in order """
+    return [article['id'] for article in create_filtered_list()]
+
+def publish_news_changes(previous_ids: list[str]) -> None:
+    """ Pushes the articles added to and removed from the dashboard to browsers.
+
+    Arguments:
+        previous_ids: the ids of the articles shown before the change, see shown_article_ids
+    """
+    shown = create_filtered_list()
+    added = [{'id': article['id'], 'title': article['headline'], 'url': article['url'],
+        'description': article['content']} for article in shown
+        if article['id'] not in previous_ids]
+    shown_ids = {article['id'] for article in shown}
+    removed = [current_id for current_id in previous_ids if current_id not in shown_ids]
+    if added or removed:
+        dashboard_events.publish('news', {'added': added, 'removed': removed})
+
 def update_news(update_name: str, update_interval:int = 86399) -> None:
     """ Function to schedule news updates.
 
-    Uses the sched module to schedule updates using the interval provided by the user.
+    Adds a news refresh to the named update in the update registry,
+    using the interval provided by the user.
 
     Arguments:
         update_interval: time until update occurs
         update_name: the name of the update, specified by user, used as an identifier"""
     logging.info("News scheduler: %s, called", update_name)
-    news_sched.enter(update_interval, 1, update_news_process, (update_name,))
+    add_update(update_name, update_interval, {'news': update_news_process})
 
 def update_news_process(update_name: str) -> None:
     """ Runs when the scheduled update executes, re-queries the API to update JSON files.
@@ -116,16 +330,15 @@ def update_news_process(update_name: str) -> None:
         update_name: the name of the update, specified by user, used as an identifier
     """
     logging.info("News scheduler: %s, running", update_name)
-    news_API_request()
+    # updates due at the same time share one request
+    run_single_flight('news', news_API_request)
 
 
-def delete_scheduled_news_event(item_name: str) -> None: # needs reworking
+def delete_scheduled_news_event(item_name: str) -> None:
     """ Deletes scheduled update for news if requested by the user (x is pressed)
 
     Arguments:
-        item_name: the name of the sched to delete
+        item_name: the name of the update to delete
     """
     logging.info('News scheduler delete called for: %s', item_name)
-    for event in news_sched.queue:
-        if event.argument == item_name:
-            news_sched.cancel(event)
+    cancel_update(item_name, 'news')
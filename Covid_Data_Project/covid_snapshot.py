@@ -0,0 +1,271 @@
+""" Module for the compact binary snapshot of covid series for the covid data dashboard.
+A snapshot is a folder of typed column arrays, one .npy file per column, with
+dates stored as int32 days since 1970-01-01 and metrics as int32. The rows for
+each area are contiguous and oldest first, and index.json holds where each
+area's rows start and stop. Each snapshot is written to a new folder inside the
+snapshot folder, then the file 'current' is replaced atomically to name it. A
+reader always finds a complete snapshot, and a writer never replaces a folder
+another process is reading or writing. Columns are memory mapped when loaded,
+so loading takes milliseconds whatever the size and every worker process
+shares the same pages rather than each holding a copy. The dashboard writes a
+snapshot of the data store after each refresh that changed it, recording each
+area's store version. Only changed areas are read from the store, the others
+are copied from the last snapshot. History indexes are built from the mapped
+columns while they are current.
+Convert the existing files with:
+    python covid_snapshot.py covid_snapshot --region region_covid_data.json
+        --nation nation_covid_data.json nation_2021-10-28.csv
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import logging
+import numpy as np
+import atomic_files
+import covid_metrics
+
+snapshot_format = 1
+missing_value = np.iinfo(np.int32).min # stored for empty cells
+# replaced snapshots are removed once this old, after readers have mapped the new one
+replaced_expiry = 60
+# folder -> the snapshot_version it was loaded at and the snapshot loaded from it
+loaded_snapshots = {}
+loaded_lock = threading.Lock()
+
+def write_snapshot(folder: str, areas: dict, versions: dict = None, base: dict = None) -> None:
+    """ Writes a snapshot, replacing any snapshot already in the folder.
+
+    The snapshot is written to its own new folder and then made current, so a
+    reader never sees a partly written snapshot. Areas that have not changed can
+    be copied from the last snapshot as they are stored, rather than converted again.
+
+    Arguments:
+        folder: the snapshot folder
+        areas: dictionary of (area type, area name) -> daily records in the api format
+        versions: dictionary of (area type, area name) -> the store version of the records
+        base: a loaded snapshot, the areas in versions but not in areas are copied from it
+    """
+    versions = versions or {}
+    index = []
+    columns = {name: [] for name in ['date'] + covid_metrics.metric_columns}
+    rows = 0
+    for area_type, area_name in dict.fromkeys(list(areas) + list(versions)):
+        if (area_type, area_name) in areas:
+            area_columns = snapshot_columns(areas[(area_type, area_name)])
+        elif base is not None and (area_type, area_name) in base['areas']:
+            start, stop = base['areas'][(area_type, area_name)]
+            area_columns = {name: values[start:stop] for name, values in base['columns'].items()}
+        else:
+            continue
+        for name, values in area_columns.items():
+            columns[name].append(values)
+        days = len(area_columns['date'])
+        index.append({'area_type': area_type, 'area_name': area_name,
+            'start': rows, 'stop': rows + days, 'version': versions.get((area_type, area_name))})
+        rows += days
+    # named uniquely, as several workers may write a snapshot at once
+    os.makedirs(folder, exist_ok=True)
+    snapshot_folder = tempfile.mkdtemp(dir=folder, prefix='snapshot.')
+    try:
+        for name, arrays in columns.items():
+            np.save(os.path.join(snapshot_folder, name + '.npy'),
+                np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int32))
+        with open(os.path.join(snapshot_folder, 'index.json'), 'w',
+            encoding='UTF-8') as index_file:
+            json.dump({'format': snapshot_format, 'created': time.time(), 'areas': index},
+                index_file)
+        atomic_files.write_atomic(os.path.join(folder, 'current'),
+            os.path.basename(snapshot_folder).encode('UTF-8'))
+    except BaseException:
+        shutil.rmtree(snapshot_folder, ignore_errors=True)
+        raise
+    remove_replaced_snapshots(folder)
+    logging.info('Snapshot of %s areas, %s days written to %s', len(index), rows, folder)
+
+def snapshot_columns(records: list[dict]) -> dict:
+    """ Converts an area's daily records in the api format to its snapshot columns """
+    series = covid_metrics.series_from_records(sorted(records,
+        key=lambda record: record['date'], reverse=True))
+    columns = {'date': series['date'].astype('int64').astype(np.int32)}
+    for column in covid_metrics.metric_columns:
+        columns[column] = np.where(np.isnan(series[column]), missing_value,
+            series[column]).astype(np.int32)
+    return columns
+
+def remove_replaced_snapshots(folder: str) -> None:
+    """ Removes the snapshots in a folder that are no longer current.
+
+    Only snapshots last written more than replaced_expiry seconds ago are removed,
+    so one that another worker is still writing, or has only just replaced, is kept.
+    Readers that mapped a removed snapshot keep it until it is unmapped.
+    """
+    current = os.path.basename(current_folder(folder))
+    for entry in os.scandir(folder):
+        try:
+            expired = time.time() - entry.stat().st_mtime > replaced_expiry
+        except FileNotFoundError: # removed by another worker
+            continue
+        if entry.is_dir() and entry.name.startswith('snapshot.') and entry.name != current \
+            and expired:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def current_folder(folder: str) -> str:
+    """ Returns the folder holding the current snapshot, named by the file 'current'.
+
+    A snapshot written before snapshots were kept in their own folders is in the
+    snapshot folder itself.
+    """
+    try:
+        with open(os.path.join(folder, 'current'), 'r', encoding='UTF-8') as current_file:
+            return os.path.join(folder, current_file.read().strip())
+    except FileNotFoundError:
+        return folder
+
+def snapshot_version(folder: str):
+    """ Returns a value that changes whenever the snapshot in a folder is replaced,
+    None if there is no snapshot.
+    """
+    for name in ('current', 'index.json'):
+        try:
+            file_status = os.stat(os.path.join(folder, name))
+        except FileNotFoundError:
+            continue
+        return file_status.st_ino, file_status.st_mtime_ns
+    return None
+
+def load_snapshot(folder: str, memory_map: bool = True) -> dict:
+    """ Loads a snapshot.
+
+    Arguments:
+        folder: the snapshot folder
+        memory_map: if True the columns are memory mapped read only, rather than read
+
+    Returns:
+        snapshot: dictionary of 'areas' -> {(area type, area name): (start, stop)},
+            'versions' -> {(area type, area name): store version, None if unknown},
+            'columns' -> {column name: int32 array} and 'created' -> time written
+    """
+    folder = current_folder(folder)
+    with open(os.path.join(folder, 'index.json'), 'r', encoding='UTF-8') as index_file:
+        index = json.load(index_file)
+    if index['format'] != snapshot_format:
+        raise ValueError('Unknown snapshot format: ' + str(index['format']))
+    columns = {name: np.load(os.path.join(folder, name + '.npy'),
+        mmap_mode='r' if memory_map else None)
+        for name in ['date'] + covid_metrics.metric_columns}
+    return {'created': index['created'], 'columns': columns,
+        'areas': {(area['area_type'], area['area_name']): (area['start'], area['stop'])
+            for area in index['areas']},
+        'versions': {(area['area_type'], area['area_name']): area.get('version')
+            for area in index['areas']}}
+
+def get_loaded_snapshot(folder: str) -> dict:
+    """ Returns the snapshot in a folder, memory mapped, None if there is none.
+
+    It is mapped again only if it has been rewritten since it was last loaded.
+    """
+    version = snapshot_version(folder)
+    if version is None:
+        return None
+    with loaded_lock:
+        loaded = loaded_snapshots.get(folder)
+    if loaded is not None and loaded['version'] == version:
+        return loaded['snapshot']
+    try:
+        snapshot = load_snapshot(folder)
+    except FileNotFoundError: # replaced while it was being loaded, keep the last one
+        return None if loaded is None else loaded['snapshot']
+    with loaded_lock:
+        loaded_snapshots[folder] = {'version': version, 'snapshot': snapshot}
+    return snapshot
+
+def snapshot_series(snapshot: dict, area_type: str, area_name: str) -> dict:
+    """ Returns an area's series from a snapshot.
+
+    Arguments:
+        snapshot: as returned by load_snapshot
+        area_type: 'region' or 'nation'
+        area_name: name of the area
+
+    Returns:
+        series: in the format of covid_metrics.series_from_records, None if the
+            snapshot does not hold the area
+    """
+    rows = snapshot['areas'].get((area_type, area_name))
+    if rows is None:
+        return None
+    start, stop = rows
+    columns = snapshot['columns']
+    series = {'date': columns['date'][start:stop].astype('int64').astype('datetime64[D]')}
+    for column in covid_metrics.metric_columns:
+        values = columns[column][start:stop]
+        series[column] = np.where(values == missing_value, np.nan, values)
+    return series
+
+def series_records(series: dict, area_name: str) -> list[dict]:
+    """ Converts a series back into daily records in the api format, most recent first """
+    records = []
+    for position in range(len(series['date']) - 1, -1, -1):
+        record = {'date': str(series['date'][position]), 'areaName': area_name}
+        for column in covid_metrics.metric_columns:
+            value = series[column][position]
+            record[column] = None if np.isnan(value) else int(value)
+        records.append(record)
+    return records
+
+def records_from_json(json_filename: str) -> dict:
+    """ Reads a json file saved from the api, grouping its records by area name """
+    with open(json_filename, 'r', encoding='UTF-8') as covid_json:
+        covid_data = json.load(covid_json)
+    areas = collections.defaultdict(list)
+    for record in covid_data['data']:
+        areas[record['areaName']].append(record)
+    return areas
+
+def records_from_csv(csv_filename: str) -> dict:
+    """ Reads a csv export, grouping its records by area name """
+    from covid_data_handler import iter_csv_records # pylint: disable=import-outside-toplevel
+    areas = collections.defaultdict(list)
+    for record in iter_csv_records(csv_filename):
+        areas[record['areaName']].append(record)
+    return areas
+
+def convert_files(folder: str, files: dict) -> None:
+    """ Writes a snapshot from json files saved from the api and csv exports.
+
+    Records for the same area from several files are merged, later files win.
+
+    Arguments:
+        folder: the snapshot folder
+        files: dictionary of area type -> list of .json or .csv file names
+    """
+    areas = {}
+    for area_type, filenames in files.items():
+        for filename in filenames:
+            if filename.endswith('.csv'):
+                file_areas = records_from_csv(filename)
+            else:
+                file_areas = records_from_json(filename)
+            for area_name, records in file_areas.items():
+                by_date = {record['date']: record
+                    for record in areas.get((area_type, area_name), [])}
+                by_date.update((record['date'], record) for record in records)
+                areas[(area_type, area_name)] = list(by_date.values())
+    write_snapshot(folder, areas)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert covid data files to a snapshot')
+    parser.add_argument('folder', help='the snapshot folder to write')
+    parser.add_argument('--region', nargs='*', default=[], help='region .json or .csv files')
+    parser.add_argument('--nation', nargs='*', default=[], help='nation .json or .csv files')
+    options = parser.parse_args(sys.argv[1:])
+    convert_files(options.folder, {'region': options.region, 'nation': options.nation})
@@ -0,0 +1,124 @@
+""" Module for pushing changes to the covid data dashboard to connected browsers.
+The refreshes publish small events - changed metrics, news articles added or
+removed and scheduled updates added, run or removed - rather than browsers
+reloading the whole page to find out. Events are numbered and the most recent
+are kept in a buffer, so a browser that reconnects with the last id it saw is
+sent only what it missed. Events are streamed to browsers as server-sent events
+at /events, by asgi_app (a coroutine for each connection) or by main (a thread
+for each connection).
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import collections
+import json
+import threading
+import logging
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+recent_events = collections.deque(maxlen=config.getint('events', 'buffer_size', fallback=256))
+event_state = {'last_id': 0, 'published': 0, 'streams': 0}
+events_condition = threading.Condition()
+listeners = [] # called with no arguments after each event is published
+
+def publish(event_type: str, data: dict) -> int:
+    """ Publishes an event to every connected browser.
+
+    Arguments:
+        event_type: 'metrics', 'news' or 'updates'
+        data: the change, must be json serialisable
+
+    Returns:
+        event_id: the id of the event
+    """
+    with events_condition:
+        event_state['last_id'] += 1
+        event_state['published'] += 1
+        event = {'id': event_state['last_id'], 'type': event_type, 'data': data}
+        recent_events.append(event)
+        events_condition.notify_all()
+        current_listeners = list(listeners)
+    for listener in current_listeners:
+        try:
+            listener()
+        except Exception: # pylint: disable=broad-except
+            # a failing listener must not fail the refresh that published the event
+            logging.exception('Event listener failed')
+    logging.info('Event %s published: %s', event['id'], event_type)
+    return event['id']
+
+def get_last_id() -> int:
+    """ Returns the id of the most recent event, 0 if none have been published """
+    with events_condition:
+        return event_state['last_id']
+
+def events_since(last_id: int) -> list[dict]:
+    """ Returns the events published after an event.
+
+    If events after last_id are no longer buffered, or last_id is from before the
+    dashboard restarted, a single 'reload' event is returned instead, as the
+    browser cannot be brought up to date with changes alone.
+
+    Arguments:
+        last_id: the id of the last event the browser was sent
+    """
+    with events_condition:
+        if last_id > event_state['last_id'] or (recent_events
+            and last_id < recent_events[0]['id'] - 1):
+            return [{'id': event_state['last_id'], 'type': 'reload', 'data': {}}]
+        return [event for event in recent_events if event['id'] > last_id]
+
+def wait_for_events(last_id: int, timeout: float) -> list[dict]:
+    """ Waits until there are events after last_id, see events_since.
+
+    Holds the calling thread, so is only for servers with a thread for each connection.
+
+    Arguments:
+        last_id: the id of the last event the browser was sent
+        timeout: the longest to wait in seconds
+
+    Returns:
+        events: the events, empty if none were published before the timeout
+    """
+    with events_condition:
+        events_condition.wait_for(lambda: event_state['last_id'] != last_id, timeout)
+    return events_since(last_id)
+
+def add_listener(listener) -> None:
+    """ Adds a function called after every event is published, on the publishing thread """
+    with events_condition:
+        listeners.append(listener)
+
+def remove_listener(listener) -> None:
+    """ Removes a listener added with add_listener """
+    with events_condition:
+        if listener in listeners:
+            listeners.remove(listener)
+
+def parse_last_id(value: str) -> int:
+    """ Returns an event id sent by a browser (Last-Event-ID), the most recent id if
+    there is none, so a new connection is only sent new events.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return get_last_id()
+
+def format_event(event: dict) -> bytes:
+    """ Formats an event as a server-sent event """
+    return ('id: ' + str(event['id']) + '\nevent: ' + event['type'] + '\ndata: '
+        + json.dumps(event['data'], separators=(',', ':')) + '\n\n').encode()
+
+def count_stream(change: int) -> None:
+    """ Counts event streams opened (1) and closed (-1) """
+    with events_condition:
+        event_state['streams'] += change
+
+def get_event_stats() -> dict:
+    """ Returns a copy of the event counters """
+    with events_condition:
+        return {'published': event_state['published'], 'buffered': len(recent_events),
+            'streams': event_state['streams']}
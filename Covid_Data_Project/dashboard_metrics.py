@@ -0,0 +1,98 @@
+""" Module for timing and counting the dashboard's hot paths
+for the covid data dashboard.
+Functions decorated with timed record their latency in a histogram, other
+modules add to named counters, and everything is rendered in the Prometheus
+text format for the /metrics endpoint.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+latency_buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+histograms = {} # function name -> bucket counts, sum and count of latencies
+counters = {} # counter name -> value
+metrics_lock = threading.Lock()
+
+def observe(name: str, seconds: float) -> None:
+    """ Records one latency in the histogram for a function.
+
+    Arguments:
+        name: name of the function timed
+        seconds: how long the call took
+    """
+    with metrics_lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = {'buckets': [0] * (len(latency_buckets) + 1), 'sum': 0.0, 'count': 0}
+            histograms[name] = histogram
+        histogram['buckets'][bisect.bisect_left(latency_buckets, seconds)] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+def timed(function):
+    """ Decorator recording the latency of every call to a function, including failed calls """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            observe(function.__name__, time.perf_counter() - start)
+    return wrapper
+
+def increment(name: str, amount: int = 1) -> None:
+    """ Adds to a named counter, e.g. 'page_cache_hits' """
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + amount
+
+def get_histogram(name: str) -> dict:
+    """ Returns a copy of a function's histogram, None if it has not been called """
+    with metrics_lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            return None
+        return {'buckets': list(histogram['buckets']), 'sum': histogram['sum'],
+            'count': histogram['count']}
+
+def format_value(value) -> str:
+    """ Formats a number for the Prometheus text format """
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+def render_metrics(gauges: dict = None) -> str:
+    """ Renders the histograms, counters and gauges in the Prometheus text format.
+
+    Arguments:
+        gauges: dictionary of metric name -> current value, collected by the caller
+            from other modules (e.g. http_client.get_client_stats)
+
+    Returns:
+        text: the exposition text served by /metrics
+    """
+    lines = ['# HELP dashboard_function_duration_seconds Latency of instrumented functions.',
+        '# TYPE dashboard_function_duration_seconds histogram']
+    with metrics_lock:
+        for name, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(latency_buckets + ['+Inf'], histogram['buckets']):
+                cumulative += count
+                lines.append('dashboard_function_duration_seconds_bucket{function="' + name
+                    + '",le="' + str(bound) + '"} ' + str(cumulative))
+            lines.append('dashboard_function_duration_seconds_sum{function="' + name + '"} '
+                + format_value(histogram['sum']))
+            lines.append('dashboard_function_duration_seconds_count{function="' + name + '"} '
+                + str(histogram['count']))
+        for name, value in sorted(counters.items()):
+            lines.append('# TYPE dashboard_' + name + '_total counter')
+            lines.append('dashboard_' + name + '_total ' + format_value(value))
+    for name, value in sorted((gauges or {}).items()):
+        if value is None:
+            continue
+        lines.append('# TYPE dashboard_' + name + ' gauge')
+        lines.append('dashboard_' + name + ' ' + format_value(value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,113 @@
+""" Module for choosing where the covid data dashboard's upstream data comes from.
+Requests to the covid api and the news api go through get_json, which uses the
+backend named in config_file.ini:
+    live - the real apis (or the urls given in config_file.ini)
+    mock - a local mock server for both apis, started on first use (see mock_upstream)
+    replay - responses recorded earlier, read from the fixture folder
+Any backend other than replay can record its responses as fixtures, so a
+recorded session can be replayed later without network.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import hashlib
+import json
+import os
+import threading
+import logging
+from uk_covid19 import Cov19API
+import http_client
+import atomic_files
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+default_urls = {'covid': Cov19API.endpoint, 'news': 'https://newsapi.org/v2/top-headlines'}
+# parameters left out of fixture names, so fixtures do not depend on the api key
+unrecorded_params = {'apiKey'}
+source_state = {'mock_server': None, 'replayed': set()}
+source_lock = threading.Lock()
+
+def get_backend() -> str:
+    """ Returns the backend named in config_file.ini, 'live' by default """
+    return config.get('data_source', 'backend', fallback='live')
+
+def get_source_url(source: str) -> str:
+    """ Returns the url requests for a source are sent to.
+
+    Arguments:
+        source: 'covid' or 'news'
+    """
+    if get_backend() == 'mock':
+        import mock_upstream # pylint: disable=import-outside-toplevel
+        with source_lock:
+            if source_state['mock_server'] is None:
+                source_state['mock_server'] = mock_upstream.start_mock_server()
+                logging.info('Mock upstream server started')
+        path = mock_upstream.covid_api_path if source == 'covid' else mock_upstream.news_api_path
+        return mock_upstream.server_url(source_state['mock_server'], path)
+    return config.get('data_source', source + '_url', fallback=default_urls[source])
+
+def fixture_path(source: str, params: dict = None) -> str:
+    """ Returns the fixture file for a request.
+
+    Arguments:
+        source: 'covid' or 'news'
+        params: query parameters for the request
+    """
+    recorded_params = {name: value for name, value in (params or {}).items()
+        if name not in unrecorded_params}
+    key = hashlib.sha1(http_client.cache_key(source, recorded_params).encode()).hexdigest()[:20]
+    return os.path.join(config.get('data_source', 'fixture_folder', fallback='fixtures'),
+        source + '-' + key + '.json')
+
+def record_fixture(source: str, params: dict, data) -> None:
+    """ Writes a response to its fixture file """
+    path = fixture_path(source, params)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    atomic_files.write_json(path, {'source': source, 'params': {name: value
+        for name, value in params.items() if name not in unrecorded_params}, 'data': data})
+
+def replay_fixture(source: str, params: dict) -> tuple:
+    """ Returns a recorded response, as get_json.
+
+    The first replay of a fixture counts as modified, later replays as not
+    modified, as a live api would answer with a 304.
+
+    Raises:
+        FileNotFoundError: if the request was not recorded
+    """
+    path = fixture_path(source, params)
+    with open(path, 'r', encoding='UTF-8') as fixture_file:
+        data = json.load(fixture_file)['data']
+    with source_lock:
+        modified = path not in source_state['replayed']
+        source_state['replayed'].add(path)
+    return data, modified
+
+def get_json(source: str, params: dict = None, timeout: float = None) -> tuple:
+    """ Requests data for a source from the configured backend.
+
+    Arguments:
+        source: 'covid' or 'news'
+        params: query parameters for the request
+        timeout: seconds to wait for the server
+
+    Returns:
+        data: the parsed json body, None for a 204 response
+        modified: False if the data has not changed since it was last returned
+    """
+    params = params or {}
+    if get_backend() == 'replay':
+        return replay_fixture(source, params)
+    data, modified = http_client.get_json(get_source_url(source), params, timeout=timeout)
+    if config.getboolean('data_source', 'record', fallback=False):
+        record_fixture(source, params, data)
+    return data, modified
+
+def get_last_modified(source: str, params: dict = None) -> str:
+    """ Returns the Last-Modified header of the last response for a request, if any """
+    if get_backend() == 'replay':
+        return None
+    return http_client.get_last_modified(get_source_url(source), params)
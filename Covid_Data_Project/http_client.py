@@ -0,0 +1,132 @@
+""" Module providing the shared HTTP client for the covid data dashboard.
+One pooled requests session is used for both the News API and the Public Health
+England API. Responses are kept in a local cache and revalidated with
+If-None-Match / If-Modified-Since so an unchanged dataset costs a 304 and no re-parse.
+The cache is limited to cache_bytes of response bodies, the least recently used
+response is evicted first and is simply requested in full next time.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import collections
+import threading
+import time
+import logging
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=config.getint('http_client', 'pool_connections', fallback=4),
+    pool_maxsize=config.getint('http_client', 'pool_maxsize', fallback=10))
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+# request url -> validators and parsed body of the last 200 response, least recently used first
+response_cache = collections.OrderedDict()
+cache_lock = threading.Lock()
+client_stats = {'requests': 0, 'not_modified': 0, 'bytes_transferred': 0,
+    'bytes_saved': 0, 'time_saved': 0.0, 'cached_bytes': 0, 'cache_evictions': 0}
+stats_lock = threading.Lock()
+
+def cache_key(url: str, params: dict = None) -> str:
+    """ Returns the full request url used to identify a cached response.
+
+    Arguments:
+        url: the url without a query string
+        params: query parameters for the request
+    """
+    if not params:
+        return url
+    return url + '?' + urlencode(sorted(params.items()))
+
+def get_json(url: str, params: dict = None, timeout: float = None) -> tuple:
+    """ Makes a conditional GET request through the shared session.
+
+    If a previous response for the same request had an ETag or Last-Modified
+    header they are sent back, and a 304 returns the cached body without parsing.
+
+    Arguments:
+        url: the url to request
+        params: query parameters for the request
+        timeout: seconds to wait for the server
+
+    Returns:
+        data: the parsed json body, None for a 204 response
+        modified: False if the server answered 304 Not Modified
+    """
+    key = cache_key(url, params)
+    with cache_lock:
+        cached = response_cache.get(key)
+        if cached is not None:
+            response_cache.move_to_end(key)
+    headers = {}
+    if cached is not None:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    start = time.perf_counter()
+    response = session.get(url, params=params, headers=headers, timeout=timeout)
+    elapsed = time.perf_counter() - start
+    size = len(response.content)
+    with stats_lock:
+        client_stats['requests'] += 1
+        client_stats['bytes_transferred'] += size
+    if response.status_code == 304 and cached is not None:
+        with stats_lock:
+            client_stats['not_modified'] += 1
+            client_stats['bytes_saved'] += cached['size']
+            client_stats['time_saved'] += max(cached['elapsed'] - elapsed, 0)
+        logging.info('Request to %s not modified, using cached response', url)
+        return cached['data'], False
+    response.raise_for_status()
+    if response.status_code == 204: # no content, e.g. past the last page
+        return None, True
+    data = response.json()
+    if response.headers.get('ETag') or response.headers.get('Last-Modified'):
+        cache_response(key, {'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'data': data, 'size': size, 'elapsed': elapsed})
+    return data, True
+
+def cache_response(key: str, cached: dict) -> None:
+    """ Adds a response to the cache, evicting the least recently used responses
+    while the bodies held add up to more than cache_bytes (config_file.ini).
+
+    Arguments:
+        key: the request url, see cache_key
+        cached: the validators, parsed body and body 'size' in bytes of the response
+    """
+    limit = config.getint('http_client', 'cache_bytes', fallback=8388608)
+    evictions = 0
+    with cache_lock:
+        previous = response_cache.pop(key, None)
+        cached_bytes = client_stats['cached_bytes'] - (previous['size'] if previous else 0)
+        if cached['size'] <= limit:
+            response_cache[key] = cached
+            cached_bytes += cached['size']
+        while cached_bytes > limit:
+            _, evicted = response_cache.popitem(last=False)
+            cached_bytes -= evicted['size']
+            evictions += 1
+        with stats_lock:
+            client_stats['cached_bytes'] = cached_bytes
+            client_stats['cache_evictions'] += evictions
+
+def get_last_modified(url: str, params: dict = None) -> str:
+    """ Returns the Last-Modified header of the cached response for a request, if any """
+    with cache_lock:
+        cached = response_cache.get(cache_key(url, params))
+    if cached is None:
+        return None
+    return cached['last_modified']
+
+def get_client_stats() -> dict:
+    """ Returns a copy of the request, byte and time saved counters """
+    with stats_lock:
+        return dict(client_stats)
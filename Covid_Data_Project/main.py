@@ -3,31 +3,80 @@
 Part of the 2021 Assessement for ECM1400 at University of Exeter
 © 2021 - James Cracknell https://github.com/JamesCracknell """
 
-import sched
+import configparser
+import os
 import time
+import json
+import atexit
+import hashlib
 import logging
-from datetime import datetime
+import logging.handlers
+import queue
+import threading
+import collections
+from datetime import datetime, timezone
 
 from flask import Flask
 from flask import request
 from flask import render_template
+from flask import make_response
+from flask import abort
+from flask import stream_with_context
 
 from covid_data_handler import process_covid_api_data, delete_scheduled_data_event,\
-    data_sched, schedule_covid_updates, process_nation_request, process_region_request
+    data_sched, execute_update, refresh_covid_data,\
+    get_data_version, get_cache_stats, get_data_refreshed, get_data_trend, get_area_name
 from covid_news_handling import create_filtered_list, news_API_request,\
-    news_sched, update_news, delete_scheduled_news_event
+    news_sched, update_news_process, delete_scheduled_news_event, get_news_version,\
+    remove_article, get_news_refreshed
 import time_conversions as convert_time
+from update_pipeline import run_concurrently, run_single_flight, get_refresh_stats
+from scheduler_service import register_scheduler, register_runner, start_scheduler_service,\
+    stop_scheduler_service, wake_scheduler_service, get_scheduler_status
+from update_registry import add_update, run_due_updates, get_registry_status
+from shared_state import state
+from http_client import get_client_stats
+from news_client import get_news_client_stats
+from dashboard_metrics import timed, increment, render_metrics
+from covid_history import get_history, history_days, cases_between, get_history_stats
+import dashboard_events
 
-s = sched.scheduler(time.time, time.sleep) # create scheduler
-logging.basicConfig(filename='sys.log', encoding='utf-8', level=logging.DEBUG,\
-    format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+# the schedulers and update registry are run by the scheduler service thread, not by requests
+register_scheduler('news', news_sched)
+register_scheduler('data', data_sched)
+register_runner('updates', run_due_updates)
+# requests only put log records on a queue, a listener thread writes them to sys.log
+log_queue = queue.SimpleQueue()
+log_file_handler = logging.FileHandler('sys.log', encoding='utf-8')
+log_file_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p'))
+log_listener = logging.handlers.QueueListener(log_queue, log_file_handler)
+# force, as a warning logged while importing the handlers may already have added a handler
+logging.basicConfig(level=logging.DEBUG, handlers=[logging.handlers.QueueHandler(log_queue)],
+    format='%(message)s', force=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 logging.info('\n \n \n==== New Instance Started ====')
-removed_articles = []
-updates = []
+# scheduled updates are held in the shared state so every worker shows the same list
+# rendered pages, keyed on the version of everything shown on the page
+page_cache = collections.OrderedDict()
+page_cache_lock = threading.Lock()
+startup_state = {'refreshing': False} # True while fresh data is loaded after startup
+# the process the startup refresh and scheduler service were started in
+background_state = {'pid': None}
+background_lock = threading.Lock()
 
 app = Flask(__name__)
 
+@app.before_request
+def ensure_background_services():
+    """ Starts the background services on the first request, see start_background_services """
+    start_background_services()
+
 @app.route('/index')
+@timed
 def index():
     """ Function in charge of loading the flask template and processing the data needed for it
 
@@ -37,19 +86,15 @@ def index():
         'notif': news article removal (x clicked)
         'two' and 'update': scheduling data updates
         'update_item': removing scheduled updates
+        'area' and 'nation': the local area and nation to show, defaults in config_file.ini
     """
-    logging.info('Data called')
-    region_data = process_covid_api_data('region')
-    nation_data = process_covid_api_data('nation')
-    logging.info('News called')
-    news_articles_list = create_filtered_list(removed_articles)
+    area = request.args.get('area')
+    nation = request.args.get('nation')
     notif = request.args.get('notif') # if x is pressed on news article
 
     if notif: # processes news article removal
-        logging.info('News article with name: %s removed', notif)
-        removed_articles.append(notif)
-        news_API_request()
-        news_articles_list = create_filtered_list(removed_articles)
+        logging.info('News article with id: %s removed', notif)
+        remove_article(notif) # served from the backlog, refilled in the background
 
     if request.args.get('two') and request.args.get('update'):
         # if there is a name and update time
@@ -64,12 +109,49 @@ def index():
         delete_scheduled_news_event(update_name) # delete news sched
         remove_item(update_name) # delete front end display
 
-    news_sched.run(blocking=False)
-    data_sched.run(blocking=False)
-    s.run(blocking=False)
-
+    # read first, so events published while the page is rendered are replayed to it
+    event_id = dashboard_events.get_last_id()
+    data_status = get_data_status(area, nation)
+    state_key = (area, get_data_version('region', area), nation,
+        get_data_version('nation', nation), get_news_version(),
+        state.get_value('versions', 'updates', 0), repr(data_status), event_id)
+    with page_cache_lock:
+        page = page_cache.get(state_key)
+    if page is None: # something shown on the page has changed, render it again
+        increment('page_cache_misses')
+        page = render_index(area, nation, state_key, data_status, event_id)
+    else:
+        increment('page_cache_hits')
     logging.info('Return statement executed')
-    return render_template('index.html',
+    response = make_response(page['html'])
+    response.set_etag(page['etag'])
+    response.last_modified = page['last_modified']
+    response.cache_control.no_cache = True # browsers revalidate with the etag
+    return response.make_conditional(request)
+
+def render_index(area: str, nation: str, state_key: tuple, data_status: dict,
+    event_id: int) -> dict:
+    """ Renders the dashboard and stores it in the page cache.
+
+    Arguments:
+        area: the local area to show, None for the default
+        nation: the nation to show, None for the default
+        state_key: versions of everything shown on the page
+        data_status: as returned by get_data_status
+        event_id: the last event published before the data was read, the page's
+            event stream starts after it
+
+    Returns:
+        page: dictionary holding the rendered 'html', its 'etag' and 'last_modified' time
+    """
+    logging.info('Data called')
+    region_data = process_covid_api_data('region', area)
+    nation_data = process_covid_api_data('nation', nation)
+    logging.info('News called')
+    news_articles_list = create_filtered_list()
+    local_trend = get_data_trend('region', area)
+    national_trend = get_data_trend('nation', nation)
+    html = render_template('index.html',
     title='Covid-19 Dashboard',
     image='covid_icon.png',
     favicon ='static/images/covid_icon.png',
@@ -77,11 +159,191 @@ def index():
     local_7day_infections=region_data[1],
     nation_location = nation_data[0],
     national_7day_infections = nation_data[1],
+    local_trend = trend_message(local_trend),
+    national_trend = trend_message(national_trend),
     hospital_cases = nation_data[2],
     deaths_total = nation_data[3],
     news_articles = news_articles_list,
-    updates = updates
+    updates = get_updates(),
+    data_message = data_status_message(data_status),
+    event_id = event_id
     )
+    page = {'html': html, 'etag': hashlib.sha1(repr(state_key).encode()).hexdigest(),
+        'last_modified': datetime.now(timezone.utc)}
+    with page_cache_lock:
+        page_cache[state_key] = page
+        while len(page_cache) > 64: # one page for each area shown recently
+            page_cache.popitem(last=False)
+    return page
+
+def select_fields(item: dict) -> dict:
+    """ Returns only the fields of item listed in the 'fields' query parameter, if given
+
+    Arguments:
+        item: dictionary to be returned by a json endpoint
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        return item
+    fields = fields.split(',')
+    return {field: value for field, value in item.items() if field in fields}
+
+def json_response(payload, state_key: tuple):
+    """ Creates a compact json response that clients can cache and revalidate.
+
+    Arguments:
+        payload: the data to return
+        state_key: versions of everything in the payload, used for the etag
+    """
+    response = app.response_class(json.dumps(payload, separators=(',', ':')),
+        mimetype='application/json')
+    response.set_etag(hashlib.sha1(repr((state_key, request.args.get('fields')))
+        .encode()).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = config.getint('dashboard', 'api_max_age', fallback=30)
+    return response.make_conditional(request)
+
+@app.route('/api/metrics')
+def api_metrics():
+    """ Returns the metrics for an area and nation as json. Read only.
+
+    Query parameters:
+        'area' and 'nation': the areas to return, defaults in config_file.ini
+        'fields': comma separated fields to return for each area
+    """
+    area = request.args.get('area')
+    nation = request.args.get('nation')
+    data_status = get_data_status(area, nation)
+    state_key = (area, get_data_version('region', area), nation,
+        get_data_version('nation', nation), repr(data_status))
+    # nothing is seeded, requested or shared, so the endpoint has no side effects
+    region_data = process_covid_api_data('region', area, record=False)
+    nation_data = process_covid_api_data('nation', nation, record=False)
+    return json_response({
+        'region': select_fields(dict(data_status['region'], area=region_data[0],
+            seven_day_rate=region_data[1], trend=get_data_trend('region', area))),
+        'nation': select_fields(dict(data_status['nation'], area=nation_data[0],
+            seven_day_rate=nation_data[1], hospital_cases=nation_data[2],
+            deaths=nation_data[3], trend=get_data_trend('nation', nation)))}, state_key)
+
+@app.route('/api/history')
+def api_history():
+    """ Returns the daily metrics for an area over a range of dates as json. Read only.
+
+    Query parameters:
+        'area_type': 'region' (default) or 'nation'
+        'area': the area to return, default in config_file.ini
+        'start' and 'end': the first and last dates, e.g. 2021-10-01, default all stored days
+        'fields': comma separated fields to return for each day
+    """
+    area_type = 'nation' if request.args.get('area_type') == 'nation' else 'region'
+    area = request.args.get('area') or get_area_name(area_type)
+    start = request.args.get('start')
+    end = request.args.get('end')
+    index = get_history(area_type, area)
+    if index is None:
+        abort(404)
+    try:
+        days = history_days(index, start, end)
+        total_cases = cases_between(index, start, end)
+    except ValueError:
+        abort(400) # not a valid date
+    return json_response({'area': area, 'cases': total_cases,
+        'days': [select_fields(day) for day in days]},
+        (area_type, area, index['version'], start, end))
+
+@app.route('/api/news')
+def api_news():
+    """ Returns the news articles shown on the dashboard as json. Read only.
+
+    Query parameters:
+        'fields': comma separated fields to return for each article
+    """
+    articles = [select_fields({'id': article['id'], 'title': article['headline'],
+        'url': article['url'], 'description': article['content']})
+        for article in create_filtered_list()]
+    return json_response(articles, get_news_version())
+
+@app.route('/api/updates')
+def api_updates():
+    """ Returns the scheduled updates as json. Read only.
+
+    Query parameters:
+        'fields': comma separated fields to return for each update
+    """
+    return json_response([select_fields(update) for update in get_updates()],
+        state.get_value('versions', 'updates', 0))
+
+@app.route('/api/status')
+def api_status():
+    """ Returns when the data was last refreshed and whether it is stale as json. Read only.
+
+    Query parameters:
+        'area' and 'nation': the areas to return, defaults in config_file.ini
+    """
+    area = request.args.get('area')
+    nation = request.args.get('nation')
+    data_status = get_data_status(area, nation)
+    return json_response(data_status, repr(data_status))
+
+@app.route('/events')
+def events():
+    """ Streams changes to the dashboard as server-sent events. Read only.
+
+    Each connection holds a thread here, serve with asgi_app for many connections.
+    Browsers reconnecting send the Last-Event-ID header and are sent what they missed.
+    A new connection is sent the events after 'since', the event id the page was
+    rendered with, so changes made while the page was loading are not lost.
+    """
+    last_id = dashboard_events.parse_last_id(request.headers.get('Last-Event-ID')
+        or request.args.get('since'))
+    heartbeat = config.getfloat('events', 'heartbeat', fallback=15)
+    def stream(last_id: int):
+        dashboard_events.count_stream(1)
+        try:
+            yield b'retry: 5000\n\n'
+            while True:
+                new_events = dashboard_events.wait_for_events(last_id, heartbeat)
+                if not new_events:
+                    yield b': keep alive\n\n'
+                for event in new_events:
+                    last_id = event['id']
+                    yield dashboard_events.format_event(event)
+        finally: # the browser disconnected
+            dashboard_events.count_stream(-1)
+    response = app.response_class(stream_with_context(stream(last_id)),
+        mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """ Returns latency histograms, upstream calls, bytes fetched and cache hit
+    rates in the Prometheus text format. Read only.
+    """
+    gauges = {}
+    for name, value in get_client_stats().items():
+        gauges['upstream_' + name] = value
+    for name, value in get_news_client_stats().items():
+        gauges['news_api_' + name] = value
+    cache_stats = get_cache_stats()
+    for name, value in cache_stats.items():
+        gauges['data_cache_' + name] = value
+    lookups = cache_stats['hits'] + cache_stats['misses']
+    gauges['data_cache_hit_ratio'] = cache_stats['hits'] / lookups if lookups else None
+    for source, stats in get_refresh_stats().items():
+        for name, value in stats.items():
+            gauges['refresh_' + source + '_' + name] = value
+    for name, value in get_history_stats().items():
+        gauges['history_' + name] = value
+    for name, value in dashboard_events.get_event_stats().items():
+        gauges['events_' + name] = value
+    gauges['scheduled_updates'] = get_registry_status()['scheduled']
+    scheduler_status = get_scheduler_status()
+    gauges['scheduler_jobs_run'] = scheduler_status['jobs_run']
+    gauges['scheduler_jobs_failed'] = scheduler_status['jobs_failed']
+    return app.response_class(render_metrics(gauges),
+        mimetype='text/plain; version=0.0.4')
 
 def schedule_update() -> None:
     """ Schedules updates for data and news.
@@ -103,28 +365,26 @@ def schedule_update() -> None:
         repeat = False
     if update_covid_data or update_news_articles:
         # if the update affects either covid data or news
-        name_unique = True
-        for update in updates:
-            if update['title'] == update_name:
-                # update name is not unique
-                name_unique = False
-        if name_unique is True:
-            # if update name is already in list of updates it is invalid
-            time_of_update = request.args.get('update') # gets update time
-            current_time = datetime.now().strftime("%H:%M:%S") # gets current time
-            # append to updates, an array storing how updates are displayed on dashboard
-            # format message
-            update_message = ('Update scheduled for: ' + time_of_update+'.')
-            if update_news_articles:
-                update_message = update_message + " News articles will update."
-            if update_covid_data:
-                update_message = update_message + " Covid data will update."
-            if repeat:
-                update_message = update_message + " Update will repeat."
-            else:
-                update_message = update_message + " Update will not repeat."
-            updates.append({'title': update_name,
+        time_of_update = request.args.get('update') # gets update time
+        current_time = datetime.now().strftime("%H:%M:%S") # gets current time
+        # format message
+        update_message = ('Update scheduled for: ' + time_of_update+'.')
+        if update_news_articles:
+            update_message = update_message + " News articles will update."
+        if update_covid_data:
+            update_message = update_message + " Covid data will update."
+        if repeat:
+            update_message = update_message + " Update will repeat."
+        else:
+            update_message = update_message + " Update will not repeat."
+        # add to updates, storing how updates are displayed on dashboard
+        # fails if update name is already in updates, as it is invalid
+        name_unique = state.add_item('updates', update_name, {'title': update_name,
             'content': update_message})
+        if name_unique is True:
+            state.increment('versions', 'updates')
+            dashboard_events.publish('updates', {'added': {'title': update_name,
+                'content': update_message}})
             # convert both times to seconds
             time_of_update = convert_time.hhmm_to_seconds(time_of_update)
             current_time = convert_time.hhmmss_to_seconds(current_time)
@@ -132,65 +392,127 @@ def schedule_update() -> None:
                 time_till_update = time_of_update - current_time
             else: # update time is in the 'past' (so is scheduled for tomorrow)
                 time_till_update = (86400 - current_time) + time_of_update
+            actions = {}
             if update_news_articles:
-                # schedule news updates through update_news function
-                update_news(update_name, time_till_update)
+                # news is refreshed by update_news_process
+                actions['news'] = update_news_process
             if update_covid_data:
-                # schedule covid updates through schedule_covid_updates function
-                schedule_covid_updates(update_name, time_till_update)
-            # 'overarching scheduler' controls deleting of update, or creating repeat
-            s.enter(time_till_update, 1, update_occured, (update_name, repeat,
-            update_news_articles, update_covid_data, ((86400 - current_time) + time_of_update)))
+                # covid data is refreshed by execute_update
+                actions['data'] = execute_update
+            # the actions are added together, so none is lost to a later due time. The
+            # registry removes the update once run, or repeats it a day later
+            add_update(update_name, time_till_update, actions,
+                repeat_interval=86400 if repeat else None, on_complete=remove_item)
+            wake_scheduler_service()
         else:
             logging.warning('Warning: Name is not unique. There is already an \
             update with name: %s', update_name)
     else:
         logging.warning('Warning: Neither data or news will be updated. Update request ignored.')
 
-def remove_item(update_name: str) -> None:
-    """ Removes update from updates, so it is no longer displayed on front end
+def get_data_status(area: str = None, nation: str = None) -> dict:
+    """ Returns when the data shown was last refreshed and whether it is stale.
+
+    Data is stale if it has not been refreshed within stale_after seconds (config_file.ini).
 
     Arguments:
-        update_name: name of update to be removed
-        """
-    for update in updates:
-        if update['title'] == update_name:
-            updates.remove(update)
-            logging.info('Update removed from front end')
+        area: the local area, None for the default
+        nation: the nation, None for the default
+
+    Returns:
+        data_status: 'region', 'nation' and 'news' -> {'refreshed': time or None, 'stale': bool},
+            and 'refreshing': True while fresh data is loaded after startup
+    """
+    stale_after = config.getfloat('dashboard', 'stale_after', fallback=86400)
+    data_status = {'refreshing': startup_state['refreshing']}
+    for name, refreshed in (('region', get_data_refreshed('region', area)),
+        ('nation', get_data_refreshed('nation', nation)), ('news', get_news_refreshed())):
+        data_status[name] = {'refreshed': refreshed,
+            'stale': refreshed is None or time.time() - refreshed > stale_after}
+    return data_status
 
-def update_occured(update_name: str, repeat: bool, update_news_articles:
-    bool, update_covid_data: bool, future_update_time: int) -> None:
-    """ Deletes front end update display, or repeats scheduler.
+def data_status_message(data_status: dict) -> str:
+    """ Returns the staleness notice shown on the dashboard, None if the data is fresh """
+    stale = [name for name in ('region', 'nation', 'news') if data_status[name]['stale']]
+    if data_status['refreshing']:
+        return 'Showing saved data while fresh data is loaded.'
+    if not stale:
+        return None
+    refreshed = [data_status[name]['refreshed'] for name in stale
+        if data_status[name]['refreshed'] is not None]
+    if not refreshed:
+        return 'Some data has not been loaded yet: ' + ', '.join(stale) + '.'
+    return ('Some data may be out of date: ' + ', '.join(stale) + ', last refreshed '
+        + datetime.fromtimestamp(min(refreshed)).strftime('%d/%m/%Y %H:%M') + '.')
+
+def trend_message(trend: dict) -> str:
+    """ Returns the change in a 7 day rate as shown on the dashboard, None if unknown
 
     Arguments:
-        update_name: Identifier for the update, specified by the user
-        repeat: True if scheduled update is to be repeated
-        update_news_articles: True if news articles are to be updated
-        update_covid_data: True if data is to updates
-        future_update_time: Time next update occurs
+        trend: as returned by get_data_trend
     """
-    for update in updates:
-        if update['title'] == update_name:
-            # item is that which was scheduled
-            if repeat is False: # remove the item
-                remove_item(update_name)
-                logging.info('Non repeating update %s removed', update_name)
-            else: # recreate schedules to allow for repeat
-                logging.info('Update %s is repeating', update_name)
-                s.enter(future_update_time, 1, update_occured, (update_name, repeat,
-                    update_news_articles, update_covid_data, future_update_time))
-                if update_news_articles:
-                    # schedule news updates through update_news function
-                    logging.info('News update rescheduled')
-                    update_news(update_name, future_update_time)
-                if update_covid_data:
-                    # schedule covid updates through schedule_covid_updates function
-                    logging.info('Data update rescheduled')
-                    schedule_covid_updates(update_name, future_update_time)
+    if trend is None or trend['change'] is None:
+        return None
+    weeks = str(trend['weeks']) + (' week' if trend['weeks'] == 1 else ' weeks')
+    if trend['change'] == 0:
+        return 'No change on ' + weeks + ' ago'
+    message = ('Up ' if trend['change'] > 0 else 'Down ') + str(abs(trend['change']))
+    if trend['percent_change'] is not None:
+        message += ' (' + str(abs(trend['percent_change'])) + '%)'
+    return message + ' on ' + weeks + ' ago'
+
+def refresh_on_startup() -> None:
+    """ Fetches fresh news and covid data, the requests are made at once.
+
+    Runs as single-flight refreshes, so scheduled updates due at startup join them.
+    """
+    startup_state['refreshing'] = True
+    try:
+        run_concurrently({'news': lambda: run_single_flight('news', news_API_request),
+            'covid_data': lambda: run_single_flight('covid_data', refresh_covid_data)})
+    finally:
+        startup_state['refreshing'] = False
+        logging.info('Startup refresh finished')
+
+def start_background_services() -> bool:
+    """ Starts the startup refresh and the scheduler service, once in each process.
+
+    Called when main is run, when the ASGI server starts and on the first request,
+    so they also run under a WSGI server such as gunicorn, which imports main
+    rather than running it. A forked worker process starts its own.
+
+    Returns:
+        started: False if they were already started in this process
+    """
+    with background_lock:
+        if background_state['pid'] == os.getpid():
+            return False
+        background_state['pid'] = os.getpid()
+    if config.get('dashboard', 'startup', fallback='background') == 'blocking':
+        refresh_on_startup() # fetch initial data before serving
+    else:
+        # serve the last saved data straight away and fetch fresh data in the background
+        startup_state['refreshing'] = True
+        threading.Thread(target=refresh_on_startup, name='startup-refresh', daemon=True).start()
+    start_scheduler_service()
+    return True
+
+def get_updates() -> list[dict]:
+    """ Returns the scheduled updates shown on the front end, in the order they were added """
+    return [update for _, update in state.get_items('updates')]
+
+def remove_item(update_name: str) -> None:
+    """ Removes update from updates, so it is no longer displayed on front end
+
+    Arguments:
+        update_name: name of update to be removed
+        """
+    if state.remove_item('updates', update_name):
+        state.increment('versions', 'updates')
+        dashboard_events.publish('updates', {'removed': update_name})
+        logging.info('Update removed from front end')
 
 if __name__ == '__main__':
-    # run program and fetch initial data
-    news_API_request()
-    process_region_request()
-    process_nation_request()
+    start_background_services()
+    atexit.register(stop_scheduler_service)
     app.run()
@@ -0,0 +1,132 @@
+""" Module providing a local mock of the Public Health England and News API
+endpoints for the covid data dashboard.
+One threaded HTTP server answers both APIs with seeded synthetic data, in the
+same format and with the same paging and ETag validators as the real services,
+so the dashboard can be started, load tested and benchmarked without network.
+Run on its own with: python mock_upstream.py [port]
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import json
+import random
+import sys
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+covid_api_path = '/v1/data'
+news_api_path = '/v2/top-headlines'
+
+def synthetic_records(days: int, seed: int, area_name: str = None) -> list[dict]:
+    """ Creates daily records, most recent first, with the most recent day empty """
+    generator = random.Random(seed)
+    start = np.datetime64('2020-01-30')
+    records = [{'date': str(start + day), 'areaName': area_name or 'Area ' + str(seed),
+        'newCasesBySpecimenDate': generator.randint(0, 5000),
+        'hospitalCases': generator.randint(0, 500) if generator.random() > 0.1 else None,
+        'cumDailyNsoDeathsByDeathDate': day * 3} for day in range(days)]
+    records[-1]['newCasesBySpecimenDate'] = None
+    return records[::-1]
+
+def synthetic_articles(count: int, seed: int) -> list[dict]:
+    """ Creates news articles in the format returned by the news api """
+    generator = random.Random(seed)
+    return [{'source': {'id': None, 'name': 'Synthetic News'},
+        'title': 'Covid article ' + str(seed) + '-' + str(number),
+        'description': ' '.join(generator.choice(['cases', 'hospital', 'vaccine', 'covid',
+            'rise', 'fall', 'local', 'national']) for _ in range(20)),
+        'url': 'https://news.example/' + str(seed) + '/' + str(number),
+        'publishedAt': '2021-12-17T00:00:00Z'} for number in range(count)]
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    """ Answers covid api and news api requests with synthetic data """
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """ Routes a request to the covid or news mock """
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == covid_api_path:
+            body = self.covid_api_response(params)
+        elif url.path == news_api_path:
+            body = self.news_api_response(params)
+        else:
+            self.send_error(404)
+            return
+        if body is None:
+            self.send_response(204) # past the last page
+            self.end_headers()
+            return
+        etag = '"' + format(zlib.crc32(body), 'x') + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def covid_api_response(self, params: dict) -> bytes:
+        """ Returns one page of records for the filters, None past the last page """
+        filters = dict(item.split('=', 1) for item in params.get('filters', '').split(';') if item)
+        structure = json.loads(params.get('structure', '{}'))
+        page = int(params.get('page', 1))
+        area_name = filters.get('areaName', 'Area 0')
+        records = synthetic_records(self.server.days, zlib.crc32(area_name.encode()), area_name)
+        page_size = self.server.page_size
+        page_records = records[(page - 1) * page_size:page * page_size]
+        if not page_records:
+            return None
+        data = [{name: record.get(metric) for name, metric in structure.items()}
+            for record in page_records]
+        next_page = None
+        if page * page_size < len(records):
+            next_page = covid_api_path + '?page=' + str(page + 1)
+        return json.dumps({'length': len(data), 'data': data,
+            'pagination': {'current': page, 'next': next_page}}).encode()
+
+    def news_api_response(self, params: dict) -> bytes:
+        """ Returns articles for a search term """
+        articles = synthetic_articles(min(int(params.get('pageSize', 20)), self.server.articles),
+            zlib.crc32(params.get('q', '').encode()))
+        return json.dumps({'status': 'ok', 'totalResults': len(articles),
+            'articles': articles}).encode()
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+def start_mock_server(port: int = 0, days: int = 700, articles: int = 50,
+    page_size: int = 2500) -> ThreadingHTTPServer:
+    """ Starts the mock server in a daemon thread.
+
+    Arguments:
+        port: local port to listen on, 0 for any free port
+        days: days of history returned for every area
+        articles: maximum articles returned for each search term
+        page_size: records in each page of covid api data
+
+    Returns:
+        server: the running server, stop it with server.shutdown()
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockUpstreamHandler)
+    server.daemon_threads = True
+    server.days = days
+    server.articles = articles
+    server.page_size = page_size
+    threading.Thread(target=server.serve_forever, name='mock-upstream', daemon=True).start()
+    return server
+
+def server_url(server: ThreadingHTTPServer, path: str) -> str:
+    """ Returns the url of a path on the mock server """
+    return 'http://127.0.0.1:' + str(server.server_port) + path
+
+if __name__ == '__main__':
+    mock_server = start_mock_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8001)
+    print('Covid api: ' + server_url(mock_server, covid_api_path))
+    print('News api:  ' + server_url(mock_server, news_api_path))
+    threading.Event().wait() # serve until interrupted
@@ -0,0 +1,176 @@
+""" Module providing the News API client for the covid data dashboard.
+NewsAPI allows a limited number of requests a day, so the client:
+    can combine the search terms into as few queries as possible (term OR term),
+    if combine_terms is set. NewsAPI only documents OR for its /v2/everything
+    endpoint, so it is off for the default /v2/top-headlines
+    counts requests against a daily budget, held in the shared state so every
+    worker spends the same budget, and stops requesting once it is spent or
+    the api answers 429 rate limited
+    retries timeouts, connection errors and server errors with jittered
+    exponential backoff, within the update pipeline's request timeout
+When no request can be made the caller keeps its cached articles. Requests are
+only made by the news refresh, so a backoff never holds a page request.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import random
+import threading
+import time
+import logging
+import requests
+import data_sources
+from update_pipeline import get_request_timeout
+from shared_state import state
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+client_stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rate_limited': 0,
+    'budget_exhausted': 0, 'fallbacks': 0}
+stats_lock = threading.Lock()
+
+class BudgetExhausted(Exception):
+    """ Raised when no more News API requests can be made today """
+
+def count(name: str) -> None:
+    """ Adds one to a client counter """
+    with stats_lock:
+        client_stats[name] += 1
+
+def build_queries(search_terms: list[str]) -> list[str]:
+    """ Combines search terms into queries matching any of the terms.
+
+    Each query is kept within max_query_length characters (config_file.ini), so
+    a long list of terms may need more than one.
+
+    Arguments:
+        search_terms: the terms, e.g. ['Covid', 'COVID-19', 'coronavirus']
+
+    Returns:
+        queries: e.g. ['Covid OR COVID-19 OR coronavirus'], one per term if
+            combine_terms is false
+    """
+    if not config.getboolean('news_api', 'combine_terms', fallback=False):
+        return list(search_terms)
+    max_length = config.getint('news_api', 'max_query_length', fallback=500)
+    queries = []
+    query = ''
+    for term in search_terms:
+        if query and len(query) + len(' OR ') + len(term) > max_length:
+            queries.append(query)
+            query = ''
+        query = query + ' OR ' + term if query else term
+    if query:
+        queries.append(query)
+    return queries
+
+def get_daily_budget() -> int:
+    """ Returns the News API requests allowed a day, from config_file.ini """
+    return config.getint('news_api', 'daily_budget', fallback=100)
+
+def budget_day() -> str:
+    """ Returns the day requests are counted against, the budget resets at midnight UTC """
+    return time.strftime('%Y-%m-%d', time.gmtime())
+
+def get_budget_used() -> int:
+    """ Returns the News API requests made today """
+    return state.get_value('news_budget', budget_day(), 0)
+
+def reserve_request() -> bool:
+    """ Counts a request against today's budget.
+
+    Only the live backend is counted, the mock and replay backends are free.
+
+    Returns:
+        reserved: False if the budget is spent and the request must not be made
+    """
+    if data_sources.get_backend() != 'live':
+        return True
+    day = budget_day()
+    for counted_day, _ in state.get_items('news_budget'):
+        if counted_day != day: # forget earlier days
+            state.remove_item('news_budget', counted_day)
+    if state.get_value('news_budget', day, 0) >= get_daily_budget():
+        return False
+    return state.increment('news_budget', day) <= get_daily_budget()
+
+def spend_budget() -> None:
+    """ Marks today's budget as spent, after the api has answered rate limited """
+    state.set_value('news_budget', budget_day(), get_daily_budget())
+
+def backoff_delay(attempt: int) -> float:
+    """ Returns the wait before a retry, a random time up to an exponentially growing limit.
+
+    The randomness spreads out retries from several workers failing at once.
+
+    Arguments:
+        attempt: the number of the attempt that failed, from 0
+    """
+    limit = min(config.getfloat('news_api', 'backoff_cap', fallback=30),
+        config.getfloat('news_api', 'backoff_base', fallback=1) * 2 ** attempt)
+    return random.uniform(0, limit)
+
+def is_retryable(error: Exception) -> bool:
+    """ Returns True if a failed request may succeed if made again """
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, (requests.Timeout, requests.ConnectionError))
+
+def get_news(params: dict) -> dict:
+    """ Makes a News API request within the budget, retrying failures with backoff.
+
+    Every attempt and wait fits within the update pipeline's request timeout, so
+    the pipeline never gives up on a request that then succeeds and spends budget.
+
+    Arguments:
+        params: query parameters for the request
+
+    Returns:
+        news_return: the api response
+
+    Raises:
+        BudgetExhausted: if today's budget is spent or the api answered rate limited
+        requests.RequestException: if the request failed and could not be retried,
+            or failed on every attempt
+    """
+    max_retries = config.getint('news_api', 'max_retries', fallback=2)
+    timeout = config.getfloat('news_api', 'request_timeout', fallback=10)
+    deadline = time.monotonic() + get_request_timeout()
+    attempt = 0
+    while True:
+        if not reserve_request():
+            count('budget_exhausted')
+            raise BudgetExhausted('News API budget of ' + str(get_daily_budget())
+                + ' requests spent for today')
+        count('requests')
+        try:
+            news_return, _ = data_sources.get_json('news', params,
+                timeout=min(timeout, max(deadline - time.monotonic(), 0.1)))
+            return news_return
+        except requests.RequestException as error:
+            if isinstance(error, requests.HTTPError) and error.response is not None\
+                and error.response.status_code == 429:
+                count('rate_limited')
+                spend_budget()
+                raise BudgetExhausted('News API rate limit reached') from error
+            delay = backoff_delay(attempt)
+            # a retry needs at least a second for its request after the wait
+            if not is_retryable(error) or attempt >= max_retries\
+                or time.monotonic() + delay + 1 > deadline:
+                count('failures')
+                raise
+            logging.warning('Warning: News API request failed (%s), retrying in %.1f seconds',
+                error, delay)
+        count('retries')
+        time.sleep(delay)
+        attempt += 1
+
+def get_news_client_stats() -> dict:
+    """ Returns a copy of the client counters, with today's budget used and remaining """
+    with stats_lock:
+        stats = dict(client_stats)
+    stats['budget_used'] = get_budget_used()
+    stats['budget_remaining'] = max(get_daily_budget() - stats['budget_used'], 0)
+    return stats
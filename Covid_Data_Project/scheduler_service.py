@@ -0,0 +1,174 @@
+""" Module for running the dashboard's schedulers on a background thread
+for the covid data dashboard.
+The schedulers used by 'main', 'covid_data_handler' and 'covid_news_handling'
+are registered here and their due events are run by a single daemon thread,
+so scheduled updates never run inside a web request. Runners, such as the
+update registry, are polled by the same thread.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import collections
+import threading
+import time
+import logging
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+schedulers = {} # name -> sched.scheduler
+runners = {} # name -> function running due jobs, returning the delay until the next
+job_history = collections.deque(maxlen=50) # status of the most recently run jobs
+service_state = {'thread': None, 'jobs_run': 0, 'jobs_failed': 0, 'started': None}
+stop_event = threading.Event()
+wake_event = threading.Event()
+
+def register_scheduler(name: str, scheduler) -> None:
+    """ Adds a scheduler to the set run by the background thread.
+
+    Arguments:
+        name: identifier used for the scheduler in status reports
+        scheduler: a sched.scheduler instance
+    """
+    schedulers[name] = scheduler
+    logging.info('Scheduler %s registered with scheduler service', name)
+
+def register_runner(name: str, runner) -> None:
+    """ Adds a runner polled by the background thread.
+
+    Arguments:
+        name: identifier used for the runner in status reports
+        runner: function that runs its due jobs and returns the seconds until
+            its next job, or None if it has none
+    """
+    runners[name] = runner
+    logging.info('Runner %s registered with scheduler service', name)
+
+def run_due_jobs() -> float:
+    """ Runs every event that is due across the registered schedulers and runners.
+
+    Each event is removed from its queue before it is run so that a failing
+    job is logged and recorded rather than stopping the service.
+
+    Returns:
+        delay: seconds until the next queued event, None if all queues are empty
+    """
+    delay = None
+    for name, scheduler in list(schedulers.items()):
+        while True:
+            queue = scheduler.queue # sorted copy of the queue
+            if not queue:
+                break
+            event = queue[0]
+            now = scheduler.timefunc()
+            if event.time > now:
+                if delay is None or event.time - now < delay:
+                    delay = event.time - now
+                break
+            try:
+                scheduler.cancel(event)
+            except ValueError:
+                continue # already cancelled by another thread
+            run_job(name, event)
+    for name, runner in list(runners.items()):
+        try:
+            runner_delay = runner()
+        except Exception: # pylint: disable=broad-except
+            logging.exception('Runner %s failed', name)
+            continue
+        if runner_delay is not None and (delay is None or runner_delay < delay):
+            delay = runner_delay
+    return delay
+
+def run_job(scheduler_name: str, event) -> None:
+    """ Runs a single scheduled event and records the outcome.
+
+    Arguments:
+        scheduler_name: name of the scheduler the event came from
+        event: the sched.Event to run
+    """
+    job = {'scheduler': scheduler_name, 'action': event.action.__name__,
+        'argument': event.argument, 'started': time.time(), 'finished': None, 'status': 'running'}
+    job_history.append(job)
+    try:
+        event.action(*event.argument, **event.kwargs)
+        job['status'] = 'complete'
+        service_state['jobs_run'] += 1
+    except Exception: # pylint: disable=broad-except
+        # job failures must not stop the service thread
+        job['status'] = 'failed'
+        service_state['jobs_failed'] += 1
+        logging.exception('Scheduled job %s from %s failed', job['action'], scheduler_name)
+    job['finished'] = time.time()
+
+def scheduler_loop(poll_interval: float) -> None:
+    """ Body of the background thread. Runs due jobs until stop_event is set.
+
+    Arguments:
+        poll_interval: maximum time to wait before checking the queues again
+    """
+    while not stop_event.is_set():
+        delay = run_due_jobs()
+        if delay is None or delay > poll_interval:
+            delay = poll_interval
+        wake_event.wait(delay)
+        wake_event.clear()
+
+def start_scheduler_service(poll_interval: float = None) -> threading.Thread:
+    """ Starts the background scheduler thread if it is not already running.
+
+    Arguments:
+        poll_interval: maximum time the thread waits between checking the queues,
+            defaults to the value in config_file.ini
+
+    Returns:
+        thread: the running service thread
+    """
+    thread = service_state['thread']
+    if thread is not None and thread.is_alive():
+        return thread
+    if poll_interval is None:
+        poll_interval = config.getfloat('scheduler', 'poll_interval', fallback=1)
+    stop_event.clear()
+    thread = threading.Thread(target=scheduler_loop, args=(poll_interval,),
+        name='scheduler-service', daemon=True)
+    service_state['thread'] = thread
+    service_state['started'] = time.time()
+    thread.start()
+    logging.info('Scheduler service started')
+    return thread
+
+def wake_scheduler_service() -> None:
+    """ Wakes the service thread so newly entered events are picked up immediately """
+    wake_event.set()
+
+def stop_scheduler_service(timeout: float = 5) -> None:
+    """ Stops the background thread, waiting for a running job to finish.
+
+    Arguments:
+        timeout: maximum time to wait for the thread to finish
+    """
+    thread = service_state['thread']
+    stop_event.set()
+    wake_event.set()
+    if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+        thread.join(timeout)
+    service_state['thread'] = None
+    logging.info('Scheduler service stopped')
+
+def get_scheduler_status() -> dict:
+    """ Returns the state of the service, its queued events and recently run jobs """
+    thread = service_state['thread']
+    queued = []
+    for name, scheduler in list(schedulers.items()):
+        for event in scheduler.queue:
+            queued.append({'scheduler': name, 'action': event.action.__name__,
+                'argument': event.argument, 'due': event.time})
+    return {'running': thread is not None and thread.is_alive(),
+        'started': service_state['started'],
+        'jobs_run': service_state['jobs_run'],
+        'jobs_failed': service_state['jobs_failed'],
+        'queued': queued,
+        'runners': list(runners),
+        'history': list(job_history)}
@@ -0,0 +1,143 @@
+""" Module holding the dashboard's shared state for the covid data dashboard.
+Scheduled updates, removed news articles, cached metrics and page version
+counters are kept in a state backend with atomic operations. The 'memory'
+backend is for a single process, the 'sqlite' backend is shared by every
+worker process on the machine. The backend is chosen in config_file.ini.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import collections
+import json
+import sqlite3
+import threading
+import logging
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+class MemoryStateBackend:
+    """ State held in this process, each operation is atomic under a lock.
+
+    Values are stored as given, so callers should not mutate them after storing.
+    """
+
+    def __init__(self):
+        self.namespaces = collections.defaultdict(collections.OrderedDict)
+        self.lock = threading.Lock()
+
+    def add_item(self, namespace: str, key: str, value) -> bool:
+        """ Adds a value if the key is not already used, returns False if it is """
+        with self.lock:
+            if key in self.namespaces[namespace]:
+                return False
+            self.namespaces[namespace][key] = value
+            return True
+
+    def set_value(self, namespace: str, key: str, value) -> None:
+        """ Adds or replaces a value """
+        with self.lock:
+            self.namespaces[namespace][key] = value
+
+    def get_value(self, namespace: str, key: str, default = None):
+        """ Returns a value, or default if the key is not used """
+        with self.lock:
+            return self.namespaces[namespace].get(key, default)
+
+    def remove_item(self, namespace: str, key: str) -> bool:
+        """ Removes a value, returns False if the key was not used """
+        with self.lock:
+            return self.namespaces[namespace].pop(key, None) is not None
+
+    def get_items(self, namespace: str) -> list[tuple]:
+        """ Returns every (key, value) pair in a namespace, in the order they were added """
+        with self.lock:
+            return list(self.namespaces[namespace].items())
+
+    def increment(self, namespace: str, key: str) -> int:
+        """ Adds one to a counter and returns the new value """
+        with self.lock:
+            value = self.namespaces[namespace].get(key, 0) + 1
+            self.namespaces[namespace][key] = value
+            return value
+
+class SQLiteStateBackend:
+    """ State held in a SQLite database, shared by every process that opens it.
+
+    Values are stored as json, so tuples are returned as lists.
+    """
+
+    def __init__(self, database: str):
+        self.database = database
+        self.connections = threading.local() # one connection per thread
+        self.get_connection()
+
+    def get_connection(self) -> sqlite3.Connection:
+        """ Returns this thread's connection, creating the table if needed """
+        connection = getattr(self.connections, 'connection', None)
+        if connection is None:
+            # autocommit, so each statement is its own atomic transaction
+            connection = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''CREATE TABLE IF NOT EXISTS state (
+                position INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT, key TEXT, value TEXT, UNIQUE (namespace, key))''')
+            self.connections.connection = connection
+        return connection
+
+    def add_item(self, namespace: str, key: str, value) -> bool:
+        """ Adds a value if the key is not already used, returns False if it is """
+        cursor = self.get_connection().execute('''INSERT OR IGNORE INTO state
+            (namespace, key, value) VALUES (?, ?, ?)''', (namespace, key, json.dumps(value)))
+        return cursor.rowcount == 1
+
+    def set_value(self, namespace: str, key: str, value) -> None:
+        """ Adds or replaces a value """
+        self.get_connection().execute('''INSERT INTO state (namespace, key, value)
+            VALUES (?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value''',
+            (namespace, key, json.dumps(value)))
+
+    def get_value(self, namespace: str, key: str, default = None):
+        """ Returns a value, or default if the key is not used """
+        row = self.get_connection().execute('''SELECT value FROM state
+            WHERE namespace = ? AND key = ?''', (namespace, key)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def remove_item(self, namespace: str, key: str) -> bool:
+        """ Removes a value, returns False if the key was not used """
+        cursor = self.get_connection().execute('''DELETE FROM state
+            WHERE namespace = ? AND key = ?''', (namespace, key))
+        return cursor.rowcount == 1
+
+    def get_items(self, namespace: str) -> list[tuple]:
+        """ Returns every (key, value) pair in a namespace, in the order they were added """
+        rows = self.get_connection().execute('''SELECT key, value FROM state
+            WHERE namespace = ? ORDER BY position''', (namespace,)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def increment(self, namespace: str, key: str) -> int:
+        """ Adds one to a counter and returns the new value """
+        return int(self.get_connection().execute('''INSERT INTO state (namespace, key, value)
+            VALUES (?, ?, '1') ON CONFLICT (namespace, key) DO UPDATE SET value = value + 1
+            RETURNING value''', (namespace, key)).fetchone()[0])
+
+def create_state_backend(backend: str = None):
+    """ Creates the state backend named in config_file.ini.
+
+    Arguments:
+        backend: 'memory' or 'sqlite', overrides the value in config_file.ini
+    """
+    if backend is None:
+        backend = config.get('shared_state', 'backend', fallback='memory')
+    if backend == 'sqlite':
+        logging.info('Using sqlite shared state')
+        return SQLiteStateBackend(config.get('shared_state', 'database',
+            fallback='shared_state.db'))
+    if backend != 'memory':
+        logging.warning('Warning: Unknown state backend %s, using memory', backend)
+    return MemoryStateBackend()
+
+state = create_state_backend()
@@ -0,0 +1,46 @@
+import json
+import os
+import threading
+import pytest
+import atomic_files
+from atomic_files import write_json
+
+def test_write_json(tmp_path):
+    path = str(tmp_path / 'data.json')
+    file_status = write_json(path, {'version': 1})
+    assert os.stat(path).st_ino == file_status.st_ino
+    assert os.listdir(tmp_path) == ['data.json'] # no temporary file left
+    with open(path, 'r', encoding='UTF-8') as data_file:
+        assert json.load(data_file) == {'version': 1}
+
+def test_readers_never_see_partial_writes(tmp_path):
+    path = str(tmp_path / 'data.json')
+    write_json(path, list(range(20000)))
+    errors = []
+    done = threading.Event()
+    def read_repeatedly():
+        while not done.is_set():
+            try:
+                with open(path, 'r', encoding='UTF-8') as data_file:
+                    assert len(json.load(data_file)) == 20000
+            except Exception as error: # pylint: disable=broad-except
+                errors.append(error)
+    reader = threading.Thread(target=read_repeatedly)
+    reader.start()
+    for version in range(20):
+        write_json(path, [version] * 20000)
+    done.set()
+    reader.join()
+    assert errors == []
+
+def test_failed_write_keeps_old_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'data.json')
+    write_json(path, {'version': 1})
+    def failing_replace(source, destination):
+        raise OSError('disk full')
+    monkeypatch.setattr(atomic_files.os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        write_json(path, {'version': 2})
+    assert os.listdir(tmp_path) == ['data.json']
+    with open(path, 'r', encoding='UTF-8') as data_file:
+        assert json.load(data_file) == {'version': 1}
@@ -1,8 +1,18 @@
 from covid_data_handler import parse_csv_data
 from covid_data_handler import process_covid_csv_data
+from covid_data_handler import process_covid_csv_file
+from covid_data_handler import read_csv_batches
 from covid_data_handler import covid_API_request
 from covid_data_handler import schedule_covid_updates
 from covid_data_handler import process_covid_api_data
+from covid_data_handler import get_cache_stats
+from covid_data_handler import pending_areas
+from covid_data_handler import request_area
+from covid_data_handler import note_missing_area
+from covid_data_handler import is_missing_area
+from covid_data_handler import cache_lock
+from covid_data_store import upsert_records
+from covid_data_store import get_area_version
 
 def test_parse_csv_data():
     data = parse_csv_data('nation_2021-10-28.csv')
@@ -16,18 +26,68 @@ def test_process_covid_csv_data():
     assert current_hospital_cases == 7_019
     assert total_deaths == 141_544
 
-def test_covid_API_request():
+def test_covid_API_request(temporary_store):
     data = covid_API_request()
     assert isinstance(data, dict)
 
 def test_schedule_covid_updates():
     schedule_covid_updates(update_interval=10, update_name='update test')
 
-def test_process_covid_API_region_data():
+def test_process_covid_API_region_data(temporary_store):
     data = process_covid_api_data('region')
     assert isinstance(data, tuple)
 
-def test_process_covid_API_nation_data():
+def test_process_covid_API_nation_data(temporary_store):
     data = process_covid_api_data('nation')
     assert isinstance(data, tuple)
 
+
+def test_process_covid_API_data_cached(temporary_store):
+    first = process_covid_api_data('nation')
+    hits = get_cache_stats()['hits']
+    assert process_covid_api_data('nation') == first
+    assert get_cache_stats()['hits'] == hits + 1
+
+def test_process_covid_API_data_area(temporary_store):
+    upsert_records('region', 'Area Test', [{'date': '2021-12-' + str(day),
+        'newCasesBySpecimenDate': 1} for day in range(10, 30)])
+    assert process_covid_api_data('region', 'Area Test') == ('Area Test', 7)
+
+def test_process_covid_API_data_unknown_area(temporary_store):
+    assert process_covid_api_data('region', 'Unknown Area') == ('Unknown Area', None)
+    assert 'Unknown Area' in pending_areas['region']
+
+def test_process_covid_API_data_read_only(temporary_store):
+    assert process_covid_api_data('nation', 'Read Only', record=False) == \
+        ('Read Only', None, None, None)
+    assert 'Read Only' not in pending_areas['nation']
+    nation = process_covid_api_data('nation', record=False)[0]
+    assert get_area_version('nation', nation) is None
+
+def test_process_covid_csv_file():
+    assert process_covid_csv_file('nation_2021-10-28.csv') == \
+        process_covid_csv_data(parse_csv_data('nation_2021-10-28.csv'))
+
+def test_read_csv_batches():
+    batches = list(read_csv_batches('nation_2021-10-28.csv', batch_size=500))
+    assert [len(batch['date']) for batch in batches] == [500, 138]
+
+def test_request_area_missing(temporary_store):
+    note_missing_area('region', 'Missing Area')
+    process_covid_api_data('region', 'Missing Area')
+    assert 'Missing Area' not in pending_areas['region']
+    assert is_missing_area('region', 'Missing Area')
+    assert not is_missing_area('region', 'Unknown Area')
+
+def test_request_area_limit():
+    with cache_lock:
+        queued = {area_type: set(names) for area_type, names in pending_areas.items()}
+        pending_areas['nation'].update('Queued ' + str(number) for number in range(16))
+    try:
+        request_area('region', 'Over Limit Area')
+        assert 'Over Limit Area' not in pending_areas['region']
+    finally:
+        with cache_lock:
+            for area_type, names in queued.items():
+                pending_areas[area_type].clear()
+                pending_areas[area_type].update(names)
@@ -0,0 +1,30 @@
+import time
+from covid_data_store import upsert_records
+from covid_data_store import get_area_version
+from covid_data_store import read_recent_records
+from covid_data_store import latest_value
+from covid_data_store import mark_refreshed
+from covid_data_store import get_refreshed_time
+
+def test_upsert_records(temporary_store):
+    records = [{'date': '2021-12-01', 'newCasesBySpecimenDate': 5},
+        {'date': '2021-12-02', 'newCasesBySpecimenDate': None}]
+    upsert_records('region', 'Upsert Test', records)
+    version = get_area_version('region', 'Upsert Test')
+    assert upsert_records('region', 'Upsert Test', records) == 0
+    assert get_area_version('region', 'Upsert Test') == version
+    records[1]['newCasesBySpecimenDate'] = 7 # revised day
+    assert upsert_records('region', 'Upsert Test', records) == 1
+    assert get_area_version('region', 'Upsert Test') == version + 1
+
+def test_read_recent_records(temporary_store):
+    upsert_records('nation', 'Read Test', [{'date': '2021-12-0' + str(day),
+        'newCasesBySpecimenDate': day, 'hospitalCases': None if day > 2 else day}
+        for day in range(1, 6)])
+    records = read_recent_records('nation', 'Read Test', 2)
+    assert [record['date'] for record in records] == ['2021-12-05', '2021-12-04']
+    assert latest_value('nation', 'Read Test', 'hospitalCases') == 2
+
+def test_mark_refreshed(temporary_store):
+    mark_refreshed('region', 'Refresh Test Area')
+    assert time.time() - get_refreshed_time('region', 'Refresh Test Area') < 5
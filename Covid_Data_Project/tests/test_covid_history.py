@@ -0,0 +1,95 @@
+import numpy as np
+import covid_history
+import covid_data_handler
+from covid_metrics import series_from_records
+from covid_metrics import compute_metrics
+from covid_data_store import upsert_records
+from covid_history import build_index
+from covid_history import update_index
+from covid_history import get_history
+from covid_history import value_on
+from covid_history import cases_between
+from covid_history import weekly_change
+from covid_history import history_days
+from covid_history import get_history_stats
+
+def history_records(days):
+    return [{'date': str(np.datetime64('2021-10-01') + day), 'newCasesBySpecimenDate':
+        None if day % 30 == 4 else day, 'hospitalCases': None if day % 3 else day}
+        for day in range(days)][::-1]
+
+def test_build_index():
+    records = history_records(60)
+    index = build_index(series_from_records(records))
+    metrics = compute_metrics(series_from_records(records))
+    assert value_on(index, 'seven_day_cases') == metrics['seven_day_cases'][-1]
+    assert value_on(index, 'seven_day_cases', '2021-10-20') ==\
+        compute_metrics(series_from_records(records[-20:]))['seven_day_cases'][-1]
+    assert value_on(index, 'hospital_cases', '2021-10-05') == 3
+    assert value_on(index, 'seven_day_cases', '2021-09-01') is None
+    assert cases_between(index, '2021-10-02', '2021-10-04') == 1 + 2 + 3
+    assert weekly_change(index, 2)['previous_rate'] ==\
+        value_on(index, 'seven_day_cases', '2021-11-15')
+    assert [day['date'] for day in history_days(index, '2021-11-28')] ==\
+        ['2021-11-28', '2021-11-29']
+
+def test_update_index():
+    records = history_records(60)
+    index = build_index(series_from_records(records[20:]))
+    assert update_index(index, series_from_records(records[30:])) is index # nothing changed
+    records[35]['newCasesBySpecimenDate'] = 1000 # revised day
+    updated = update_index(index, series_from_records(records[:36]))
+    expected = build_index(series_from_records(records))
+    for name in ('seven_day_cases', 'case_totals', 'hospital_cases', 'deaths'):
+        assert np.allclose(updated[name], expected[name], equal_nan=True)
+    assert len(index['date']) == 40 # the old index is unchanged
+
+def test_get_history(temporary_store):
+    upsert_records('region', 'History Test', history_records(30))
+    index = get_history('region', 'History Test')
+    assert get_history('region', 'History Test') is index
+    upsert_records('region', 'History Test', history_records(31)[:1])
+    assert len(get_history('region', 'History Test')['date']) == 31
+    assert get_history('region', 'History Missing') is None
+
+def test_get_history_limit(temporary_store, monkeypatch):
+    monkeypatch.setitem(covid_history.config['covid_store'], 'cache_size', '2')
+    for number in range(3):
+        upsert_records('region', 'Limit Test ' + str(number), history_records(10))
+        get_history('region', 'Limit Test ' + str(number))
+    assert len(covid_history.history_indexes) == 2
+    assert ('region', 'Limit Test 0') not in covid_history.history_indexes
+
+def test_get_history_from_snapshot(temporary_store, tmp_path, monkeypatch):
+    folder = str(tmp_path / 'snapshot')
+    monkeypatch.setitem(covid_history.config['covid_store'], 'snapshot', folder)
+    monkeypatch.setitem(covid_data_handler.config['covid_store'], 'snapshot', folder)
+    upsert_records('region', 'Snapshot History', history_records(40))
+    covid_data_handler.snapshot_state['changed'] = True
+    covid_data_handler.write_covid_snapshot()
+    expected = build_index(series_from_records(history_records(40)))
+    reads = get_history_stats()['snapshot_reads']
+    index = get_history('region', 'Snapshot History')
+    assert get_history_stats()['snapshot_reads'] == reads + 1
+    for name in ('seven_day_cases', 'case_totals', 'hospital_cases', 'deaths'):
+        assert np.allclose(index[name], expected[name], equal_nan=True)
+    upsert_records('region', 'Snapshot History', history_records(41)[:1])
+    get_history('region', 'Snapshot History') # the snapshot is out of date, read the store
+    assert get_history_stats()['snapshot_reads'] == reads + 1
+    upsert_records('region', 'Snapshot Unchanged', history_records(10))
+    read_areas = []
+    read_area_records = covid_data_handler.covid_data_store.read_area_records
+    monkeypatch.setattr(covid_data_handler.covid_data_store, 'read_area_records',
+        lambda *area: read_areas.append(area) or read_area_records(*area))
+    covid_data_handler.snapshot_state['changed'] = True
+    covid_data_handler.write_covid_snapshot()
+    assert sorted(read_areas) == [('region', 'Snapshot History'), ('region', 'Snapshot Unchanged')]
+    read_areas.clear()
+    upsert_records('region', 'Snapshot History', history_records(42)[:1])
+    covid_data_handler.snapshot_state['changed'] = True
+    covid_data_handler.write_covid_snapshot() # only the changed area is read again
+    assert read_areas == [('region', 'Snapshot History')]
+    covid_history.history_indexes.clear()
+    assert len(get_history('region', 'Snapshot Unchanged')['date']) == 10
+    assert len(get_history('region', 'Snapshot History')['date']) == 42
+    assert get_history_stats()['snapshot_reads'] == reads + 3
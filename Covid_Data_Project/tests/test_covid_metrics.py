@@ -0,0 +1,19 @@
+import numpy as np
+from covid_metrics import series_from_records
+from covid_metrics import compute_metrics
+from covid_metrics import latest_metrics
+
+def test_compute_metrics():
+    records = [{'date': '2021-12-' + str(day), 'newCasesBySpecimenDate': day,
+        'hospitalCases': day if day < 18 else None} for day in range(10, 21)][::-1]
+    metrics = compute_metrics(series_from_records(records))
+    # most recent day skipped, then the 7 days 13th - 19th
+    assert metrics['seven_day_cases'][-1] == sum(range(13, 20))
+    assert metrics['hospital_cases'][-1] == 17
+    assert np.isnan(metrics['deaths'][-1])
+
+def test_latest_metrics_csv_rule():
+    records = [{'date': '2021-12-' + str(day), 'newCasesBySpecimenDate':
+        None if day == 16 else 1} for day in range(10, 21)][::-1]
+    # 20th and 19th skipped, empty 16th skipped within the 7
+    assert latest_metrics(series_from_records(records), 'csv') == (7, None, None)
@@ -0,0 +1,60 @@
+import os
+import threading
+import numpy as np
+import covid_snapshot
+from covid_snapshot import write_snapshot
+from covid_snapshot import load_snapshot
+from covid_snapshot import snapshot_series
+from covid_snapshot import series_records
+from covid_snapshot import convert_files
+from covid_snapshot import get_loaded_snapshot
+from covid_metrics import series_from_records
+from covid_metrics import latest_metrics
+from covid_data_handler import process_covid_csv_file
+
+def test_write_and_load_snapshot(tmp_path):
+    records = [{'date': '2021-12-0' + str(day), 'areaName': 'Snapshot Test',
+        'newCasesBySpecimenDate': None if day == 5 else day * 10,
+        'hospitalCases': day if day < 3 else None, 'cumDailyNsoDeathsByDeathDate': 100 + day}
+        for day in range(5, 0, -1)]
+    write_snapshot(str(tmp_path / 'snapshot'), {('nation', 'Snapshot Test'): records})
+    snapshot = load_snapshot(str(tmp_path / 'snapshot'))
+    assert isinstance(snapshot['columns']['date'], np.memmap)
+    series = snapshot_series(snapshot, 'nation', 'Snapshot Test')
+    expected = series_from_records(records)
+    for column, values in expected.items():
+        assert np.array_equal(series[column], values, equal_nan=column != 'date')
+    assert series_records(series, 'Snapshot Test') == records
+    assert snapshot_series(snapshot, 'region', 'Snapshot Test') is None
+
+def test_convert_files(tmp_path):
+    convert_files(str(tmp_path / 'snapshot'), {'region': ['region_covid_data.json'],
+        'nation': ['nation_2021-10-28.csv']})
+    snapshot = load_snapshot(str(tmp_path / 'snapshot'))
+    assert latest_metrics(snapshot_series(snapshot, 'nation', 'England'), 'csv')\
+        == process_covid_csv_file('nation_2021-10-28.csv')
+    assert snapshot_series(snapshot, 'region', 'Exeter') is not None
+
+def test_concurrent_snapshot_writes(tmp_path, monkeypatch):
+    folder = str(tmp_path / 'snapshot')
+    errors = []
+    def write(number):
+        try:
+            for day in range(1, 6):
+                write_snapshot(folder, {('nation', 'Writer ' + str(number)): [{'date':
+                    '2021-12-0' + str(day), 'newCasesBySpecimenDate': day}]})
+                assert get_loaded_snapshot(folder) is not None
+        except Exception as error: # pylint: disable=broad-except
+            errors.append(error)
+    writers = [threading.Thread(target=write, args=(number,)) for number in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    assert not errors
+    assert len(load_snapshot(folder)['areas']) == 1
+    monkeypatch.setattr(covid_snapshot, 'replaced_expiry', -1)
+    write_snapshot(folder, {('nation', 'Last Writer'): []})
+    assert sorted(os.listdir(folder)) == \
+        ['current', os.path.basename(covid_snapshot.current_folder(folder))]
+    assert list(get_loaded_snapshot(folder)['areas']) == [('nation', 'Last Writer')]
@@ -0,0 +1,37 @@
+import threading
+from dashboard_events import publish
+from dashboard_events import get_last_id
+from dashboard_events import events_since
+from dashboard_events import wait_for_events
+from dashboard_events import add_listener
+from dashboard_events import remove_listener
+from dashboard_events import format_event
+from dashboard_events import recent_events
+
+def test_events_since():
+    last_id = get_last_id()
+    event_id = publish('updates', {'fired': 'Events Test'})
+    assert event_id == last_id + 1
+    assert events_since(last_id) == [{'id': event_id, 'type': 'updates',
+        'data': {'fired': 'Events Test'}}]
+    assert events_since(event_id) == []
+    # from before a restart, or no longer buffered
+    assert events_since(event_id + 5)[0]['type'] == 'reload'
+    for _ in range(recent_events.maxlen):
+        publish('updates', {'fired': 'Events Test'})
+    assert events_since(last_id)[0]['type'] == 'reload'
+
+def test_wait_for_events():
+    last_id = get_last_id()
+    called = []
+    listener = lambda: called.append(True)
+    add_listener(listener)
+    threading.Timer(0.1, publish, ('news', {'added': [], 'removed': ['1']})).start()
+    assert wait_for_events(last_id, 5)[0]['data'] == {'added': [], 'removed': ['1']}
+    remove_listener(listener)
+    assert called == [True]
+    assert wait_for_events(get_last_id(), 0.01) == []
+
+def test_format_event():
+    assert format_event({'id': 3, 'type': 'metrics', 'data': {'deaths': 5}}) ==\
+        b'id: 3\nevent: metrics\ndata: {"deaths":5}\n\n'
@@ -0,0 +1,24 @@
+from dashboard_metrics import timed
+from dashboard_metrics import increment
+from dashboard_metrics import get_histogram
+from dashboard_metrics import render_metrics
+
+@timed
+def timed_test_function():
+    return 'result'
+
+def test_timed():
+    assert timed_test_function() == 'result'
+    histogram = get_histogram('timed_test_function')
+    assert histogram['count'] == 1
+    assert sum(histogram['buckets']) == 1
+
+def test_render_metrics():
+    timed_test_function()
+    increment('test_hits', 2)
+    text = render_metrics({'test_gauge': 1.5, 'test_unknown': None})
+    assert ('dashboard_function_duration_seconds_bucket'
+            '{function="timed_test_function",le="+Inf"}') in text
+    assert 'dashboard_test_hits_total 2' in text
+    assert 'dashboard_test_gauge 1.5' in text
+    assert 'test_unknown' not in text
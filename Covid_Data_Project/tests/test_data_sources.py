@@ -0,0 +1,28 @@
+import data_sources
+from data_sources import get_json
+
+def set_data_source(**options):
+    previous = dict(data_sources.config['data_source'])
+    data_sources.config['data_source'].update(options)
+    return previous
+
+def test_mock_backend():
+    previous = set_data_source(backend='mock', record='false')
+    try:
+        news_return, modified = get_json('news', {'q': 'Covid', 'pageSize': 5}, timeout=5)
+        assert news_return['status'] == 'ok' and len(news_return['articles']) == 5
+        assert modified
+    finally:
+        data_sources.config['data_source'] = previous
+
+def test_record_and_replay(tmp_path):
+    params = {'q': 'coronavirus', 'pageSize': 3, 'apiKey': 'secret'}
+    previous = set_data_source(backend='mock', record='true', fixture_folder=str(tmp_path))
+    try:
+        recorded, _ = get_json('news', params, timeout=5)
+        data_sources.config['data_source']['backend'] = 'replay'
+        replayed, modified = get_json('news', dict(params, apiKey='another key'))
+        assert replayed == recorded and modified
+        assert get_json('news', params) == (recorded, False)
+    finally:
+        data_sources.config['data_source'] = previous
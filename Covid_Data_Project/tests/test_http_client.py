@@ -0,0 +1,47 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import http_client
+from http_client import get_json
+from http_client import cache_response
+from http_client import get_client_stats
+
+class ETagHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = b'{"data": [1, 2, 3]}'
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_get_json_conditional():
+    server = HTTPServer(('127.0.0.1', 0), ETagHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:' + str(server.server_port) + '/data'
+    try:
+        data, modified = get_json(url, {'q': 'test'}, timeout=5)
+        assert data == {'data': [1, 2, 3]} and modified
+        not_modified = get_client_stats()['not_modified']
+        cached_data, modified = get_json(url, {'q': 'test'}, timeout=5)
+        assert cached_data is data and not modified
+        assert get_client_stats()['not_modified'] == not_modified + 1
+    finally:
+        server.shutdown()
+
+def test_cache_response_limit(monkeypatch):
+    monkeypatch.setitem(http_client.config['http_client'], 'cache_bytes', '100')
+    evictions = get_client_stats()['cache_evictions']
+    for number in range(3):
+        cache_response('limit-test-' + str(number), {'etag': '"v1"', 'last_modified': None,
+            'data': {}, 'size': 40, 'elapsed': 0})
+    assert 'limit-test-0' not in http_client.response_cache
+    assert 'limit-test-2' in http_client.response_cache
+    assert get_client_stats()['cache_evictions'] > evictions
+    assert get_client_stats()['cached_bytes'] <= 100
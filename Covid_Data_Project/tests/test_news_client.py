@@ -0,0 +1,64 @@
+import pytest
+import requests
+import news_client
+from news_client import build_queries
+from news_client import reserve_request
+from news_client import get_news
+from news_client import get_news_client_stats
+from news_client import BudgetExhausted
+from shared_state import state
+
+def test_build_queries(monkeypatch):
+    monkeypatch.setitem(news_client.config['news_api'], 'combine_terms', 'false')
+    assert build_queries(['Covid', 'COVID-19']) == ['Covid', 'COVID-19']
+    monkeypatch.setitem(news_client.config['news_api'], 'combine_terms', 'true')
+    assert build_queries(['Covid', 'COVID-19', 'coronavirus']) ==\
+        ['Covid OR COVID-19 OR coronavirus']
+    assert build_queries(['term' + str(number) for number in range(200)])[0].count(' OR ') < 199
+
+def test_reserve_request(monkeypatch):
+    monkeypatch.setattr(news_client.data_sources, 'get_backend', lambda: 'live')
+    state.set_value('news_budget', news_client.budget_day(), news_client.get_daily_budget() - 1)
+    assert reserve_request()
+    assert not reserve_request()
+    state.set_value('news_budget', news_client.budget_day(), 0)
+
+def test_get_news_retries(monkeypatch):
+    calls = []
+    def flaky_get_json(source, params, timeout=None):
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise requests.Timeout('timed out')
+        return {'status': 'ok', 'articles': []}, True
+    monkeypatch.setattr(news_client.data_sources, 'get_json', flaky_get_json)
+    monkeypatch.setattr(news_client, 'backoff_delay', lambda attempt: 0)
+    retries = get_news_client_stats()['retries']
+    assert get_news({'q': 'Covid'}) == {'status': 'ok', 'articles': []}
+    assert len(calls) == 3 and calls[0] is not None
+    assert get_news_client_stats()['retries'] == retries + 2
+
+def test_get_news_deadline(monkeypatch):
+    calls = []
+    def slow_get_json(source, params, timeout=None):
+        calls.append(timeout)
+        raise requests.Timeout('timed out')
+    monkeypatch.setattr(news_client.data_sources, 'get_json', slow_get_json)
+    monkeypatch.setattr(news_client, 'backoff_delay', lambda attempt: 2)
+    monkeypatch.setattr(news_client, 'get_request_timeout', lambda: 2.5)
+    with pytest.raises(requests.Timeout): # no time left to wait and retry
+        get_news({'q': 'Covid'})
+    assert len(calls) == 1 and calls[0] <= 2.5
+
+def test_get_news_rate_limited(monkeypatch):
+    def rate_limited_get_json(source, params, timeout=None):
+        response = requests.Response()
+        response.status_code = 429
+        raise requests.HTTPError('429 Too Many Requests', response=response)
+    monkeypatch.setattr(news_client.data_sources, 'get_json', rate_limited_get_json)
+    monkeypatch.setattr(news_client.data_sources, 'get_backend', lambda: 'live')
+    with pytest.raises(BudgetExhausted):
+        get_news({'q': 'Covid'})
+    assert get_news_client_stats()['budget_remaining'] == 0
+    with pytest.raises(BudgetExhausted): # no request is made once the budget is spent
+        get_news({'q': 'Covid'})
+    state.set_value('news_budget', news_client.budget_day(), 0)
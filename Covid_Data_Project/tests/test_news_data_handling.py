@@ -1,6 +1,14 @@
 from covid_news_handling import news_API_request
 from covid_news_handling import update_news
 from covid_news_handling import create_filtered_list
+from covid_news_handling import merge_articles
+from covid_news_handling import remove_article
+from covid_news_handling import available_article_count
+from covid_news_handling import refill_news_backlog
+from covid_news_handling import news_sched
+from covid_news_handling import news_state
+from covid_news_handling import load_news_articles
+from covid_news_handling import cached_news_return
 
 def test_news_API_request():
     assert news_API_request()
@@ -15,3 +23,33 @@ def test_create_filtered_list():
     assert isinstance(data, list)
     assert data != []
 
+
+def test_merge_articles():
+    first = {'articles': [{'url': 'a', 'title': 'A'}, {'url': 'b', 'title': 'B'}]}
+    second = {'articles': [{'url': 'b', 'title': 'B'}, {'url': 'c', 'title': 'C'}]}
+    assert [article['url'] for article in merge_articles([first, second])] == ['a', 'b', 'c']
+
+def test_remove_article():
+    article = create_filtered_list()[0]
+    remove_article(article['id'])
+    assert article not in create_filtered_list()
+
+def test_news_backlog_refill_scheduled():
+    for article in create_filtered_list():
+        remove_article(article['id'])
+    while available_article_count() >= 8:
+        remove_article(create_filtered_list()[0]['id'])
+    assert news_state['refill_pending']
+    assert any(event.action is refill_news_backlog for event in news_sched.queue)
+
+def test_load_news_articles_keeps_version():
+    store = load_news_articles()
+    assert load_news_articles() is store # unchanged file, same immutable version
+    assert all(article['id'] in store['articles'] for article in create_filtered_list())
+
+def test_cached_news_return_from_store():
+    store = load_news_articles()
+    cached = cached_news_return()
+    assert cached['cached']
+    assert [article['url'] for article in cached['articles']] == \
+        [article['url'] for article in store['articles'].values()]
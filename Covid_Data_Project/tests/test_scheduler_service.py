@@ -0,0 +1,24 @@
+import sched
+import time
+from scheduler_service import register_scheduler
+from scheduler_service import run_due_jobs
+from scheduler_service import get_scheduler_status
+
+def test_run_due_jobs():
+    test_sched = sched.scheduler(time.time, time.sleep)
+    register_scheduler('test', test_sched)
+    results = []
+    test_sched.enter(0, 1, results.append, ('due',))
+    test_sched.enter(60, 1, results.append, ('not due',))
+    delay = run_due_jobs()
+    assert results == ['due']
+    assert 0 < delay <= 60
+
+def test_get_scheduler_status():
+    test_sched = sched.scheduler(time.time, time.sleep)
+    register_scheduler('status test', test_sched)
+    test_sched.enter(0, 1, print, ('status test',))
+    run_due_jobs()
+    status = get_scheduler_status()
+    assert isinstance(status['queued'], list)
+    assert status['history'][-1]['status'] == 'complete'
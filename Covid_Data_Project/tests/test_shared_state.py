@@ -0,0 +1,26 @@
+import os
+import tempfile
+from shared_state import MemoryStateBackend
+from shared_state import SQLiteStateBackend
+
+def check_backend(backend):
+    assert backend.add_item('updates', 'first', {'title': 'first'})
+    assert not backend.add_item('updates', 'first', {'title': 'again'})
+    backend.add_item('updates', 'second', {'title': 'second'})
+    assert backend.get_items('updates') == [('first', {'title': 'first'}),
+        ('second', {'title': 'second'})]
+    assert backend.remove_item('updates', 'first')
+    assert not backend.remove_item('updates', 'first')
+    assert backend.get_value('updates', 'first') is None
+    assert backend.increment('versions', 'updates') == 1
+    assert backend.increment('versions', 'updates') == 2
+
+def test_memory_state_backend():
+    check_backend(MemoryStateBackend())
+
+def test_sqlite_state_backend():
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'state.db')
+        check_backend(SQLiteStateBackend(database))
+        # a second connection, as another worker would have, sees the same state
+        assert SQLiteStateBackend(database).get_value('versions', 'updates') == 2
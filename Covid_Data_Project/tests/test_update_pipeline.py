@@ -0,0 +1,44 @@
+import time
+from update_pipeline import run_concurrently
+from update_pipeline import run_single_flight
+from update_pipeline import get_refresh_stats
+from update_pipeline import add_refresh_callback
+
+def failing_task():
+    raise ValueError('upstream down')
+
+def test_run_concurrently():
+    start = time.time()
+    results, failures = run_concurrently({'a': lambda: time.sleep(0.2) or 'a',
+        'b': lambda: time.sleep(0.2) or 'b', 'c': failing_task})
+    assert time.time() - start < 0.4
+    assert results == {'a': 'a', 'b': 'b'}
+    assert isinstance(failures['c'], ValueError)
+
+def test_run_concurrently_timeout():
+    results, failures = run_concurrently({'slow': lambda: time.sleep(0.5)}, timeout=0.05)
+    assert results == {}
+    assert isinstance(failures['slow'], TimeoutError)
+
+def test_run_single_flight():
+    calls = []
+    def refresh():
+        calls.append(time.time())
+        time.sleep(0.2)
+        return len(calls)
+    results, failures = run_concurrently({'first': lambda: run_single_flight('test', refresh),
+        'second': lambda: run_single_flight('test', refresh)})
+    assert failures == {}
+    assert results == {'first': 1, 'second': 1}
+    assert len(calls) == 1
+    assert get_refresh_stats()['test'] == {'fetches': 1, 'joined': 1, 'skipped': 0}
+
+def test_add_refresh_callback():
+    called = []
+    assert add_refresh_callback('callback test', lambda: called.append('done')) is False
+    results, _ = run_concurrently({
+        'refresh': lambda: run_single_flight('callback test', lambda: time.sleep(0.2)),
+        'wait': lambda: time.sleep(0.05) or add_refresh_callback('callback test',
+            lambda: called.append('done'))})
+    assert results['wait'] is True
+    assert called == ['done']
@@ -0,0 +1,58 @@
+import time
+import update_registry
+from update_registry import add_update
+from update_registry import cancel_update
+from update_registry import run_due_updates
+from update_registry import get_update
+from shared_state import state
+
+def test_run_due_updates():
+    results = []
+    completed = []
+    add_update('registry test', -1, {'news': results.append}, on_complete=completed.append)
+    add_update('registry test', -1, {'data': results.append})
+    add_update('registry not due', 60, {'news': results.append})
+    delay = run_due_updates()
+    assert results == ['registry test', 'registry test']
+    assert completed == ['registry test']
+    assert get_update('registry test') is None
+    assert 0 < delay <= 60
+    assert cancel_update('registry not due')
+
+def test_repeating_update():
+    results = []
+    add_update('registry repeat', -1, {'news': results.append}, repeat_interval=100)
+    run_due_updates()
+    assert results == ['registry repeat']
+    assert get_update('registry repeat')['repeat_interval'] == 100
+    assert cancel_update('registry repeat')
+
+def test_cancel_update():
+    results = []
+    add_update('registry cancel', -1, {'news': results.append, 'data': results.append})
+    assert add_update('registry cancel', 60) is False # name is already used
+    assert cancel_update('registry cancel', 'news')
+    assert get_update('registry cancel')['actions'] == ['data']
+    assert cancel_update('registry cancel', 'data')
+    assert get_update('registry cancel') is None
+    run_due_updates()
+    assert results == []
+
+def test_cancelled_by_another_worker():
+    results = []
+    add_update('registry shared', -1, {'news': results.append, 'data': results.append},
+        repeat_interval=100)
+    # another worker records a cancellation, this worker's registry still holds the update
+    state.set_value('cancelled_updates', 'registry shared/news', time.time())
+    run_due_updates()
+    assert results == ['registry shared'] # only the data action ran
+    assert get_update('registry shared')['actions'] == ['data']
+    state.set_value('cancelled_updates', 'registry shared/', time.time())
+    update_registry.updates['registry shared']['due'] = time.time() - 1
+    update_registry.push_update(update_registry.updates['registry shared'])
+    run_due_updates()
+    assert results == ['registry shared']
+    assert get_update('registry shared') is None
+    add_update('registry shared', -1, {'news': results.append}) # the name can be used again
+    run_due_updates()
+    assert results == ['registry shared', 'registry shared']
@@ -0,0 +1,149 @@
+""" Module for running upstream requests concurrently for the covid data dashboard.
+Region data, nation data and each news search term are fetched in parallel
+using a bounded thread pool so a refresh takes as long as the slowest call.
+Refreshes of the same source are single-flight: overlapping updates join the
+refresh already running, and a refresh within the source's minimum interval
+of the last one is skipped.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import configparser
+import concurrent.futures
+import threading
+import time
+import logging
+
+config = configparser.ConfigParser()
+config.read('config_file.ini')
+
+refresh_flights = {} # source -> the running refresh, if any
+refresh_sources = {} # source -> time and result of the last successful refresh
+refresh_stats = {} # source -> counts of refreshes run, joined and skipped
+refresh_lock = threading.Lock()
+
+def get_request_timeout() -> float:
+    """ Returns the per request timeout in seconds from config_file.ini """
+    return config.getfloat('update_pipeline', 'request_timeout', fallback=30)
+
+def run_concurrently(tasks: dict, timeout: float = None) -> tuple[dict, dict]:
+    """ Runs each task on a bounded thread pool and waits for them to finish.
+
+    A task that raises or does not finish within the timeout is logged and
+    reported as failed, the remaining results are still returned. As tasks only
+    write their data files once they succeed, a failure keeps the last good data.
+
+    Arguments:
+        tasks: dictionary of task name -> function taking no arguments
+        timeout: seconds to wait for the tasks, defaults to the request timeout
+
+    Returns:
+        results: dictionary of task name -> return value for tasks that succeeded
+        failures: dictionary of task name -> exception (or TimeoutError) for those that did not
+    """
+    results = {}
+    failures = {}
+    if not tasks:
+        return results, failures
+    if timeout is None:
+        timeout = get_request_timeout()
+    max_workers = min(len(tasks), config.getint('update_pipeline', 'max_workers', fallback=4))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+        thread_name_prefix='update-pipeline')
+    futures = {executor.submit(task): name for name, task in tasks.items()}
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as error: # pylint: disable=broad-except
+            failures[name] = error
+            logging.warning('Warning: Update task %s failed, keeping last data: %s', name, error)
+    for future in not_done:
+        name = futures[future]
+        future.cancel()
+        failures[name] = TimeoutError('Task did not finish within ' + str(timeout) + ' seconds')
+        logging.warning('Warning: Update task %s timed out, keeping last data', name)
+    # do not wait for timed out tasks, their threads finish in the background
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results, failures
+
+def get_min_refresh_interval(source: str) -> float:
+    """ Returns the minimum seconds between refreshes of a source from config_file.ini """
+    return config.getfloat('update_pipeline', source + '_min_interval', fallback=0)
+
+def run_single_flight(source: str, task):
+    """ Runs a refresh of a source unless one is running or has just finished.
+
+    A caller arriving while a refresh of the same source is running waits for
+    it and gets its result (or exception). A caller arriving within the minimum
+    refresh interval of the last successful refresh gets that refresh's result.
+
+    Arguments:
+        source: name of the data refreshed, e.g. 'news' or 'covid_data'
+        task: function taking no arguments that refreshes the source
+
+    Returns:
+        result: the return value of the refresh run, joined or reused
+    """
+    with refresh_lock:
+        stats = refresh_stats.setdefault(source, {'fetches': 0, 'joined': 0, 'skipped': 0})
+        flight = refresh_flights.get(source)
+        joined = flight is not None
+        if joined:
+            stats['joined'] += 1
+        else:
+            last = refresh_sources.get(source)
+            if last is not None and time.time() - last['time'] < get_min_refresh_interval(source):
+                stats['skipped'] += 1
+                logging.info('Refresh of %s skipped, last refresh is recent', source)
+                return last['result']
+            flight = {'done': threading.Event(), 'result': None, 'error': None,
+                'callbacks': []}
+            refresh_flights[source] = flight
+            stats['fetches'] += 1
+    if joined:
+        logging.info('Refresh of %s already running, waiting for it', source)
+        flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return flight['result']
+    try:
+        flight['result'] = task()
+    except Exception as error:
+        flight['error'] = error
+        raise
+    finally:
+        with refresh_lock:
+            if flight['error'] is None:
+                refresh_sources[source] = {'time': time.time(), 'result': flight['result']}
+            del refresh_flights[source]
+        flight['done'].set()
+        for callback in flight['callbacks']:
+            callback()
+    return flight['result']
+
+def add_refresh_callback(source: str, callback) -> bool:
+    """ Calls callback, with no arguments, when the running refresh of a source finishes.
+
+    Lets a caller wait for a refresh without holding a thread, e.g. from asyncio.
+    The callback is called on the refreshing thread, so it should return quickly.
+
+    Arguments:
+        source: name of the data refreshed, e.g. 'news' or 'covid_data'
+        callback: function taking no arguments
+
+    Returns:
+        added: False if no refresh of the source is running
+    """
+    with refresh_lock:
+        flight = refresh_flights.get(source)
+        if flight is None:
+            return False
+        flight['callbacks'].append(callback)
+        return True
+
+def get_refresh_stats() -> dict:
+    """ Returns a copy of the refreshes run, joined and skipped for each source """
+    with refresh_lock:
+        return {source: dict(stats) for source, stats in refresh_stats.items()}
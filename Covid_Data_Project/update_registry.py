@@ -0,0 +1,227 @@
+""" Module for the registry of scheduled updates for the covid data dashboard.
+Updates are keyed by name and held in a heap ordered by due time, so adding,
+cancelling and running updates is O(log n) however many are scheduled. Each
+update can refresh news, covid data or both, and repeats are rescheduled
+from their previous due time. The registry is held by the worker that added
+the update, so cancellations are also recorded in the shared state, and a due
+update cancelled by another worker is dropped rather than run.
+Part of the 2021 Assessement for ECM1400 at University of Exeter
+© 2021 - James Cracknell https://github.com/JamesCracknell
+"""
+
+import heapq
+import threading
+import time
+import logging
+import dashboard_events
+from shared_state import state
+
+updates = {} # update name -> scheduled update
+update_heap = [] # (due time, entry id, update name), may hold cancelled entries
+registry_lock = threading.Lock()
+registry_state = {'next_entry_id': 0, 'cancelled_entries': 0, 'updates_run': 0,
+    'cancellations_pruned': 0}
+# updates are due within a day and repeat daily, so a cancellation recorded in the
+# shared state has been seen by the worker holding the update by the time it expires
+cancelled_expiry = 172800
+
+def push_update(update: dict) -> None:
+    """ Adds an update's next due time to the heap. registry_lock must be held. """
+    update['entry_id'] = registry_state['next_entry_id']
+    registry_state['next_entry_id'] += 1
+    heapq.heappush(update_heap, (update['due'], update['entry_id'], update['name']))
+
+def add_update(update_name: str, update_interval: float, actions: dict = None,
+    repeat_interval: float = None, on_complete = None) -> bool:
+    """ Schedules an update, or adds actions to an update already due at the same time.
+
+    Arguments:
+        update_name: the name of the update, specified by user, used as an identifier
+        update_interval: the time in seconds until the update is due
+        actions: dictionary of action name (e.g. 'news') -> function called with the update name
+        repeat_interval: if given the update repeats this many seconds after each run
+        on_complete: function called with the update name once a non repeating update has run
+
+    Returns:
+        added: False if an update with the same name is due at a different time
+    """
+    due = time.time() + update_interval
+    with registry_lock:
+        update = updates.get(update_name)
+        if update is not None:
+            if abs(update['due'] - due) > 1:
+                logging.warning('Warning: Update %s is already scheduled', update_name)
+                return False
+            update['actions'].update(actions or {})
+            if repeat_interval is not None:
+                update['repeat_interval'] = repeat_interval
+            if on_complete is not None:
+                update['on_complete'] = on_complete
+            return True
+        update = {'name': update_name, 'due': due, 'actions': dict(actions or {}),
+            'repeat_interval': repeat_interval, 'on_complete': on_complete,
+            'created': time.time()}
+        updates[update_name] = update
+        push_update(update)
+    logging.info('Update %s added to registry', update_name)
+    return True
+
+def cancel_update(update_name: str, action: str = None) -> bool:
+    """ Cancels an update, or one of its actions.
+
+    The cancellation is recorded in the shared state, so the update is not run
+    if it is held by another worker's registry (see run_due_updates).
+
+    Arguments:
+        update_name: the name of the update
+        action: if given only this action is cancelled, the update is cancelled
+            once it has no actions left
+
+    Returns:
+        cancelled: False if there was nothing to cancel in this worker
+    """
+    record_cancellation(update_name, action)
+    return remove_update(update_name, action)
+
+def record_cancellation(update_name: str, action: str = None) -> None:
+    """ Records the time an update, or one of its actions, was cancelled in the shared state
+
+    Cancellations older than cancelled_expiry are removed, at most once an hour.
+    """
+    now = time.time()
+    if now - registry_state['cancellations_pruned'] > 3600:
+        registry_state['cancellations_pruned'] = now
+        for key, cancelled in state.get_items('cancelled_updates'):
+            if now - cancelled > cancelled_expiry:
+                state.remove_item('cancelled_updates', key)
+    state.set_value('cancelled_updates', update_name + '/' + (action or ''), now)
+
+def get_cancelled_actions(update: dict) -> set:
+    """ Returns the actions of an update cancelled by any worker since it was added,
+    every action if the whole update was cancelled
+    """
+    cancelled = set()
+    for action in [''] + list(update['actions']):
+        cancelled_time = state.get_value('cancelled_updates', update['name'] + '/' + action)
+        if cancelled_time is not None and cancelled_time >= update['created']:
+            if not action:
+                return set(update['actions'])
+            cancelled.add(action)
+    return cancelled
+
+def remove_update(update_name: str, action: str = None) -> bool:
+    """ Removes an update, or one of its actions, from this worker's registry.
+
+    The heap entry is left in place and skipped when it reaches the top, the heap
+    is rebuilt once more than half of it is cancelled entries.
+
+    Arguments:
+        update_name: the name of the update
+        action: if given only this action is removed, the update is removed
+            once it has no actions left
+
+    Returns:
+        removed: False if there was nothing to remove
+    """
+    with registry_lock:
+        update = updates.get(update_name)
+        if update is None:
+            return False
+        if action is not None:
+            if update['actions'].pop(action, None) is None:
+                return False
+            if update['actions']:
+                return True
+        del updates[update_name]
+        registry_state['cancelled_entries'] += 1
+        if registry_state['cancelled_entries'] > len(update_heap) // 2:
+            update_heap[:] = [(update['due'], update['entry_id'], name)
+                for name, update in updates.items()]
+            heapq.heapify(update_heap)
+            registry_state['cancelled_entries'] = 0
+    logging.info('Update %s cancelled', update_name)
+    return True
+
+def drop_cancelled_actions(update: dict, actions: dict) -> dict:
+    """ Returns the actions of a due update that have not been cancelled by another
+    worker, and removes the cancelled actions from the registry
+    """
+    cancelled = get_cancelled_actions(update)
+    for action in cancelled:
+        if update['repeat_interval']: # a repeat is still in the registry
+            remove_update(update['name'], action)
+        logging.info('Action %s of update %s was cancelled by another worker',
+            action, update['name'])
+    return {name: action for name, action in actions.items() if name not in cancelled}
+
+def is_current(entry: tuple) -> bool:
+    """ Returns False if a heap entry belongs to a cancelled or rescheduled update """
+    update = updates.get(entry[2])
+    return update is not None and update['entry_id'] == entry[1]
+
+def run_due_updates() -> float:
+    """ Runs every update that is due. Registered with the scheduler service.
+
+    Returns:
+        delay: seconds until the next update is due, None if none are scheduled
+    """
+    now = time.time()
+    due_updates = []
+    with registry_lock:
+        while update_heap and update_heap[0][0] <= now:
+            entry = heapq.heappop(update_heap)
+            if not is_current(entry):
+                registry_state['cancelled_entries'] = max(
+                    registry_state['cancelled_entries'] - 1, 0)
+                continue
+            update = updates[entry[2]]
+            due_updates.append((update, dict(update['actions'])))
+            if update['repeat_interval']:
+                while update['due'] <= now: # skip any runs missed while stopped
+                    update['due'] += update['repeat_interval']
+                push_update(update)
+            else:
+                del updates[update['name']]
+        while update_heap and not is_current(update_heap[0]):
+            heapq.heappop(update_heap)
+            registry_state['cancelled_entries'] = max(registry_state['cancelled_entries'] - 1, 0)
+        delay = update_heap[0][0] - now if update_heap else None
+    for update, actions in due_updates:
+        actions = drop_cancelled_actions(update, actions)
+        if actions:
+            run_update(update, actions)
+    return delay
+
+def run_update(update: dict, actions: dict) -> None:
+    """ Calls each action of an update, then on_complete if it does not repeat.
+
+    Arguments:
+        update: the scheduled update
+        actions: the actions to call, copied when the update became due
+    """
+    logging.info('Update %s running', update['name'])
+    registry_state['updates_run'] += 1
+    for action_name, action in actions.items():
+        try:
+            action(update['name'])
+        except Exception: # pylint: disable=broad-except
+            # one failing action must not stop the others
+            logging.exception('Action %s of update %s failed', action_name, update['name'])
+    dashboard_events.publish('updates', {'fired': update['name']})
+    if not update['repeat_interval'] and update['on_complete'] is not None:
+        update['on_complete'](update['name'])
+
+def get_update(update_name: str) -> dict:
+    """ Returns a copy of a scheduled update, None if there is no update with the name """
+    with registry_lock:
+        update = updates.get(update_name)
+        if update is None:
+            return None
+        return {'name': update['name'], 'due': update['due'], 'actions': list(update['actions']),
+            'repeat_interval': update['repeat_interval']}
+
+def get_registry_status() -> dict:
+    """ Returns the number of scheduled updates, heap entries and updates run """
+    with registry_lock:
+        return {'scheduled': len(updates), 'heap_entries': len(update_heap),
+            'updates_run': registry_state['updates_run']}